@@ -0,0 +1,164 @@
+"""
+Measures the latency of the read endpoints under concurrent clients, together with the event loop lag.
+
+The event loop lag is how late a 10 ms sleep wakes up while the requests are being served. Blocking database
+calls on the event loop show up there directly, because nothing else can run while they wait for the database.
+
+Runs against a temporary SQLite file by default, set DATABASE_URL to benchmark a real PostgreSQL instance
+(the tables are created and dropped by the script, so use an empty database).
+
+Usage: python -m scripts.bench_latency [clients] [requests_per_client]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_latency.db"),
+)
+os.environ.setdefault("TOKEN_SECRET", "benchmark")
+os.environ.setdefault("JWT_SECRET", "benchmark")
+os.environ.setdefault("TEST_ENV", "1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx  # noqa: E402
+
+from src import db  # noqa: E402
+from src.main import app  # noqa: E402
+from src.orm_models import Base, Fetch, Offer, OfferSummary, Product, offer_fetch  # noqa: E402
+
+PRODUCTS = 200
+FETCHES_PER_PRODUCT = 50
+OFFERS_PER_PRODUCT = 10
+
+
+def seed() -> list[uuid.UUID]:
+    Base.metadata.drop_all(db.engine)
+    Base.metadata.create_all(db.engine)
+
+    product_ids = [uuid.uuid4() for _ in range(PRODUCTS)]
+    products, offers, fetches, links, summaries = [], [], [], [], []
+    for product_id in product_ids:
+        products.append({"id": product_id, "name": "bench", "description": "bench"})
+        offer_ids = [uuid.uuid4() for _ in range(OFFERS_PER_PRODUCT)]
+        offers += [
+            {"id": offer_id, "price": 100 + i, "items_in_stock": i, "product_id": product_id}
+            for i, offer_id in enumerate(offer_ids)
+        ]
+        for i in range(FETCHES_PER_PRODUCT):
+            fetch_id = uuid.uuid4()
+            # summaries are precomputed, so that reading the price history does not write to the database
+            summary_id = uuid.uuid4()
+            summaries.append(
+                {
+                    "id": summary_id,
+                    "min_price": 100,
+                    "max_price": 100 + OFFERS_PER_PRODUCT - 1,
+                    "avg_price": 100 + (OFFERS_PER_PRODUCT - 1) / 2,
+                    "median_price": 100 + OFFERS_PER_PRODUCT // 2,
+                    "offer_count": OFFERS_PER_PRODUCT,
+                }
+            )
+            fetches.append(
+                {
+                    "id": fetch_id,
+                    "time": i * 60,
+                    "product_id": product_id,
+                    "offer_summary_id": summary_id,
+                }
+            )
+            links += [
+                {"id": uuid.uuid4(), "offer_id": offer_id, "fetch_id": fetch_id}
+                for offer_id in offer_ids
+            ]
+
+    with db.engine.begin() as conn:
+        conn.execute(Product.__table__.insert(), products)
+        conn.execute(Offer.__table__.insert(), offers)
+        conn.execute(OfferSummary.__table__.insert(), summaries)
+        conn.execute(Fetch.__table__.insert(), fetches)
+        conn.execute(offer_fetch.insert(), links)
+
+    return product_ids
+
+
+async def measure_loop_lag(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - start - 0.01) * 1000)
+
+
+async def client_run(
+    client: httpx.AsyncClient,
+    product_ids: list[uuid.UUID],
+    requests: int,
+    timings: dict[str, list[float]],
+    offset: int,
+):
+    for i in range(requests):
+        product_id = product_ids[(offset + i) % len(product_ids)]
+        for name, url, params in (
+            ("GET /products/", "/products/", None),
+            ("GET /products/{id}/offers", f"/products/{product_id}/offers", None),
+            (
+                "GET /products/{id}/price-history",
+                f"/products/{product_id}/price-history",
+                {"from_time": 0, "to_time": FETCHES_PER_PRODUCT * 60},
+            ),
+        ):
+            start = time.perf_counter()
+            response = await client.get(url, params=params)
+            timings[name].append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+
+
+def percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100)[p - 1] if len(values) > 1 else values[0]
+
+
+async def main(clients: int, requests: int):
+    product_ids = seed()
+    timings: dict[str, list[float]] = {
+        "GET /products/": [],
+        "GET /products/{id}/offers": [],
+        "GET /products/{id}/price-history": [],
+    }
+    lags: list[float] = []
+    stop = asyncio.Event()
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        lag_task = asyncio.create_task(measure_loop_lag(lags, stop))
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                client_run(client, product_ids, requests, timings, offset=i * requests)
+                for i in range(clients)
+            )
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await lag_task
+
+    print(f"{clients} clients x {requests} requests per endpoint in {elapsed:.2f}s")
+    print(f"{'endpoint':<35} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, values in timings.items():
+        print(
+            f"{name:<35} {percentile(values, 50):>8.1f} {percentile(values, 95):>8.1f} {percentile(values, 99):>8.1f}"
+        )
+    print(
+        f"{'event loop lag':<35} {percentile(lags, 50):>8.1f} {percentile(lags, 95):>8.1f} {max(lags):>8.1f} (max)"
+    )
+
+    Base.metadata.drop_all(db.engine)
+
+
+if __name__ == "__main__":
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    asyncio.run(main(clients, requests))
@@ -0,0 +1,96 @@
+"""
+Measures how a burst of logins affects the latency of GET /products/.
+
+Readers request the product list while other clients log in as fast as they can. This runs three times: without
+logins, with the passwords verified in the shared thread pool (AUTH_VERIFY_WORKERS=0, like a sync endpoint) and
+with them verified in the process pool. Logins rejected because the pool was saturated are counted, not retried.
+
+Uses the same database setup as bench_latency.
+
+Usage: python -m scripts.bench_login [readers] [login_clients] [seconds]
+"""
+import asyncio
+import sys
+import time
+
+from scripts.bench_latency import measure_loop_lag, percentile, seed  # noqa: E402 (sets the environment)
+
+import httpx  # noqa: E402
+
+import src.env as env  # noqa: E402
+from src import db  # noqa: E402
+from src.auth import PasswordVerifier, fake_users_db  # noqa: E402
+from src.main import app  # noqa: E402
+from src.orm_models import Base  # noqa: E402
+
+
+async def read(client: httpx.AsyncClient, timings: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get("/products/")
+        timings.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+
+
+async def login(client: httpx.AsyncClient, statuses: dict[int, int], stop: asyncio.Event):
+    while not stop.is_set():
+        response = await client.post(
+            "/token", json={"username": "alice", "password": "Alice123"}
+        )
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if response.status_code == 503:
+            await asyncio.sleep(0.05)
+
+
+async def run(name: str, readers: int, login_clients: int, seconds: float):
+    timings: list[float] = []
+    lags: list[float] = []
+    statuses: dict[int, int] = {}
+    stop = asyncio.Event()
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        tasks = [asyncio.create_task(measure_loop_lag(lags, stop))]
+        tasks += [asyncio.create_task(read(client, timings, stop)) for _ in range(readers)]
+        tasks += [
+            asyncio.create_task(login(client, statuses, stop)) for _ in range(login_clients)
+        ]
+        await asyncio.sleep(seconds)
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    logins = ", ".join(f"{count} x {status}" for status, count in sorted(statuses.items()))
+    print(
+        f"{name:<20} {len(timings):>8} {percentile(timings, 50):>8.1f} {percentile(timings, 95):>8.1f}"
+        f" {percentile(timings, 99):>8.1f} {max(lags):>8.1f}   {logins or '-'}"
+    )
+
+
+async def main(readers: int, login_clients: int, seconds: float):
+    seed()
+
+    print(f"{readers} readers, {login_clients} login clients, {seconds:.0f}s per run")
+    print(
+        f"{'run':<20} {'requests':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max lag':>8}   logins"
+    )
+    await run("no logins", readers, 0, seconds)
+
+    workers, queue = env.AUTH_VERIFY_WORKERS, env.AUTH_VERIFY_QUEUE
+    env.AUTH_VERIFY_WORKERS, env.AUTH_VERIFY_QUEUE = 0, login_clients
+    await run("thread pool", readers, login_clients, seconds)
+
+    env.AUTH_VERIFY_WORKERS, env.AUTH_VERIFY_QUEUE = workers, queue
+    # start the processes first, so that spawning them is not measured
+    await asyncio.gather(
+        *(PasswordVerifier.verify("warmup", fake_users_db["alice"]) for _ in range(workers))
+    )
+    await run("process pool", readers, login_clients, seconds)
+    PasswordVerifier.stop()
+
+    Base.metadata.drop_all(db.engine)
+
+
+if __name__ == "__main__":
+    readers = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    login_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    asyncio.run(main(readers, login_clients, seconds))
@@ -0,0 +1,124 @@
+"""
+Counts the database round trips needed to store the offers of one product, before and after the bulk upsert.
+
+Runs against a temporary SQLite file by default, set DATABASE_URL to benchmark a real PostgreSQL instance
+(the tables are created and dropped by the script, so use an empty database). The legacy implementation runs on
+the sync engine, the current one on the async engine, so both need to see the same database.
+
+Usage: python -m scripts.bench_store_offers
+"""
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+os.environ.setdefault(
+    "DATABASE_URL",
+    "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_store_offers.db"),
+)
+os.environ.setdefault("TOKEN_SECRET", "benchmark")
+os.environ.setdefault("JWT_SECRET", "benchmark")
+os.environ.setdefault("TEST_ENV", "1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from sqlalchemy import event  # noqa: E402
+
+from src import db  # noqa: E402
+from src.db import async_session_scope, session_scope  # noqa: E402
+from src.offers import _store_offers_in_db  # noqa: E402
+from src.orm_models import Base, Fetch, Offer, Product  # noqa: E402
+from src.pydantic_models import OfferModel  # noqa: E402
+
+OFFER_COUNTS = [1, 10, 50, 200]
+CYCLES = 5
+
+
+async def legacy_store_offers_in_db(offerModels: list[OfferModel], prod: Product):
+    """The per-offer implementation that was replaced, kept here for comparison. It blocks the event loop."""
+    with session_scope() as session:
+        product = session.query(Product).filter(Product.id == prod.id).first()
+
+        new_fetch = Fetch(id=uuid.uuid4(), time=time.time())
+        product.fetches.append(new_fetch)
+        session.add(new_fetch)
+        session.commit()
+
+        offers = [model.to_offer() for model in offerModels]
+        for offer in offers:
+            the_offer = session.query(Offer).filter(Offer.id == offer.id).first()
+            if the_offer:
+                the_offer.price = offer.price
+                the_offer.items_in_stock = offer.items_in_stock
+            else:
+                session.add(offer)
+        session.commit()
+
+        for offer in offers:
+            ofr = session.query(Offer).filter(Offer.id == offer.id).first()
+            new_fetch.offers.append(ofr)
+        session.commit()
+
+
+class RoundTripCounter:
+    def __init__(self, *engines):
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_statement)
+            event.listen(engine, "commit", self._on_commit)
+
+    def _on_statement(self, *args):
+        self.count += 1
+
+    def _on_commit(self, *args):
+        self.count += 1
+
+
+async def run(store, offer_count: int, counter: RoundTripCounter) -> tuple[float, float]:
+    product_id = uuid.uuid4()
+    async with async_session_scope() as session:
+        session.add(Product(id=product_id, name="bench", description="bench"))
+    product = Product(id=product_id, name="bench", description="bench")
+
+    models = [
+        OfferModel(id=uuid.uuid4(), price=i, items_in_stock=i, product_id=product_id)
+        for i in range(offer_count)
+    ]
+
+    counter.count = 0
+    start = time.perf_counter()
+    for cycle in range(CYCLES):
+        for model in models:
+            model.price += 1
+        await store(models, product)
+    elapsed = time.perf_counter() - start
+
+    return counter.count / CYCLES, elapsed / CYCLES * 1000
+
+
+async def main():
+    Base.metadata.drop_all(db.engine)
+    Base.metadata.create_all(db.engine)
+    counter = RoundTripCounter(db.engine, db.async_engine.sync_engine)
+
+    print(f"{'offers':>8} {'before (trips)':>15} {'after (trips)':>14} {'before (ms)':>12} {'after (ms)':>11}")
+    try:
+        for offer_count in OFFER_COUNTS:
+            before_trips, before_ms = await run(
+                legacy_store_offers_in_db, offer_count, counter
+            )
+            after_trips, after_ms = await run(
+                lambda models, product: _store_offers_in_db(models, product),
+                offer_count,
+                counter,
+            )
+            print(
+                f"{offer_count:>8} {before_trips:>15.0f} {after_trips:>14.0f} {before_ms:>12.2f} {after_ms:>11.2f}"
+            )
+    finally:
+        Base.metadata.drop_all(db.engine)
+        await db.dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,13 @@
-from datetime import datetime, timedelta
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import multiprocessing
+import threading
+from typing import Optional
+
 from fastapi.params import Security
 from fastapi.security import (
     HTTPAuthorizationCredentials,
@@ -7,10 +16,15 @@ from fastapi.security import (
 import jwt
 from passlib.hash import sha256_crypt
 
-from .exceptions.internal import JWTInvalidTokenError, JWTSignatureExpiredError
+from .exceptions.internal import (
+    JWTInvalidTokenError,
+    JWTSignatureExpiredError,
+    LoginUnavailableError,
+)
 
 from .pydantic_models import TokenData
 from .env import JWT_SECRET, ALGORITHM, JWT_TOKEN_EXPIRE_MINUTES
+import src.env as env
 from .logger import get_logger
 
 logger = get_logger(__name__)
@@ -22,18 +36,104 @@ def hash_password(password: str) -> str:
     return sha256_crypt.hash(password)
 
 
+# Hashes of the passwords of the demo users, made with 'hash_password'. Hashing them at import would cost
+# several hundred thousand rounds of SHA-256 per user on every start. The passwords are JonhDoe123, Alice123,
+# Bob123 and string.
 fake_users_db = {
-    "johndoe": hash_password("JonhDoe123"),
-    "alice": hash_password("Alice123"),
-    "bob": hash_password("Bob123"),
-    "string": hash_password("string"),
+    "johndoe": "$5$rounds=535000$Pq.5FANHnfgGgWtb$qBC/mDl6gSFlAMdVrIn9VjEDYGAnC8i5gjXlHkInkPA",
+    "alice": "$5$rounds=535000$E2Ju88V1VcFVpqJY$4.8ZvEbk4mfc/BN6bpzCF5TnEZ2R7gvYkWWlWPV3q1A",
+    "bob": "$5$rounds=535000$kmVvHfCfnP3xnhBZ$cyUFHPDlwxMoWxngCyFNLalBKRhCkzarisvfwD.Ymb0",
+    "string": "$5$rounds=535000$5u21HXQTF5M2hf5z$XxD9lQqgQFBhezizQrtUIm9otdkJUMSCH6sOC1pAKS9",
 }
 
+_credentials: Optional[dict[str, str]] = None
+
+
+def get_credentials() -> dict[str, str]:
+    """
+    Get the password hashes of the users, by username. They are read from the JSON object in 'CREDENTIALS_FILE'
+    on first use, or are the demo users if it is not set.
+    """
+    global _credentials
+    if _credentials is None:
+        if env.CREDENTIALS_FILE:
+            with open(env.CREDENTIALS_FILE) as file:
+                _credentials = json.load(file)
+            logger.info("Loaded %d users from %s", len(_credentials), env.CREDENTIALS_FILE)
+        else:
+            _credentials = fake_users_db
+    return _credentials
+
 
 def validate_password(plain_password: str, hashed_password: str) -> bool:
     return sha256_crypt.verify(plain_password, hashed_password)
 
 
+class PasswordVerifier:
+    """
+    Verifies passwords in a dedicated pool of 'AUTH_VERIFY_WORKERS' processes. A verification takes hundreds of
+    milliseconds of CPU by design, so a burst of logins running in the thread pool shared with the rest of the app
+    (or on the event loop) would delay every other request. In separate processes it also does not hold the GIL.
+
+    At most 'AUTH_VERIFY_QUEUE' verifications wait for a free process. Further logins are rejected right away
+    with 'LoginUnavailableError' (503) instead of queueing for ever longer.
+
+    Attributes:
+        _pool (Optional[ProcessPoolExecutor]): The pool, created on first use.
+        _in_flight (int): Number of verifications running or waiting for a process.
+        rejected (int): Number of logins rejected because the pool was saturated.
+    """
+
+    _pool: Optional[ProcessPoolExecutor] = None
+    _in_flight = 0
+    rejected = 0
+
+    @classmethod
+    def start(cls) -> Optional[ProcessPoolExecutor]:
+        """
+        Creates the pool, its processes are started when they are needed. Without workers, passwords are verified
+        in the default thread pool.
+        """
+        if cls._pool is None and env.AUTH_VERIFY_WORKERS > 0:
+            logger.debug(
+                "Starting password verification pool with %d processes", env.AUTH_VERIFY_WORKERS
+            )
+            # spawned processes do not inherit the event loop and the threads of the app like forked ones would
+            cls._pool = ProcessPoolExecutor(
+                max_workers=env.AUTH_VERIFY_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return cls._pool
+
+    @classmethod
+    def stop(cls):
+        if cls._pool is not None:
+            logger.debug("Stopping password verification pool")
+            cls._pool.shutdown(wait=False, cancel_futures=True)
+            cls._pool = None
+
+    @classmethod
+    async def verify(cls, plain_password: str, hashed_password: str) -> bool:
+        """
+        Verify a password without blocking the event loop or the shared thread pool.
+
+        Raises:
+            LoginUnavailableError: If all processes are busy and the queue is full.
+        """
+        if cls._in_flight >= max(env.AUTH_VERIFY_WORKERS, 1) + env.AUTH_VERIFY_QUEUE:
+            cls.rejected += 1
+            logger.debug("Password verification saturated, %d logins in flight", cls._in_flight)
+            raise LoginUnavailableError()
+
+        cls._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                cls.start(), validate_password, plain_password, hashed_password
+            )
+        finally:
+            cls._in_flight -= 1
+
+
 def create_token(username: str) -> str:
     to_encode = {
         "sub": username,
@@ -43,11 +143,79 @@ def create_token(username: str) -> str:
     return token
 
 
+def _now() -> float:
+    # the same clock jwt.decode checks 'exp' against
+    return datetime.now(tz=timezone.utc).timestamp()
+
+
+class VerifiedTokenCache:
+    """
+    Bounded cache of the tokens whose signature and claims were already verified, so that a client reusing its
+    token does not pay for the verification on every request.
+
+    Entries are keyed by the SHA-256 digest of the token, so the tokens themselves are not kept in memory.
+    An entry is only valid until the 'exp' claim of its token, after which the token is verified again (and
+    rejected as expired) like without the cache. Tokens without 'exp' are not cached. The least recently used
+    entries are evicted once there are 'AUTH_TOKEN_CACHE_SIZE' of them.
+
+    Attributes:
+        hits (int): Number of tokens found in the cache.
+        misses (int): Number of tokens that had to be verified.
+    """
+
+    _entries: OrderedDict[bytes, tuple[float, TokenData]] = OrderedDict()
+    # auth_wrapper is a sync dependency, FastAPI runs it in a thread pool
+    _lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    @classmethod
+    def get(cls, token: str) -> Optional[TokenData]:
+        key = cls._key(token)
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and _now() < entry[0]:
+                cls._entries.move_to_end(key)
+                cls.hits += 1
+                return entry[1]
+            if entry is not None:
+                del cls._entries[key]
+            cls.misses += 1
+            return None
+
+    @classmethod
+    def put(cls, token: str, expires_at: float, data: TokenData) -> None:
+        if env.AUTH_TOKEN_CACHE_SIZE <= 0:
+            return
+        with cls._lock:
+            cls._entries[cls._key(token)] = (expires_at, data)
+            while len(cls._entries) > env.AUTH_TOKEN_CACHE_SIZE:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._entries.clear()
+            cls.hits = 0
+            cls.misses = 0
+
+
 def parse_token(token: str) -> TokenData:
+    cached = VerifiedTokenCache.get(token)
+    if cached is not None:
+        return cached
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        return TokenData(username=username)
+        data = TokenData(username=username)
+        if isinstance(payload.get("exp"), (int, float)):
+            VerifiedTokenCache.put(token, payload["exp"], data)
+        return data
     except jwt.ExpiredSignatureError as e:
         raise JWTSignatureExpiredError()
     except jwt.DecodeError as e:
@@ -1,10 +1,28 @@
 import asyncio
+from dataclasses import dataclass
+import time
+from typing import Awaitable, Callable, Optional
+import uuid
 
-from .orm_models import Product
-from .db import session_scope
+from sqlalchemy import select
+
+from .orm_models import FetchLease, Offer, Product
+from .db import async_session_scope
+from .leases import claim_products, ensure_leases, next_lease_expiry, release_leases
 import src.env as env
 from .logger import get_logger
 from .offers import fetch_products
+from .jobs import due_job_ids, run_job
+from .purge import purge_deleted_products
+from .resilience import UpstreamGuard
+from .retention import CompactionStats, compact_snapshots
+from .scheduler import (
+    MIN_SLEEP,
+    FetchScheduler,
+    ProductSchedule,
+    reschedule_lease,
+    sync_schedule,
+)
 
 
 logger = get_logger(__name__)
@@ -13,7 +31,38 @@ logger = get_logger(__name__)
 # If we wanted to make this scalable, we should separate this into a separate microservice and use something like celery.
 # That would allow us to scale the offer fetching independently of the rest of the application.
 # Another potential solution would be to use a message queue like RabbitMQ or Kafka to distribute the work between multiple instances of the offer fetching service.
-# With the current setup, the offers would be fetched multiple times if we tried to scale the application.
+# With the default setup, the offers would be fetched multiple times if we tried to scale the application.
+# Setting FETCH_COORDINATION=lease splits the products between the replicas using leases in the database, see leases.py.
+# With FETCH_SCHEDULE=adaptive, every product is fetched on its own interval, see scheduler.py. Without leases the
+# schedule is kept in memory, with leases it is kept in the leases, which then expire when the product is due.
+# In memory, due products are handed to at most FETCH_CONCURRENCY fetches as soon as one of them finishes, so a slow
+# product only holds its own slot.
+
+
+def _describe_upstream() -> str:
+    upstream = UpstreamGuard.stats()
+    return (
+        f"offers API breaker {upstream.breaker_state} ({upstream.rejected} rejected), "
+        f"{upstream.limiter_wait_time:.2f}s waited for the rate limit"
+    )
+
+
+@dataclass
+class FetchCycleStats:
+    """
+    Statistics of a single fetch cycle.
+
+    Attributes:
+        done (int): Number of products whose offers were fetched successfully.
+        skipped (int): Number of products that were not fetched because the cycle deadline passed.
+        failed (int): Number of products whose fetch raised an error or timed out.
+        wall_time (float): Duration of the cycle in seconds.
+    """
+
+    done: int = 0
+    skipped: int = 0
+    failed: int = 0
+    wall_time: float = 0.0
 
 
 class OfferWorker:
@@ -22,18 +71,25 @@ class OfferWorker:
 
     Attributes:
         _is_running (bool): Status flag indicating whether the worker is currently running.
+        last_cycle_stats (Optional[FetchCycleStats]): Statistics of the last finished fetch cycle.
     """
 
     _is_running = False
+    last_cycle_stats: Optional[FetchCycleStats] = None
+    scheduler: Optional[FetchScheduler] = None
 
     @classmethod
     def start(cls):
         """
-        Starts the OfferWorker. This initiates the periodic fetching of offers.
+        Starts the OfferWorker. This initiates the periodic (or, with the adaptive schedule without leases,
+        the scheduled) fetching of offers.
         """
         cls._is_running = True
         logger.debug("Starting OfferWorker")
-        asyncio.create_task(cls.periodic_fetch_offers())
+        if env.FETCH_SCHEDULE == "adaptive" and env.FETCH_COORDINATION != "lease":
+            asyncio.create_task(cls.scheduled_fetch_offers())
+        else:
+            asyncio.create_task(cls.periodic_fetch_offers())
 
     @classmethod
     def stop(cls):
@@ -43,6 +99,145 @@ class OfferWorker:
         logger.debug("Stopping OfferWorker")
         cls._is_running = False  # will stop on the next iteration
 
+    @classmethod
+    async def fetch_cycle(
+        cls,
+        products: list[Product],
+        deadline: Optional[float] = None,
+        on_fetched: Optional[Callable[[Product, list[Offer]], Awaitable[None]]] = None,
+    ) -> FetchCycleStats:
+        """
+        Fetches offers for the given products, at most 'FETCH_CONCURRENCY' of them at the same time.
+
+        Every product fetch is limited by 'FETCH_PRODUCT_TIMEOUT' and the whole cycle by 'FETCH_CYCLE_TIMEOUT'.
+        Products that did not get a chance to start before the cycle deadline are skipped. A failing or slow
+        product only occupies its own slot, so it does not stall the rest of the cycle. Every fetch opens its
+        own sessions, so the products should be loaded in a session that is closed by now.
+
+        Args:
+            products (list[Product]): The products to fetch offers for.
+            deadline (Optional[float]): Deadline of the cycle in 'time.monotonic()' time, if it already started.
+            on_fetched (Optional[Callable]): Awaited with every product and its offers after a successful fetch.
+
+        Returns:
+            FetchCycleStats: Statistics of the cycle.
+        """
+        stats = FetchCycleStats()
+        start = time.monotonic()
+        if deadline is None:
+            deadline = start + env.FETCH_CYCLE_TIMEOUT
+        semaphore = asyncio.Semaphore(max(1, env.FETCH_CONCURRENCY))
+
+        async def fetch_one(product: Product):
+            async with semaphore:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    stats.skipped += 1
+                    return
+
+                try:
+                    offers = await asyncio.wait_for(
+                        fetch_products(product),
+                        timeout=min(env.FETCH_PRODUCT_TIMEOUT, remaining),
+                    )
+                    if on_fetched is not None:
+                        await on_fetched(product, offers)
+                    stats.done += 1
+                except asyncio.TimeoutError:
+                    logger.error("Fetching offers for product %s timed out", product.id)
+                    stats.failed += 1
+                except Exception as e:
+                    logger.error(
+                        "Fetching offers for product %s failed: %s", product.id, e
+                    )
+                    stats.failed += 1
+
+        await asyncio.gather(*(fetch_one(product) for product in products))
+
+        stats.wall_time = time.monotonic() - start
+        return stats
+
+    @classmethod
+    async def leased_fetch_cycle(cls) -> FetchCycleStats:
+        """
+        Fetches offers for the products this worker manages to claim, see 'leases'.
+
+        Products are claimed in batches of 'FETCH_LEASE_BATCH' until there are no unclaimed products left
+        or the cycle deadline passes. Other replicas do the same at the same time, so the products get split
+        between them and no product is fetched twice within 'FETCH_LEASE_TTL'. With the adaptive schedule,
+        the lease of a fetched product is extended until the product is due again.
+
+        Returns:
+            FetchCycleStats: Statistics of the cycle.
+        """
+        stats = FetchCycleStats()
+        start = time.monotonic()
+        deadline = start + env.FETCH_CYCLE_TIMEOUT
+
+        async with async_session_scope() as session:
+            await ensure_leases(session)
+
+        while time.monotonic() < deadline:
+            async with async_session_scope() as session:
+                product_ids = await claim_products(
+                    session, env.WORKER_ID, env.FETCH_LEASE_TTL, env.FETCH_LEASE_BATCH
+                )
+
+            if not product_ids:
+                break
+
+            async with async_session_scope() as session:
+                products = (
+                    await session.scalars(
+                        select(Product)
+                        .where(Product.id.in_(product_ids))
+                        .where(Product.deleted_at.is_(None))
+                    )
+                ).all()
+
+                leases = {
+                    lease.product_id: lease
+                    for lease in await session.scalars(
+                        select(FetchLease).where(FetchLease.product_id.in_(product_ids))
+                    )
+                }
+
+            async def extend_lease(product: Product, offers: list[Offer]):
+                if offers is None:
+                    return
+                async with async_session_scope() as session:
+                    await reschedule_lease(
+                        session,
+                        leases[product.id],
+                        env.WORKER_ID,
+                        offers,
+                        time.time(),
+                    )
+
+            batch_stats = await cls.fetch_cycle(
+                products,
+                deadline,
+                extend_lease if env.FETCH_SCHEDULE == "adaptive" else None,
+            )
+
+            stats.done += batch_stats.done
+            stats.skipped += batch_stats.skipped
+            stats.failed += batch_stats.failed
+
+        stats.wall_time = time.monotonic() - start
+        return stats
+
+    @classmethod
+    async def release(cls):
+        """
+        Gives up the leases of this worker, so that other replicas can take over its products immediately.
+        """
+        if env.FETCH_COORDINATION != "lease":
+            return
+
+        async with async_session_scope() as session:
+            await release_leases(session, env.WORKER_ID)
+
     @classmethod
     async def periodic_fetch_offers(cls):
         """
@@ -55,12 +250,378 @@ class OfferWorker:
         """
         logger.debug("Starting periodic fetch")
         while cls._is_running:
-            with session_scope() as session:
-                products = session.query(Product).all()
+            delay = env.PERIODIC_FETCH_INTERVAL
+            try:
+                if env.FETCH_COORDINATION == "lease":
+                    stats = await cls.leased_fetch_cycle()
+                else:
+                    async with async_session_scope() as session:
+                        products = (
+                            await session.scalars(
+                                select(Product).where(Product.deleted_at.is_(None))
+                            )
+                        ).all()
+
+                    stats = await cls.fetch_cycle(products)
 
-                for product in products:
-                    # await to make the load on the db and the api more even
-                    await fetch_products(product, session)
+                cls.last_cycle_stats = stats
+                logger.info(
+                    "Fetch cycle finished in %.2fs: %d done, %d skipped, %d failed, %s",
+                    stats.wall_time,
+                    stats.done,
+                    stats.skipped,
+                    stats.failed,
+                    _describe_upstream(),
+                )
 
-            await asyncio.sleep(env.PERIODIC_FETCH_INTERVAL)
+                delay = await cls._next_cycle_delay()
+            except Exception:
+                # e.g. the database was unreachable, the next cycle tries again
+                logger.exception("Fetch cycle failed")
+
+            await asyncio.sleep(delay)
         logger.debug("Stopping periodic fetch")
+
+    @classmethod
+    async def _next_cycle_delay(cls) -> float:
+        """
+        Seconds until the next fetch cycle. With the adaptive schedule and leases, that is when the next lease
+        expires, but at least 'MIN_SLEEP' and at most 'PERIODIC_FETCH_INTERVAL' (to pick up new products).
+        """
+        if env.FETCH_SCHEDULE != "adaptive" or env.FETCH_COORDINATION != "lease":
+            return env.PERIODIC_FETCH_INTERVAL
+
+        async with async_session_scope() as session:
+            next_expiry = await next_lease_expiry(session)
+        if next_expiry is None:
+            return env.PERIODIC_FETCH_INTERVAL
+        return min(max(next_expiry - time.time(), MIN_SLEEP), env.PERIODIC_FETCH_INTERVAL)
+
+    @classmethod
+    async def fetch_scheduled(
+        cls, scheduler: FetchScheduler, entry: ProductSchedule, stats: FetchCycleStats
+    ) -> None:
+        """
+        Fetches offers for one due product and puts it back into the schedule with its adapted interval.
+        A failed fetch is retried after the current interval, a deleted product is dropped from the schedule.
+        """
+        offers = None
+        try:
+            async with async_session_scope() as session:
+                product = await session.scalar(
+                    select(Product)
+                    .where(Product.id == entry.product_id)
+                    .where(Product.deleted_at.is_(None))
+                )
+            if product is None:
+                scheduler.remove(entry.product_id)
+                return
+
+            offers = await asyncio.wait_for(
+                fetch_products(product), timeout=env.FETCH_PRODUCT_TIMEOUT
+            )
+            stats.done += 1
+        except asyncio.TimeoutError:
+            logger.error("Fetching offers for product %s timed out", entry.product_id)
+            stats.failed += 1
+        except Exception as e:
+            logger.error("Fetching offers for product %s failed: %s", entry.product_id, e)
+            stats.failed += 1
+        finally:
+            scheduler.reschedule(entry, offers, time.time())
+
+    @classmethod
+    def start_due_fetches(
+        cls,
+        scheduler: FetchScheduler,
+        tasks: set[asyncio.Task],
+        stats: FetchCycleStats,
+    ) -> int:
+        """
+        Starts fetching the due products, the most overdue first, while fewer than 'FETCH_CONCURRENCY' fetches
+        are running. Every fetch frees its slot as soon as it finishes, so a slow product only holds up itself.
+
+        Returns:
+            int: Number of fetches started.
+        """
+        free = max(1, env.FETCH_CONCURRENCY) - len(tasks)
+        if free <= 0:
+            return 0
+
+        due = scheduler.pop_due(time.time(), free)
+        for entry in due:
+            tasks.add(asyncio.create_task(cls.fetch_scheduled(scheduler, entry, stats)))
+        return len(due)
+
+    @classmethod
+    async def scheduled_fetch_offers(cls):
+        """
+        Fetches offers for every product when it is due, see 'scheduler'. The products are loaded from the
+        database at the start and every 'PERIODIC_FETCH_INTERVAL' seconds after that, so that new products
+        get scheduled and deleted ones dropped. After a restart, the products that were not fetched for the
+        longest time come first. The statistics are logged at every reload.
+
+        Note: This method is an asynchronous coroutine and must be awaited when called.
+        """
+        logger.debug("Starting scheduled fetch")
+        cls.scheduler = FetchScheduler()
+        tasks: set[asyncio.Task] = set()
+        stats = FetchCycleStats()
+        last_sync = None
+
+        while cls._is_running:
+            try:
+                if last_sync is None or time.monotonic() - last_sync >= env.PERIODIC_FETCH_INTERVAL:
+                    if last_sync is not None:
+                        stats.wall_time = time.monotonic() - last_sync
+                        cls.last_cycle_stats = stats
+                        logger.info(
+                            "Fetched in the last %.2fs: %d done, %d failed, "
+                            "%d products scheduled, %d fetching, %s",
+                            stats.wall_time,
+                            stats.done,
+                            stats.failed,
+                            len(cls.scheduler),
+                            len(tasks),
+                            _describe_upstream(),
+                        )
+                        stats = FetchCycleStats()
+                    async with async_session_scope() as session:
+                        await sync_schedule(session, cls.scheduler)
+                    last_sync = time.monotonic()
+
+                cls.start_due_fetches(cls.scheduler, tasks, stats)
+            except Exception as e:
+                logger.error("Scheduled fetch failed: %s", e)
+
+            # wait until a fetch finishes, the next product is due or it is time to reload the products
+            delay = env.PERIODIC_FETCH_INTERVAL
+            if last_sync is not None:
+                delay = max(delay - (time.monotonic() - last_sync), 0)
+            next_due = cls.scheduler.next_due()
+            if next_due is not None and len(tasks) < max(1, env.FETCH_CONCURRENCY):
+                delay = min(max(next_due - time.time(), 0), delay)
+
+            if tasks:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                tasks -= done
+            else:
+                await asyncio.sleep(delay)
+
+        for task in tasks:
+            task.cancel()
+        logger.debug("Stopping scheduled fetch")
+
+
+class JobWorker:
+    """
+    A worker class responsible for running the jobs of asynchronously created products, see 'jobs'.
+
+    Attributes:
+        _is_running (bool): Status flag indicating whether the worker is currently running.
+        _queue (Optional[asyncio.Queue]): Ids of the jobs waiting to be run by this worker.
+        _queued (set[uuid.UUID]): Ids in the queue, so that a polled job is not queued twice.
+        _tasks (list[asyncio.Task]): The running consumers and the poller.
+    """
+
+    _is_running = False
+    _queue: Optional[asyncio.Queue] = None
+    _queued: set[uuid.UUID] = set()
+    _tasks: list[asyncio.Task] = []
+
+    @classmethod
+    def start(cls):
+        """
+        Starts 'JOB_CONCURRENCY' consumers of the queue and the polling for due jobs.
+        """
+        cls._is_running = True
+        cls._queue = asyncio.Queue()
+        cls._queued = set()
+        logger.debug("Starting JobWorker")
+        cls._tasks = [
+            asyncio.create_task(cls.consume()) for _ in range(max(1, env.JOB_CONCURRENCY))
+        ]
+        cls._tasks.append(asyncio.create_task(cls.periodic_poll()))
+
+    @classmethod
+    def stop(cls):
+        """
+        Stops the JobWorker. Jobs that are running are interrupted and taken over after 'JOB_LEASE_TTL'.
+        """
+        logger.debug("Stopping JobWorker")
+        cls._is_running = False
+        for task in cls._tasks:
+            task.cancel()
+        cls._tasks = []
+        cls._queue = None
+
+    @classmethod
+    def submit(cls, job_id: uuid.UUID):
+        """
+        Run a job as soon as a consumer is free. Without a running worker (e.g. in scripts) the job is left
+        for the polling of any replica.
+        """
+        if cls._queue is None or job_id in cls._queued:
+            return
+        cls._queued.add(job_id)
+        cls._queue.put_nowait(job_id)
+
+    @classmethod
+    async def consume(cls):
+        while cls._is_running:
+            job_id = await cls._queue.get()
+            cls._queued.discard(job_id)
+            try:
+                await run_job(job_id, env.WORKER_ID)
+            except Exception as e:
+                logger.error("Running job %s failed: %s", job_id, e)
+
+    @classmethod
+    async def periodic_poll(cls):
+        """
+        Queues the due jobs every 'JOB_POLL_INTERVAL' seconds.
+
+        Note: This method is an asynchronous coroutine and must be awaited when called.
+        """
+        while cls._is_running:
+            try:
+                async with async_session_scope() as session:
+                    job_ids = await due_job_ids(session, max(1, env.JOB_CONCURRENCY))
+                for job_id in job_ids:
+                    cls.submit(job_id)
+            except Exception as e:
+                logger.error("Polling for jobs failed: %s", e)
+
+            await asyncio.sleep(env.JOB_POLL_INTERVAL)
+        logger.debug("Stopping job polling")
+
+
+class PurgeWorker:
+    """
+    A worker class responsible for removing the history of deleted products, see 'purge'.
+
+    Attributes:
+        _is_running (bool): Status flag indicating whether the worker is currently running.
+        _wakeup (Optional[asyncio.Event]): Set to start purging before the interval elapses.
+    """
+
+    _is_running = False
+    _wakeup: Optional[asyncio.Event] = None
+
+    @classmethod
+    def start(cls):
+        """
+        Starts the PurgeWorker. Products deleted before the start (e.g. by a replica that stopped) are purged first.
+        """
+        cls._is_running = True
+        cls._wakeup = asyncio.Event()
+        logger.debug("Starting PurgeWorker")
+        asyncio.create_task(cls.periodic_purge())
+
+    @classmethod
+    def stop(cls):
+        """
+        Stops the PurgeWorker after the current iteration. A partially purged product is finished by the next start.
+        """
+        logger.debug("Stopping PurgeWorker")
+        cls._is_running = False
+        if cls._wakeup is not None:
+            cls._wakeup.set()
+
+    @classmethod
+    def wake(cls):
+        """
+        Start purging now instead of after the interval, called when a product is marked as deleted.
+        """
+        if cls._wakeup is not None:
+            cls._wakeup.set()
+
+    @classmethod
+    async def periodic_purge(cls):
+        """
+        Purges the deleted products every 'PRODUCT_PURGE_INTERVAL' seconds or when woken up.
+
+        Note: This method is an asynchronous coroutine and must be awaited when called.
+        """
+        while cls._is_running:
+            cls._wakeup.clear()
+            try:
+                purged = await purge_deleted_products(env.PRODUCT_PURGE_BATCH)
+                if purged:
+                    logger.info("Purged %d deleted products", purged)
+            except Exception as e:
+                logger.error("Purging deleted products failed: %s", e)
+
+            try:
+                await asyncio.wait_for(
+                    cls._wakeup.wait(), timeout=env.PRODUCT_PURGE_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+        logger.debug("Stopping periodic purge")
+
+
+class CompactionWorker:
+    """
+    A worker class responsible for applying the retention policy of raw offer snapshots, see 'retention'.
+
+    Attributes:
+        _is_running (bool): Status flag indicating whether the worker is currently running.
+        last_run_stats (Optional[CompactionStats]): What the last finished compaction run reclaimed.
+    """
+
+    _is_running = False
+    last_run_stats: Optional[CompactionStats] = None
+
+    @classmethod
+    def start(cls):
+        """
+        Starts the CompactionWorker, unless the snapshots are kept forever ('SNAPSHOT_RETENTION_DAYS' is 0).
+        """
+        if env.SNAPSHOT_RETENTION_DAYS <= 0:
+            logger.debug("Snapshots are kept forever, not starting CompactionWorker")
+            return
+
+        cls._is_running = True
+        logger.debug("Starting CompactionWorker")
+        asyncio.create_task(cls.periodic_compaction())
+
+    @classmethod
+    def stop(cls):
+        """
+        Stops the CompactionWorker after the current run.
+        """
+        logger.debug("Stopping CompactionWorker")
+        cls._is_running = False
+
+    @classmethod
+    async def periodic_compaction(cls):
+        """
+        Compacts the expired snapshots every 'COMPACTION_INTERVAL' seconds.
+
+        Note: This method is an asynchronous coroutine and must be awaited when called.
+        """
+        while cls._is_running:
+            try:
+                stats = await compact_snapshots(
+                    env.SNAPSHOT_RETENTION_DAYS,
+                    env.COMPACTION_BATCH,
+                    env.COMPACTION_MAX_BATCHES,
+                )
+                cls.last_run_stats = stats
+                logger.info(
+                    "Compaction finished in %.2fs: %d snapshots compacted, "
+                    "%d links and %d offers deleted, %d summaries computed",
+                    stats.wall_time,
+                    stats.snapshots,
+                    stats.links,
+                    stats.offers,
+                    stats.summaries,
+                )
+            except Exception as e:
+                logger.error("Compaction failed: %s", e)
+
+            await asyncio.sleep(env.COMPACTION_INTERVAL)
+        logger.debug("Stopping periodic compaction")
@@ -0,0 +1,143 @@
+"""
+Incremental parsing of bulk product imports.
+
+The request body is parsed while it is being received, so that only the current chunk and the items of the current
+batch are held in memory, no matter how large the import is. Both parsers yield one entry per item: the decoded
+JSON value, or a 'ValueError' describing why the item could not be decoded.
+"""
+import json
+from typing import Any, AsyncIterator, Union
+
+# Maximum size of a single item in bytes. Larger items (or a body that is not valid JSON at all) fail the import
+# instead of being buffered without bound.
+MAX_ITEM_BYTES = 64 * 1024
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+_decoder = json.JSONDecoder()
+
+
+class BulkFormatError(ValueError):
+    """The body of a bulk import can not be parsed any further."""
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Union[Any, ValueError]]:
+    """
+    Parse newline delimited JSON, one item per line. Empty lines are skipped.
+    An invalid line only fails its own item.
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _decode_line(line)
+        if len(buffer) > MAX_ITEM_BYTES:
+            raise BulkFormatError(f"Line longer than {MAX_ITEM_BYTES} bytes")
+
+    if buffer.strip():
+        yield _decode_line(buffer)
+
+
+def _decode_line(line: bytes) -> Union[Any, ValueError]:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON: {e}")
+
+
+async def iter_json_array(
+    chunks: AsyncIterator[bytes],
+) -> AsyncIterator[Union[Any, ValueError]]:
+    """
+    Parse a JSON array, yielding its elements as soon as they were received completely.
+
+    Raises:
+        BulkFormatError: If the body is not a JSON array.
+    """
+    buffer = ""
+    position = 0
+    started = False
+    finished = False
+
+    def skip(characters: str):
+        nonlocal position
+        while position < len(buffer) and buffer[position] in characters:
+            position += 1
+
+    async for chunk in _decode_utf8(chunks):
+        buffer = buffer[position:] + chunk
+        position = 0
+
+        while not finished:
+            skip(" \t\r\n")
+            if position == len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != "[":
+                    raise BulkFormatError("Expected a JSON array")
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == "]":
+                finished = True
+                position += 1
+                break
+            if buffer[position] == ",":
+                position += 1
+                continue
+
+            try:
+                item, end = _decoder.raw_decode(buffer, position)
+            except ValueError:
+                # incomplete item, wait for the next chunk
+                if len(buffer) - position > MAX_ITEM_BYTES:
+                    raise BulkFormatError(
+                        f"Invalid JSON or item larger than {MAX_ITEM_BYTES} bytes"
+                    )
+                break
+            if end == len(buffer) and not isinstance(item, (dict, list)):
+                # a number at the end of the chunk may continue in the next one
+                break
+
+            position = end
+            yield item
+
+    skip(" \t\r\n")
+    if not finished or position < len(buffer):
+        raise BulkFormatError("Invalid JSON array")
+
+
+async def _decode_utf8(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Decode chunks that may split multi-byte characters.
+    """
+    pending = b""
+    async for chunk in chunks:
+        data = pending + chunk
+        try:
+            text = data.decode()
+            pending = b""
+        except UnicodeDecodeError as e:
+            if e.start < len(data) - 3:
+                raise BulkFormatError("Body is not valid UTF-8") from e
+            text, pending = data[: e.start].decode(), data[e.start :]
+        if text:
+            yield text
+    if pending:
+        raise BulkFormatError("Body is not valid UTF-8")
+
+
+def iter_items(
+    chunks: AsyncIterator[bytes], content_type: str
+) -> AsyncIterator[Union[Any, ValueError]]:
+    """
+    Parse a bulk import with the parser matching its content type. JSON arrays are the default.
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in NDJSON_MEDIA_TYPES:
+        return iter_ndjson(chunks)
+    return iter_json_array(chunks)
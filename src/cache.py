@@ -0,0 +1,327 @@
+import asyncio
+from collections import OrderedDict
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from pydantic import TypeAdapter
+
+import src.env as env
+from .logger import get_logger
+
+try:
+    from redis import asyncio as redis
+except ImportError:  # redis is an optional dependency, only needed for RESULT_CACHE_BACKEND=redis
+    redis = None
+
+
+logger = get_logger(__name__)
+
+MISSING = object()
+
+
+class CacheBackend:
+    """
+    Storage of the 'ResultCache'.
+
+    Entries belong to a product and are stored under the current generation of that product.
+    Invalidating a product moves it to a new generation, so entries of older generations are never read again.
+    """
+
+    async def generation(self, product_id: str) -> int:
+        raise NotImplementedError
+
+    async def get(
+        self, product_id: str, generation: int, key: Hashable, type_: Any
+    ) -> Any:
+        """
+        Returns:
+            Any: The cached value, or MISSING if there is no live entry.
+        """
+        raise NotImplementedError
+
+    async def set(
+        self, product_id: str, generation: int, key: Hashable, type_: Any, value: Any
+    ) -> None:
+        raise NotImplementedError
+
+    async def invalidate(self, product_id: str) -> None:
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process cache with at most 'max_entries' entries, the least recently used entry is evicted first.
+    Entries expire 'ttl' seconds after they were stored.
+
+    Invalidations only reach the process that stored the fetch. With several replicas, the entries
+    of the other replicas stay stale for at most 'ttl' seconds.
+
+    The generation of a product is only kept while the product has entries, or until its first value is stored.
+    Dropped generations are never handed out again, and a value whose generation is no longer known is not stored,
+    so a value computed before an invalidation can not be stored after it. At most 'max_entries' generations are
+    kept, the least recently used one is dropped first, together with its entries.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self._keys_by_product: dict[str, set[tuple]] = {}
+        self._generations: OrderedDict[str, int] = OrderedDict()
+        self._next_generation = itertools.count()
+
+    async def generation(self, product_id: str) -> int:
+        generation = self._generations.get(product_id)
+        if generation is not None:
+            self._generations.move_to_end(product_id)
+            return generation
+
+        generation = self._generations[product_id] = next(self._next_generation)
+        while len(self._generations) > self.max_entries:
+            self._drop(next(iter(self._generations)))
+        return generation
+
+    async def get(
+        self, product_id: str, generation: int, key: Hashable, type_: Any
+    ) -> Any:
+        entry_key = (product_id, generation, key)
+        entry = self._entries.get(entry_key)
+        if entry is None:
+            return MISSING
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(entry_key)
+            return MISSING
+
+        self._entries.move_to_end(entry_key)
+        return value
+
+    async def set(
+        self, product_id: str, generation: int, key: Hashable, type_: Any, value: Any
+    ) -> None:
+        if generation != self._generations.get(product_id):
+            # the product was invalidated (or its generation dropped) while the value was being computed
+            return
+
+        entry_key = (product_id, generation, key)
+        self._entries[entry_key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(entry_key)
+        self._keys_by_product.setdefault(product_id, set()).add(entry_key)
+
+        while len(self._entries) > self.max_entries:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+    async def invalidate(self, product_id: str) -> None:
+        self._drop(product_id)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self._keys_by_product.clear()
+        self._generations.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, entry_key: tuple):
+        self._entries.pop(entry_key, None)
+        keys = self._keys_by_product.get(entry_key[0])
+        if keys is not None:
+            keys.discard(entry_key)
+            if not keys:
+                del self._keys_by_product[entry_key[0]]
+                self._generations.pop(entry_key[0], None)
+
+    def _drop(self, product_id: str):
+        """
+        Remove the entries and the generation of a product.
+        """
+        self._generations.pop(product_id, None)
+        for entry_key in self._keys_by_product.pop(product_id, set()):
+            self._entries.pop(entry_key, None)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Cache shared by all replicas, stored in Redis. Values are stored as JSON and expire after 'ttl' seconds.
+
+    Invalidation increments the generation counter of the product, which all replicas read, so the old entries
+    are dropped everywhere at once and left to expire. The size bound is the 'maxmemory' of the Redis server,
+    which should be configured with an LRU eviction policy (e.g. 'allkeys-lru').
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str = "result-cache"):
+        if redis is None:
+            raise RuntimeError(
+                "RESULT_CACHE_BACKEND=redis requires the 'redis' package (pip install redis)"
+            )
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    def _generation_key(self, product_id: str) -> str:
+        return f"{self.prefix}:{product_id}:generation"
+
+    def _entry_key(self, product_id: str, generation: int, key: Hashable) -> str:
+        return f"{self.prefix}:{product_id}:{generation}:{key!r}"
+
+    async def generation(self, product_id: str) -> int:
+        return int(await self._redis.get(self._generation_key(product_id)) or 0)
+
+    async def get(
+        self, product_id: str, generation: int, key: Hashable, type_: Any
+    ) -> Any:
+        raw = await self._redis.get(self._entry_key(product_id, generation, key))
+        if raw is None:
+            return MISSING
+        return TypeAdapter(type_).validate_json(raw)
+
+    async def set(
+        self, product_id: str, generation: int, key: Hashable, type_: Any, value: Any
+    ) -> None:
+        await self._redis.set(
+            self._entry_key(product_id, generation, key),
+            TypeAdapter(type_).dump_json(value),
+            px=int(self.ttl * 1000),
+        )
+
+    async def invalidate(self, product_id: str) -> None:
+        await self._redis.incr(self._generation_key(product_id))
+
+    async def clear(self) -> None:
+        async for key in self._redis.scan_iter(match=f"{self.prefix}:*"):
+            await self._redis.delete(key)
+
+
+def _create_backend() -> Optional[CacheBackend]:
+    if env.RESULT_CACHE_BACKEND == "none":
+        return None
+    if env.RESULT_CACHE_BACKEND == "redis":
+        return RedisCacheBackend(env.RESULT_CACHE_URL, env.RESULT_CACHE_TTL)
+    return MemoryCacheBackend(env.RESULT_CACHE_MAX_ENTRIES, env.RESULT_CACHE_TTL)
+
+
+class ResultCache:
+    """
+    Read-through cache of the results computed from the fetches of a product (offers, price history, ...).
+
+    The results only change when a new fetch of the product is stored, which calls 'invalidate'.
+    Identical requests that miss the cache at the same time share a single computation.
+
+    Attributes:
+        _backend (Optional[CacheBackend]): Where the results are stored, created on first use from 'RESULT_CACHE_BACKEND'.
+        _in_flight (dict): The computations that are currently running, by product, generation and key.
+        hits (int): Number of results served from the cache.
+        misses (int): Number of results that had to be computed.
+        coalesced (int): Number of requests that waited for a computation started by another request.
+    """
+
+    _backend: Optional[CacheBackend] = None
+    _configured = False
+    _in_flight: dict[tuple, asyncio.Future] = {}
+    hits = 0
+    misses = 0
+    coalesced = 0
+
+    @classmethod
+    def backend(cls) -> Optional[CacheBackend]:
+        if not cls._configured:
+            cls._backend = _create_backend()
+            cls._configured = True
+        return cls._backend
+
+    @classmethod
+    def configure(cls, backend: Optional[CacheBackend]):
+        """
+        Use the given backend instead of the one configured by the environment, None disables the cache.
+        """
+        cls._backend = backend
+        cls._configured = True
+        cls._in_flight = {}
+
+    @classmethod
+    def reset(cls):
+        """
+        Forget the backend and the statistics, the backend is created again on next use.
+        """
+        cls._backend = None
+        cls._configured = False
+        cls._in_flight = {}
+        cls.hits = cls.misses = cls.coalesced = 0
+
+    @classmethod
+    async def get_or_load(
+        cls,
+        product_id,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        type_: Any,
+    ) -> Any:
+        """
+        Get a cached result, or compute it with 'loader' and cache it. Errors are not cached.
+
+        Args:
+            product_id: The product the result belongs to.
+            key (Hashable): Identifies the query and its parameters.
+            loader (Callable[[], Awaitable[Any]]): Computes the result.
+            type_: Type of the result, used by backends that serialize the values.
+        """
+        backend = cls.backend()
+        if backend is None:
+            return await loader()
+
+        product_id = str(product_id)
+        generation = await backend.generation(product_id)
+
+        value = await backend.get(product_id, generation, key, type_)
+        if value is not MISSING:
+            cls.hits += 1
+            return value
+
+        flight_key = (product_id, generation, key)
+        task = cls._in_flight.get(flight_key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            cls.misses += 1
+            task = asyncio.ensure_future(
+                cls._load(backend, product_id, generation, key, loader, type_)
+            )
+            cls._in_flight[flight_key] = task
+            task.add_done_callback(lambda done: cls._finish(flight_key, done))
+        else:
+            cls.coalesced += 1
+
+        # shield the shared computation so that a cancelled request does not cancel it for everybody else
+        return await asyncio.shield(task)
+
+    @classmethod
+    async def _load(cls, backend, product_id, generation, key, loader, type_) -> Any:
+        value = await loader()
+        await backend.set(product_id, generation, key, type_, value)
+        return value
+
+    @classmethod
+    def _finish(cls, flight_key: tuple, task: asyncio.Future):
+        if cls._in_flight.get(flight_key) is task:
+            del cls._in_flight[flight_key]
+        if not task.cancelled():
+            # mark the error as retrieved, it was raised to the requests that waited for it
+            task.exception()
+
+    @classmethod
+    async def invalidate(cls, product_id):
+        """
+        Drop the cached results of a product. Called whenever a new fetch of the product is committed.
+        """
+        backend = cls.backend()
+        if backend is None:
+            return
+
+        try:
+            await backend.invalidate(str(product_id))
+        except Exception as e:
+            logger.error("Failed to invalidate cached results of product %s: %s", product_id, e)
@@ -1,26 +1,118 @@
-from contextlib import contextmanager
-from typing import Any, Generator
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncGenerator, Generator, Optional
 
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm.session import Session
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from .logger import get_logger
 from .env import DATABASE_URL
 
 logger = get_logger(__name__)
 
-engine = create_engine(
-    DATABASE_URL,
-)
+# async drivers used for the databases we support
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_url(database_url: str) -> URL:
+    """
+    Convert the configured database URL to one that uses an async driver,
+    e.g. postgresql://... becomes postgresql+asyncpg://...
+    """
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url
+
+
+def _async_engine_kwargs(url: URL) -> dict:
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # every connection to an in-memory database gets its own database, so all sessions share one connection
+        return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    return {}
+
+
+def _enable_sqlite_foreign_keys(engine: Engine):
+    """
+    SQLite ignores foreign keys (and their ON DELETE CASCADE) unless they are enabled for every connection.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+# The engines are created on first use rather than at import, so that importing the app (e.g. to build it with
+# 'main.create_app', run a migration or a script) neither loads the database drivers nor opens a connection pool.
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+
+SessionMkr = sessionmaker()
+
+# objects are not expired on commit, as reloading them would require an implicit (and in async forbidden) query
+AsyncSessionMkr = async_sessionmaker(expire_on_commit=False)
+
 
-SessionMkr = sessionmaker(bind=engine)
+def get_engine() -> Engine:
+    """Get the engine of the configured database, creating it on first use."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(DATABASE_URL)
+        _enable_sqlite_foreign_keys(_engine)
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """Get the async engine of the configured database, creating it on first use."""
+    global _async_engine
+    if _async_engine is None:
+        async_url = get_async_url(DATABASE_URL)
+        _async_engine = create_async_engine(async_url, **_async_engine_kwargs(async_url))
+        _enable_sqlite_foreign_keys(_async_engine.sync_engine)
+    return _async_engine
+
+
+async def dispose_engines():
+    """Close the connection pools of the engines that were created. They are created again on next use."""
+    global _engine, _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def __getattr__(name: str):
+    # 'db.engine' and 'db.async_engine' are still available, they create the engines when accessed
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 @contextmanager
 def session_scope() -> Generator[Session, Any, None]:
     """Provide a transactional scope around a series of operations."""
-    session = SessionMkr()
+    session = SessionMkr(bind=get_engine())
     try:
         yield session
         session.commit()
@@ -29,3 +121,17 @@ def session_scope() -> Generator[Session, Any, None]:
         raise
     finally:
         session.close()
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncGenerator[AsyncSession, None]:
+    """Provide an async transactional scope around a series of operations."""
+    session = AsyncSessionMkr(bind=get_async_engine())
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -1,2 +1,3 @@
 from .products import router as products_router
 from .auth import router as auth_router
+from .jobs import router as jobs_router
@@ -3,7 +3,7 @@ from fastapi.routing import APIRouter
 from ..exceptions.internal import InvalidLogin
 
 from ..logger import get_logger
-from ..auth import create_token, fake_users_db, validate_password
+from ..auth import PasswordVerifier, create_token, get_credentials
 from ..pydantic_models import AuthModel
 
 
@@ -16,7 +16,7 @@ logger = get_logger(__name__)
 
 
 @router.post("/token")
-def login(authData: AuthModel) -> dict[str, str]:
+async def login(authData: AuthModel) -> dict[str, str]:
     """
     Authenticate user and generate an access token.
 
@@ -28,14 +28,16 @@ def login(authData: AuthModel) -> dict[str, str]:
 
     Raises:
     - InvalidLogin: If the user is not found or the password is invalid.
+    - LoginUnavailableError: If too many logins are waiting for their password to be verified.
     """
 
-    if authData.username not in fake_users_db or not validate_password(
-        authData.password, fake_users_db[authData.username]
+    credentials = get_credentials()
+    if authData.username not in credentials or not await PasswordVerifier.verify(
+        authData.password, credentials[authData.username]
     ):
         raise InvalidLogin(f"User does not exist or the password is invalid")
 
     token: str = create_token(authData.username)
-    logger.debug(f"Token created for user {authData.username}")
+    logger.debug("Token created for user %s", authData.username)
 
     return {"token": token}
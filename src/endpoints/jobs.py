@@ -0,0 +1,37 @@
+import uuid
+
+from fastapi import APIRouter, Depends
+
+from ..auth import auth_wrapper
+from ..pydantic_models import JobModel
+from ..services import JobService
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+router = APIRouter()
+
+
+def _get_job_service() -> JobService:
+    return JobService()
+
+
+@router.get("/jobs/{job_id}", response_model=JobModel, status_code=200)
+async def get_job(
+    job_id: uuid.UUID,
+    _=Depends(auth_wrapper),
+    service: JobService = Depends(_get_job_service),
+) -> JobModel:
+    """
+    Get the status of the background registration and first fetch of an asynchronously created product.
+
+    Parameters:
+    - job_id (uuid.UUID): ID of the job, returned by `POST /products/?async=true`.
+
+    Returns:
+    - JobModel: The job. `status` is `pending`, `running`, `done` or `failed`, a failed attempt is
+      retried while the status is `pending` and the error of the last attempt is in `error`.
+
+    Raises:
+    - EntityNotFound: If the job does not exist.
+    """
+    return await service.get_job(job_id)
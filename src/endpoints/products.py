@@ -1,12 +1,19 @@
+import csv
+import io
+from typing import Literal, Optional, Union
 import uuid
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 
-from src.exceptions.internal import InvalidTimeRangeError
+from src.exceptions.internal import InvalidBucketError, InvalidTimeRangeError
 
 from ..auth import auth_wrapper
+from ..bulk import iter_items
 from ..pydantic_models import (
+    BulkImportResult,
     CreateProductModel,
+    JobModel,
     OfferModel,
     OfferPriceDiff,
     OfferPriceSummary,
@@ -14,10 +21,13 @@ from ..pydantic_models import (
 )
 from ..services import ProductService
 from ..logger import get_logger
+from ..util import parse_bucket
 
 logger = get_logger(__name__)
 router = APIRouter()
 
+MAX_PAGE_SIZE = 1000
+
 
 # unnecessary dependency injection. I've left it here to show that I know how to use it.
 # It could have been useful for testing if these functions were complex enough to require mocking.
@@ -27,42 +37,102 @@ def _get_product_service() -> ProductService:
 
 @router.get("/products/", response_model=list[ProductModel], status_code=200)
 async def read_products(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[uuid.UUID] = Query(None),
+    stream: bool = Query(False),
     service: ProductService = Depends(_get_product_service),
-) -> list[ProductModel]:
+):
     """
-    Get all products from the database.
+    Get products from the database, ordered by id.
+
+    Parameters:
+    - limit (int, optional): Maximum number of products to return. All products are returned if not set.
+    - after (uuid.UUID, optional): Return only products after this id. Use the `X-Next-Cursor` header
+      of the previous page.
+    - stream (bool, optional): Stream all products as newline delimited JSON (`application/x-ndjson`).
+      `limit` and `after` are ignored.
 
     Returns:
-    - list[ProductModel]: List of all products.
+    - list[ProductModel]: List of products. If there may be more products, the id to pass as `after`
+      to get the next page is in the `X-Next-Cursor` header.
 
     """
-    return await service.read_products()
+    if stream:
+
+        async def ndjson():
+            async for product in service.stream_products():
+                yield product.model_dump_json() + "\n"
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    products = await service.read_products(limit=limit, after=after)
 
+    if limit is not None and len(products) == limit:
+        response.headers["X-Next-Cursor"] = str(products[-1].id)
 
-@router.post("/products/", response_model=ProductModel, status_code=201)
+    return products
+
+
+@router.post(
+    "/products/", response_model=Union[ProductModel, JobModel], status_code=201
+)
 async def create_product(
     data: CreateProductModel,
+    response: Response,
+    run_async: bool = Query(False, alias="async"),
     _=Depends(
         auth_wrapper
     ),  # we are not using the user object here, we are just checking that the user is authenticated
     service: ProductService = Depends(_get_product_service),
-) -> ProductModel:
+) -> Union[ProductModel, JobModel]:
     """
     Create a new product and register it.
 
     Parameters:
     - data (CreateProductModel): Data of the product to create.
+    - async (bool, optional): Return `202 Accepted` as soon as the product is stored, and register it and fetch
+      its offers in the background. The status of that is reported by `GET /jobs/{id}`, see the `Location` header.
 
     Returns:
     - ProductModel: The created product.
+    - JobModel: The background job, with `async=true`.
 
     Raises:
     - CustomException: If the product data is invalid.
     - ProductRegistrationError: If the product registration failed.
     """
+    if run_async:
+        job = await service.create_product_async(data)
+        response.status_code = 202
+        response.headers["Location"] = f"/jobs/{job.id}"
+        return job
+
     return await service.create_product(data)
 
 
+@router.post("/products/bulk", response_model=BulkImportResult, status_code=200)
+async def import_products(
+    request: Request,
+    _=Depends(auth_wrapper),
+    service: ProductService = Depends(_get_product_service),
+) -> BulkImportResult:
+    """
+    Create many products at once.
+
+    The body is a JSON array of products (`{"name": ..., "description": ...}`), or one product per line with
+    `Content-Type: application/x-ndjson`. It is processed while it is being uploaded, the products are stored in
+    batches and registered at the offers API. Their offers are fetched by the periodic fetching.
+
+    Returns:
+    - BulkImportResult: The number of products per status, and the id, status and error of every item
+      in the order of the body.
+    """
+    return await service.import_products(
+        iter_items(request.stream(), request.headers.get("content-type", ""))
+    )
+
+
 @router.put("/products/{product_id}", status_code=200)
 async def update_product(
     product_id: uuid.UUID,
@@ -140,6 +210,7 @@ async def get_price_history(
     product_id: uuid.UUID,
     from_time: int = Query(...),
     to_time: int = Query(...),
+    bucket: Optional[str] = Query(None),
     service: ProductService = Depends(_get_product_service),
 ) -> list[OfferPriceSummary]:
     """
@@ -149,18 +220,28 @@ async def get_price_history(
     - product_id (str): ID of the product to get price history for.
     - from_time (float): Start time for the history.
     - to_time (float): End time for the history.
+    - bucket (str, optional): Combine the fetches into buckets of this size, e.g. 5m, 1h or 1d.
+      The `count` of a bucket is the number of fetches in it.
 
     Returns:
     - list[OfferPriceSummary]: List of price summaries for the product.
 
     Raises:
     - EntityNotFound: If the product does not exist.
+    - InvalidBucketError: If the bucket size is not valid.
     """
 
     if from_time > to_time:
         raise InvalidTimeRangeError("Start time cannot be greater than end time")
 
-    return await service.get_price_history(product_id, from_time, to_time)
+    bucket_size = None
+    if bucket is not None:
+        try:
+            bucket_size = parse_bucket(bucket)
+        except ValueError:
+            raise InvalidBucketError()
+
+    return await service.get_price_history(product_id, from_time, to_time, bucket_size)
 
 
 @router.get(
@@ -194,3 +275,64 @@ async def get_price_diff(
         raise InvalidTimeRangeError("Start time cannot be greater than end time")
 
     return await service.get_price_change(product_id, from_time, to_time)
+
+
+EXPORT_FIELDS = list(OfferPriceSummary.model_fields)
+
+
+@router.get("/products/{product_id}/price-history/export", status_code=200)
+async def export_price_history(
+    product_id: uuid.UUID,
+    from_time: int = Query(...),
+    to_time: int = Query(...),
+    format: Literal["ndjson", "csv"] = Query("ndjson"),
+    service: ProductService = Depends(_get_product_service),
+) -> StreamingResponse:
+    """
+    Stream the price history of a product, oldest first. Unlike `/price-history`, the history is sent
+    while it is being read from the database, so it is suitable for long time ranges.
+
+    Parameters:
+    - product_id (str): ID of the product to get price history for.
+    - from_time (float): Start time for the history.
+    - to_time (float): End time for the history.
+    - format (str): `ndjson` (one JSON price summary per line) or `csv` (with a header row).
+
+    Returns:
+    - StreamingResponse: The price summaries of the product.
+
+    Raises:
+    - EntityNotFound: If the product does not exist.
+    """
+
+    if from_time > to_time:
+        raise InvalidTimeRangeError("Start time cannot be greater than end time")
+
+    summaries = await service.stream_price_history(product_id, from_time, to_time)
+
+    if format == "csv":
+
+        async def csv_rows():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+
+            def flush() -> str:
+                rows = buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                return rows
+
+            # the header is sent right away, also when the time range is empty
+            writer.writeheader()
+            yield flush()
+            async for summary in summaries:
+                writer.writerow(summary.model_dump())
+                yield flush()
+
+        return StreamingResponse(csv_rows(), media_type="text/csv")
+
+    async def ndjson():
+        async for summary in summaries:
+            yield summary.model_dump_json() + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
@@ -1,4 +1,6 @@
 import os
+import socket
+import uuid
 from dotenv import load_dotenv
 
 from .exceptions.internal import EnvironmentVariableNotSet
@@ -28,8 +30,121 @@ DATABASE_URL = get_required_env_variable("DATABASE_URL")
 API_URL: str = os.getenv("API_URL", "https://python.exercise.applifting.cz/api/v1")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 JWT_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_TOKEN_EXPIRE_MINUTES", 30))
+# JSON file with the password hashes of the users by username (see auth.hash_password). The demo users if not set
+CREDENTIALS_FILE = os.getenv("CREDENTIALS_FILE")
+# Number of processes verifying passwords on login, see auth.PasswordVerifier. 0 verifies them in the thread pool
+AUTH_VERIFY_WORKERS = int(os.getenv("AUTH_VERIFY_WORKERS", 2))
+# Maximum number of logins waiting for a free verification process, further logins are rejected with 503
+AUTH_VERIFY_QUEUE = int(os.getenv("AUTH_VERIFY_QUEUE", 8))
+# Maximum number of verified bearer tokens remembered, so that they are not verified on every request. 0 disables it
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 10000))
 
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# "text" for colored console logs, "json" for one JSON object per line, see logger.py
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# At most LOG_SAMPLE_BURST repetitions of the same warning or error are logged per LOG_SAMPLE_WINDOW seconds,
+# the rest are counted and reported with the next one logged. 0 logs every repetition
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 5))
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", 60))
 
 PERIODIC_FETCH_INTERVAL = int(os.getenv("PERIODIC_FETCH_INTERVAL", 60))
+
+# Maximum number of products fetched at the same time during one cycle. 1 means sequential fetching.
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 10))
+# Deadline for a whole fetch cycle in seconds. Products that were not fetched by then are skipped until the next cycle.
+FETCH_CYCLE_TIMEOUT = float(os.getenv("FETCH_CYCLE_TIMEOUT", PERIODIC_FETCH_INTERVAL))
+# Maximum time in seconds a single product fetch may take before it is considered failed.
+FETCH_PRODUCT_TIMEOUT = float(os.getenv("FETCH_PRODUCT_TIMEOUT", 30))
+
+# Settings of the shared HTTP client used for the offers API
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", 10))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5))
+# Requires the optional 'h2' package (pip install 'httpx[http2]')
+UPSTREAM_HTTP2 = not not os.getenv("UPSTREAM_HTTP2", False)
+
+# Seconds before the offers API token expires when it gets refreshed
+UPSTREAM_TOKEN_REFRESH_MARGIN = float(os.getenv("UPSTREAM_TOKEN_REFRESH_MARGIN", 60))
+
+# Maximum rate of requests to the offers API per second, shared by all requests of this process. 0 disables the limit
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", 20))
+# Number of requests that may be sent at once after a quiet period - Default is UPSTREAM_RATE_LIMIT
+UPSTREAM_RATE_BURST = float(os.getenv("UPSTREAM_RATE_BURST", UPSTREAM_RATE_LIMIT))
+# Maximum number of retries of a failed request, and the bounds of the exponential backoff between them in seconds
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 3))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", 0.5))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", 10))
+# Retries allowed per request on average, and the number of retries that can be saved up for bursts of failures
+UPSTREAM_RETRY_BUDGET = float(os.getenv("UPSTREAM_RETRY_BUDGET", 0.2))
+UPSTREAM_RETRY_BUDGET_CAPACITY = float(os.getenv("UPSTREAM_RETRY_BUDGET_CAPACITY", 10))
+# Consecutive failed requests after which requests fail immediately, and for how many seconds. 0 disables the breaker
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", 5))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", 30))
+
+# How the offer fetching is split between multiple replicas of the application:
+#   none  - every replica fetches all products
+#   lease - products are claimed through leases stored in the database, every product is fetched by one replica
+FETCH_COORDINATION = os.getenv("FETCH_COORDINATION", "none")
+# Seconds a claimed product stays reserved for a worker - Default is PERIODIC_FETCH_INTERVAL
+FETCH_LEASE_TTL = float(os.getenv("FETCH_LEASE_TTL", PERIODIC_FETCH_INTERVAL))
+# Number of products claimed at once - Default is 2 * FETCH_CONCURRENCY
+FETCH_LEASE_BATCH = int(os.getenv("FETCH_LEASE_BATCH", 2 * FETCH_CONCURRENCY))
+# Identifier of this worker in the leases - Default is unique for every process
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+
+# How often every product is fetched:
+#   fixed    - all products every PERIODIC_FETCH_INTERVAL seconds
+#   adaptive - every product on its own interval between FETCH_MIN_INTERVAL and FETCH_MAX_INTERVAL, shorter for
+#              products whose offers change often and longer for stable ones, see scheduler.py
+FETCH_SCHEDULE = os.getenv("FETCH_SCHEDULE", "fixed")
+# Bounds of the adaptive fetch interval in seconds - Defaults are PERIODIC_FETCH_INTERVAL / 2 and 10 * PERIODIC_FETCH_INTERVAL
+FETCH_MIN_INTERVAL = float(os.getenv("FETCH_MIN_INTERVAL", PERIODIC_FETCH_INTERVAL / 2))
+FETCH_MAX_INTERVAL = float(os.getenv("FETCH_MAX_INTERVAL", 10 * PERIODIC_FETCH_INTERVAL))
+# Fraction by which the adaptive fetch times are randomly moved, so that the fetches spread over the interval
+FETCH_JITTER = float(os.getenv("FETCH_JITTER", 0.1))
+
+# Number of background jobs (registration and first fetch of asynchronously created products) run at the same time
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 4))
+# Attempts of a failing job, and the delay in seconds before the first retry (doubled with every attempt)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", 10))
+# Seconds a running job stays reserved for its worker before another worker may take it over
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", 300))
+# Seconds between checks for jobs to run, e.g. jobs of a replica that stopped or jobs waiting for a retry
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 5))
+
+# Number of products inserted per transaction by the bulk import
+BULK_IMPORT_BATCH = int(os.getenv("BULK_IMPORT_BATCH", 1000))
+# Maximum number of products of a bulk import registered at the offers API at the same time
+BULK_REGISTER_CONCURRENCY = int(os.getenv("BULK_REGISTER_CONCURRENCY", 20))
+
+# Where the results computed from the fetches (offers, price history, price change) are cached:
+#   memory - in the process, bounded by RESULT_CACHE_MAX_ENTRIES
+#   redis  - in Redis at RESULT_CACHE_URL, shared by all replicas (requires the 'redis' package)
+#   none   - no caching
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 10000))
+# Seconds a cached result is kept - Default is PERIODIC_FETCH_INTERVAL
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", PERIODIC_FETCH_INTERVAL))
+RESULT_CACHE_URL = os.getenv("RESULT_CACHE_URL", "redis://localhost:6379/0")
+
+# Number of fetches deleted per transaction when the history of a deleted product is purged.
+# Products with more fetches than this are purged in the background after the delete request returns.
+PRODUCT_PURGE_BATCH = int(os.getenv("PRODUCT_PURGE_BATCH", 1000))
+# Seconds between checks for deleted products whose history was not purged yet
+PRODUCT_PURGE_INTERVAL = float(os.getenv("PRODUCT_PURGE_INTERVAL", 60))
+
+# Days the offers of every fetch are kept, older fetches only keep their price summary. 0 (the default) keeps them
+# forever, the offers of compacted snapshots can not be restored
+SNAPSHOT_RETENTION_DAYS = float(os.getenv("SNAPSHOT_RETENTION_DAYS", 0))
+# Number of snapshots compacted per transaction
+COMPACTION_BATCH = int(os.getenv("COMPACTION_BATCH", 500))
+# Maximum number of batches per compaction run, the rest is compacted in the next run
+COMPACTION_MAX_BATCHES = int(os.getenv("COMPACTION_MAX_BATCHES", 100))
+# Seconds between compaction runs
+COMPACTION_INTERVAL = float(os.getenv("COMPACTION_INTERVAL", 60 * 60))
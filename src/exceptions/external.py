@@ -22,6 +22,13 @@ class OffersFetchError(ExternalApiException):
         super().__init__(status_code=500, detail=detail)
 
 
+class UpstreamUnavailableError(ExternalApiException):
+    """Exception raised when requests to the offers API are rejected by the open circuit breaker."""
+
+    def __init__(self, detail="Offers API is unavailable, try again later"):
+        super().__init__(status_code=503, detail=detail)
+
+
 class ProductRegistrationError(ExternalApiException):
     """Exception raised for errors in the product registration process."""
 
@@ -43,6 +43,13 @@ class InvalidLogin(InternalApiException):
         super().__init__(status_code=401, detail=detail)
 
 
+class LoginUnavailableError(InternalApiException):
+    """Exception raised when too many logins are already waiting for their password to be verified."""
+
+    def __init__(self, detail="Too many logins, try again later"):
+        super().__init__(status_code=503, detail=detail)
+
+
 class InvalidTimeRangeError(InternalApiException):
     """Exception raised for errors caused by invalid time range."""
 
@@ -76,3 +83,10 @@ class InvalidProductData(InternalApiException):
 
     def __init__(self, detail="Invalid product data"):
         super().__init__(status_code=400, detail=detail)
+
+
+class InvalidBucketError(InternalApiException):
+    """Exception raised for errors caused by invalid bucket size."""
+
+    def __init__(self, detail="Invalid bucket size, use e.g. 30s, 5m, 1h or 1d"):
+        super().__init__(status_code=400, detail=detail)
@@ -0,0 +1,81 @@
+from typing import Optional
+
+import httpx
+
+import src.env as env
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def _http2_available() -> bool:
+    """
+    HTTP/2 support in httpx requires the optional 'h2' package (installed with 'httpx[http2]').
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class UpstreamClient:
+    """
+    Holder of the long-lived HTTP client used for every request to the offers API.
+
+    Sharing one client lets httpx keep connections to the API alive between requests, so we only pay for
+    the TCP and TLS handshake once per pooled connection instead of once per request.
+
+    Attributes:
+        _client (Optional[httpx.AsyncClient]): The shared client, or None if it was not created yet.
+    """
+
+    _client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def _create_client(cls) -> httpx.AsyncClient:
+        http2 = env.UPSTREAM_HTTP2
+        if http2 and not _http2_available():
+            logger.warning(
+                "UPSTREAM_HTTP2 is enabled but the 'h2' package is not installed, falling back to HTTP/1.1"
+            )
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=env.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=env.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=env.UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            env.UPSTREAM_TIMEOUT, connect=env.UPSTREAM_CONNECT_TIMEOUT
+        )
+
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+
+    @classmethod
+    def start(cls) -> httpx.AsyncClient:
+        """
+        Creates the shared client. Called once on application startup.
+        """
+        if cls._client is None or cls._client.is_closed:
+            logger.debug("Starting upstream HTTP client")
+            cls._client = cls._create_client()
+        return cls._client
+
+    @classmethod
+    async def stop(cls):
+        """
+        Closes the shared client and all of its pooled connections. Called once on application shutdown.
+        """
+        if cls._client is not None:
+            logger.debug("Stopping upstream HTTP client")
+            await cls._client.aclose()
+            cls._client = None
+
+    @classmethod
+    def get(cls) -> httpx.AsyncClient:
+        """
+        Returns the shared client, creating it if the application lifecycle did not do so (e.g. in scripts).
+        """
+        return cls.start()
@@ -0,0 +1,155 @@
+import time
+from typing import Optional
+import uuid
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .db import async_session_scope
+from .orm_models import Job, Product
+from .offers import fetch_products, register_product
+import src.env as env
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# A product created asynchronously is only inserted into the database by the request. Its registration at the
+# offers API and the first fetch of its offers are done by a job, stored in the database together with the product.
+# The jobs are run by the JobWorker of the replica that created them right away, and picked up by any replica
+# polling for due jobs otherwise (e.g. after a restart). A running job is reserved for its worker for JOB_LEASE_TTL
+# seconds, so a job of a worker that died is taken over once that time passes.
+# A failed job is retried after JOB_RETRY_DELAY seconds (doubling with every attempt) up to JOB_MAX_ATTEMPTS times.
+# Steps that already succeeded (the registration) are not repeated.
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+async def create_job(session: AsyncSession, product_id: uuid.UUID) -> Job:
+    """
+    Add a pending job for a product created in the same transaction.
+    """
+    now = time.time()
+    job = Job(
+        id=uuid.uuid4(),
+        product_id=product_id,
+        status=PENDING,
+        registered=False,
+        fetched=False,
+        attempts=0,
+        created_at=now,
+        updated_at=now,
+        run_after=0,
+    )
+    session.add(job)
+    return job
+
+
+def _is_due(now: float):
+    return or_(Job.status == PENDING, Job.status == RUNNING) & (Job.run_after <= now)
+
+
+async def due_job_ids(session: AsyncSession, limit: int) -> list[uuid.UUID]:
+    """
+    Get up to 'limit' ids of pending jobs whose time came and of running jobs whose worker gave up on them.
+    """
+    now = time.time()
+    return list(
+        await session.scalars(
+            select(Job.id).where(_is_due(now)).order_by(Job.run_after).limit(limit)
+        )
+    )
+
+
+async def claim_job(session: AsyncSession, job_id: uuid.UUID, owner: str) -> bool:
+    """
+    Reserve a due job for 'owner' for the next 'JOB_LEASE_TTL' seconds.
+
+    Returns:
+        bool: Whether the job was claimed, False if it is not due or another worker claimed it first.
+    """
+    now = time.time()
+    result = await session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .where(_is_due(now))
+        .values(
+            status=RUNNING,
+            owner=owner,
+            attempts=Job.attempts + 1,
+            run_after=now + env.JOB_LEASE_TTL,
+            updated_at=now,
+        )
+    )
+    return result.rowcount == 1
+
+
+async def _update_job(job_id: uuid.UUID, owner: str, **values) -> None:
+    async with async_session_scope() as session:
+        await session.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .where(Job.owner == owner)
+            .values(updated_at=time.time(), **values)
+        )
+
+
+async def run_job(job_id: uuid.UUID, owner: str) -> Optional[str]:
+    """
+    Claim a job and register the product and fetch its offers.
+
+    Returns:
+        Optional[str]: The status of the job afterwards, None if the job could not be claimed.
+    """
+    async with async_session_scope() as session:
+        if not await claim_job(session, job_id, owner):
+            return None
+
+    async with async_session_scope() as session:
+        job = await session.get(Job, job_id)
+        product = await session.scalar(
+            select(Product)
+            .where(Product.id == job.product_id)
+            .where(Product.deleted_at.is_(None))
+        )
+
+    # no connection is held while the offers API is called
+    if product is None:
+        await _update_job(job_id, owner, status=FAILED, error="Product was deleted")
+        return FAILED
+
+    try:
+        if not job.registered:
+            await register_product(product)
+            await _update_job(job_id, owner, registered=True)
+
+        await fetch_products(product)
+    except Exception as e:
+        return await _fail_job(job, owner, e)
+
+    await _update_job(job_id, owner, status=DONE, fetched=True, error=None)
+    logger.info("Job %s of product %s done", job_id, product.id)
+    return DONE
+
+
+async def _fail_job(job: Job, owner: str, error: Exception) -> str:
+    detail = getattr(error, "detail", None) or str(error)
+    if job.attempts >= env.JOB_MAX_ATTEMPTS:
+        logger.error("Job %s failed after %d attempts: %s", job.id, job.attempts, detail)
+        await _update_job(job.id, owner, status=FAILED, error=detail)
+        return FAILED
+
+    delay = env.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+    logger.warning("Job %s failed, retrying in %.0fs: %s", job.id, delay, detail)
+    await _update_job(
+        job.id,
+        owner,
+        status=PENDING,
+        error=detail,
+        run_after=time.time() + delay,
+    )
+    return PENDING
@@ -0,0 +1,95 @@
+import time
+from typing import Optional
+import uuid
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .orm_models import FetchLease, Product
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Products are split between replicas with leases stored in the database. Every product has a lease row, a worker
+# claims a batch of products whose leases expired and reserves them for FETCH_LEASE_TTL seconds. Because the claim
+# skips rows locked by other workers (SELECT ... FOR UPDATE SKIP LOCKED), concurrent workers always get disjoint
+# batches. When a replica dies, its leases simply expire and the products are claimed by the remaining replicas.
+
+
+async def ensure_leases(session: AsyncSession) -> None:
+    """
+    Create an (expired) lease for every product that does not have one yet.
+    """
+    dialect = session.get_bind().dialect.name
+    dialect_insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+
+    missing = (
+        select(Product.id)
+        .where(Product.deleted_at.is_(None))
+        .where(
+            ~select(FetchLease.product_id)
+            .where(FetchLease.product_id == Product.id)
+            .exists()
+        )
+    )
+    await session.execute(
+        dialect_insert(FetchLease)
+        .from_select(["product_id"], missing)
+        .on_conflict_do_nothing(index_elements=[FetchLease.product_id])
+    )
+
+
+async def claim_products(
+    session: AsyncSession, owner: str, ttl: float, limit: int
+) -> list[uuid.UUID]:
+    """
+    Claim up to 'limit' products whose leases expired for 'owner' for the next 'ttl' seconds.
+
+    Args:
+        owner (str): Identifier of the claiming worker.
+        ttl (float): Number of seconds the products stay reserved for the worker.
+        limit (int): Maximum number of products to claim.
+
+    Returns:
+        list[uuid.UUID]: Ids of the claimed products.
+    """
+    now = time.time()
+
+    expired = (
+        select(FetchLease.product_id)
+        .where(FetchLease.expires_at <= now)
+        .order_by(FetchLease.expires_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+
+    result = await session.execute(
+        update(FetchLease)
+        .where(FetchLease.product_id.in_(expired.scalar_subquery()))
+        .values(owner=owner, expires_at=now + ttl)
+        .returning(FetchLease.product_id)
+    )
+    product_ids = list(result.scalars())
+
+    logger.debug("Worker %s claimed %d products", owner, len(product_ids))
+    return product_ids
+
+
+async def release_leases(session: AsyncSession, owner: str) -> None:
+    """
+    Expire all leases of 'owner', so that other workers can claim its products right away.
+    """
+    await session.execute(
+        update(FetchLease).where(FetchLease.owner == owner).values(expires_at=0)
+    )
+
+
+async def next_lease_expiry(session: AsyncSession) -> Optional[float]:
+    """
+    Get the time the next lease expires at, None if there are no leases.
+    """
+    return await session.scalar(select(func.min(FetchLease.expires_at)))
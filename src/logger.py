@@ -1,43 +1,199 @@
+import atexit
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import threading
+import time
+from typing import Optional
 
-from .env import LOG_LEVEL
+from .env import LOG_FORMAT, LOG_LEVEL, LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW
 from colorlog import ColoredFormatter
 
 
+# Records are put on a queue by the thread that logs them and written to stderr by a listener thread, so that
+# logging never blocks the event loop on a slow terminal or pipe. The process has a single QueueHandler on the root
+# logger; the loggers of the modules only set their level and propagate to it.
+#
+# Log with %-style arguments (logger.debug("Fetched %d offers", count)) instead of f-strings: the message is only
+# formatted if the level is enabled, and repeated messages share their template, which is what the sampling of
+# repeated warnings and errors counts.
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object on one line, for log collectors.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(ColoredFormatter):
+    """
+    The colored console format, noting how many repetitions of the message were suppressed before it.
+    """
+
+    def __init__(self):
+        super().__init__(
+            "%(log_color)s%(levelname)-8s%(reset)s %(white)s%(message)s",
+            datefmt=None,
+            reset=True,
+            log_colors={
+                "DEBUG": "cyan",
+                "INFO": "green",
+                "WARNING": "yellow",
+                "ERROR": "red",
+                "CRITICAL": "red,bg_white",
+            },
+            secondary_log_colors={},
+            style="%",
+        )
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        return message
+
+
+class RepeatSampler(logging.Filter):
+    """
+    Lets through at most 'burst' warnings and errors with the same logger, level and message template per 'window'
+    seconds, e.g. the same failure of every product in a fetch cycle. The first record let through after some were
+    dropped carries their number in its 'suppressed' attribute. Debug and info records are not sampled.
+    """
+
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        # key -> (start of the window, records in the window, records suppressed)
+        self._counts: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno < logging.WARNING:
+            return True
+
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None or now - counts[0] >= self.window:
+                if len(self._counts) > 10000:
+                    # forget the windows that ended, they would be restarted anyway
+                    self._counts = {
+                        k: c for k, c in self._counts.items() if now - c[0] < self.window
+                    }
+                suppressed = counts[2] if counts is not None else 0
+                self._counts[key] = [now, 1, 0]
+            elif counts[1] < self.burst:
+                counts[1] += 1
+                suppressed = 0
+            else:
+                counts[2] += 1
+                return False
+
+        record.suppressed = suppressed
+        return True
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    Only merges the arguments into the message before the record is queued (they may change afterwards),
+    the formatting itself is left to the listener thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # tracebacks can not be pickled or kept alive, format them while they exist
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[QueueHandler] = None
+_pid: Optional[int] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging() -> QueueHandler:
+    """
+    Installs the queue handler and starts the listener writing to stderr, once per process. A forked process
+    (e.g. a uvicorn worker) does not inherit the listener thread, so it installs its own.
+    """
+    global _listener, _handler, _pid
+    with _setup_lock:
+        if _handler is not None and _pid == os.getpid():
+            return _handler
+
+        root = logging.getLogger()
+        if _handler is not None:
+            root.removeHandler(_handler)
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(
+            JsonFormatter() if LOG_FORMAT == "json" else TextFormatter()
+        )
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        _handler = _LazyQueueHandler(log_queue)
+        _handler.addFilter(RepeatSampler(LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW))
+        root.addHandler(_handler)
+
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        _pid = os.getpid()
+        return _handler
+
+
+def stop_logging():
+    """
+    Writes the records still in the queue and stops the listener. Called when the process exits.
+    """
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None and _pid == os.getpid():
+            _listener.stop()
+        if _handler is not None:
+            logging.getLogger().removeHandler(_handler)
+        _listener = None
+        _handler = None
+
+
+atexit.register(stop_logging)
+
+
 def get_logger(name: str) -> logging.Logger:
     """
-    Creates and returns a logger with the given name.
+    Returns the logger with the given name, with the level set in the LOG_LEVEL environment variable.
 
-    The logger will have a level set as defined in the LOG_LEVEL environment variable and
-    will have a console handler that outputs colored logs.
+    The logger has no handler of its own, its records are passed to the single queue handler of the process.
 
     :param name: The name of the logger.
-    :return: A logger with the given name, a set level, and a console handler.
+    :return: A logger with the given name and a set level.
     """
+    setup_logging()
     logger = logging.getLogger(name)
     logger.setLevel(LOG_LEVEL)
-
-    formatter = ColoredFormatter(
-        "%(log_color)s%(levelname)-8s%(reset)s %(white)s%(message)s",
-        datefmt=None,
-        reset=True,
-        log_colors={
-            "DEBUG": "cyan",
-            "INFO": "green",
-            "WARNING": "yellow",
-            "ERROR": "red",
-            "CRITICAL": "red,bg_white",
-        },
-        secondary_log_colors={},
-        style="%",
-    )
-
-    # Create a console handler and add the formatter to it
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-
-    # Add the console handler to the logger
-    logger.addHandler(console_handler)
     return logger
-
-    # create console handler with a higher log level
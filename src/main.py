@@ -1,30 +1,50 @@
 from fastapi import FastAPI
 
-from .background import OfferWorker
+from .auth import PasswordVerifier
+from .background import CompactionWorker, JobWorker, OfferWorker, PurgeWorker
+from .db import dispose_engines
+from .http_client import UpstreamClient
 
 from .middleware import ExceptionMiddleware
 
 
-from .endpoints import products_router, auth_router
+from .endpoints import products_router, auth_router, jobs_router
 
 
-def start_app() -> FastAPI:
+async def startup_event():
+    UpstreamClient.start()
+    OfferWorker.start()
+    PurgeWorker.start()
+    CompactionWorker.start()
+    JobWorker.start()
+
+
+async def shutdown_event():
+    OfferWorker.stop()
+    PurgeWorker.stop()
+    CompactionWorker.stop()
+    JobWorker.stop()
+    await OfferWorker.release()
+    PasswordVerifier.stop()
+    await UpstreamClient.stop()
+    await dispose_engines()
+
+
+def create_app() -> FastAPI:
+    """
+    Build the app. Nothing expensive happens here: the database engines, the HTTP client and the background
+    workers are only created when the app starts, so 'uvicorn --factory src.main:create_app' starts quickly.
+    """
     app = FastAPI()
     app.add_middleware(ExceptionMiddleware)
     app.include_router(products_router)
     app.include_router(auth_router)
+    app.include_router(jobs_router)
 
-    return app
-
+    app.add_event_handler("startup", startup_event)
+    app.add_event_handler("shutdown", shutdown_event)
 
-app = start_app()
-
-
-@app.on_event("startup")
-async def startup_event():
-    OfferWorker.start()
+    return app
 
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    OfferWorker.stop()
+app = create_app()
@@ -15,13 +15,13 @@ class ExceptionMiddleware(BaseHTTPMiddleware):
         try:
             response = await call_next(request)
         except CustomException as e:
-            logger.error(f"Custom Exception: {str(e)}")
+            logger.error("Custom Exception: %s", e)
             response = JSONResponse({"detail": e.detail}, status_code=e.status_code)
         except StarletteHTTPException as e:
-            logger.error(f"Starlette HTTP Exception: {str(e)}")
+            logger.error("Starlette HTTP Exception: %s", e)
             response = JSONResponse({"detail": e.detail}, status_code=e.status_code)
         except Exception as e:
-            logger.error(f"Unexpected Exception: {str(e)}")
+            logger.error("Unexpected Exception: %s", e)
             response = JSONResponse(
                 {"detail": "An unexpected error occurred"}, status_code=500
             )
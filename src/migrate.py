@@ -0,0 +1,71 @@
+"""
+Brings the database schema up to date. Run it as a deploy step before starting the application:
+
+    python -m src.migrate            # upgrade to the latest revision
+    python -m src.migrate 0002       # upgrade to a specific revision
+
+Other commands (downgrade, history, new revisions) are available through the alembic CLI
+from the repository root, e.g. `alembic revision --autogenerate --rev-id 0004 -m "..."`.
+"""
+import os
+import sys
+from typing import Optional
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import Connection, create_engine, inspect
+from sqlalchemy.pool import NullPool
+
+import src.env as env
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+
+# the schema create_all produced before the migrations existed
+BASELINE_REVISION = "0001"
+
+
+def alembic_config(connection: Optional[Connection] = None) -> Config:
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    config.attributes["connection"] = connection
+    return config
+
+
+def _stamp_legacy_database(connection: Connection, config: Config):
+    """
+    Databases created by create_all have the tables but no revision, they are marked as the baseline revision.
+    """
+    if MigrationContext.configure(connection).get_current_revision() is not None:
+        return
+    if not inspect(connection).has_table("products"):
+        return
+
+    logger.info("Existing database without migrations, stamping revision %s", BASELINE_REVISION)
+    command.stamp(config, BASELINE_REVISION)
+
+
+def migrate(revision: str = "head", url: Optional[str] = None) -> None:
+    """
+    Upgrade the database to the given revision.
+
+    Args:
+        revision (str): The target revision, the latest one by default.
+        url (Optional[str]): The database to migrate, 'DATABASE_URL' by default.
+    """
+    engine = create_engine(url or env.DATABASE_URL, poolclass=NullPool)
+    try:
+        with engine.begin() as connection:
+            config = alembic_config(connection)
+            _stamp_legacy_database(connection, config)
+            command.upgrade(config, revision)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    migrate(*sys.argv[1:2])
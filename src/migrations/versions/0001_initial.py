@@ -0,0 +1,75 @@
+"""Initial schema, as created by create_all before migrations were introduced
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "jwt_tokens",
+        sa.Column("token", sa.String(), primary_key=True),
+        sa.Column("expiration", sa.Integer()),
+    )
+    op.create_table(
+        "products",
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("description", sa.String()),
+    )
+    op.create_table(
+        "offer_summary",
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        sa.Column("min_price", sa.Float()),
+        sa.Column("max_price", sa.Float()),
+        sa.Column("avg_price", sa.Float()),
+        sa.Column("median_price", sa.Float()),
+        sa.Column("offer_count", sa.Integer()),
+    )
+    op.create_table(
+        "offers",
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        sa.Column("price", sa.Integer()),
+        sa.Column("items_in_stock", sa.Integer()),
+        sa.Column(
+            "product_id", sa.Uuid(), sa.ForeignKey("products.id", ondelete="CASCADE")
+        ),
+    )
+    op.create_table(
+        "fetch",
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        sa.Column("time", sa.Float()),
+        sa.Column(
+            "product_id", sa.Uuid(), sa.ForeignKey("products.id", ondelete="CASCADE")
+        ),
+        sa.Column(
+            "offer_summary_id",
+            sa.Uuid(),
+            sa.ForeignKey("offer_summary.id"),
+            nullable=True,
+        ),
+    )
+    op.create_table(
+        "offer_fetch",
+        sa.Column("offer_id", sa.Uuid(), sa.ForeignKey("offers.id", ondelete="CASCADE")),
+        sa.Column("fetch_id", sa.Uuid(), sa.ForeignKey("fetch.id", ondelete="CASCADE")),
+        sa.Column("id", sa.Uuid(), primary_key=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("offer_fetch")
+    op.drop_table("fetch")
+    op.drop_table("offers")
+    op.drop_table("offer_summary")
+    op.drop_table("products")
+    op.drop_table("jwt_tokens")
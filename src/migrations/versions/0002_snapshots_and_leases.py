@@ -0,0 +1,85 @@
+"""Weighted summaries, fetch snapshots and fetch leases
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+Databases created by create_all may already have some of these columns and tables,
+those are left as they are.
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _columns(table: str) -> set[str]:
+    if context.is_offline_mode():
+        # no database to inspect when only the SQL is generated
+        return set()
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _has_table(table: str) -> bool:
+    if context.is_offline_mode():
+        return False
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade() -> None:
+    summary_columns = _columns("offer_summary")
+    with op.batch_alter_table("offer_summary") as batch:
+        for name, type_ in [
+            ("weighted_avg_price", sa.Float()),
+            ("weighted_median_price", sa.Float()),
+            ("total_stock", sa.Integer()),
+        ]:
+            if name not in summary_columns:
+                batch.add_column(sa.Column(name, type_, nullable=True))
+
+    fetch_columns = _columns("fetch")
+    with op.batch_alter_table("fetch") as batch:
+        if "fingerprint" not in fetch_columns:
+            batch.add_column(sa.Column("fingerprint", sa.String(64), nullable=True))
+        if "snapshot_id" not in fetch_columns:
+            batch.add_column(sa.Column("snapshot_id", sa.Uuid(), nullable=True))
+            batch.create_foreign_key(
+                "fk_fetch_snapshot_id_fetch",
+                "fetch",
+                ["snapshot_id"],
+                ["id"],
+                ondelete="CASCADE",
+            )
+
+    if not _has_table("fetch_lease"):
+        op.create_table(
+            "fetch_lease",
+            sa.Column(
+                "product_id",
+                sa.Uuid(),
+                sa.ForeignKey("products.id", ondelete="CASCADE"),
+                primary_key=True,
+            ),
+            sa.Column("owner", sa.String(), nullable=True),
+            sa.Column("expires_at", sa.Float(), nullable=False),
+        )
+        op.create_index("ix_fetch_lease_expires_at", "fetch_lease", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_fetch_lease_expires_at", table_name="fetch_lease")
+    op.drop_table("fetch_lease")
+
+    with op.batch_alter_table("fetch") as batch:
+        batch.drop_constraint("fk_fetch_snapshot_id_fetch", type_="foreignkey")
+        batch.drop_column("snapshot_id")
+        batch.drop_column("fingerprint")
+
+    with op.batch_alter_table("offer_summary") as batch:
+        batch.drop_column("total_stock")
+        batch.drop_column("weighted_median_price")
+        batch.drop_column("weighted_avg_price")
@@ -0,0 +1,28 @@
+"""Indexes for the lookups of fetches, offers and their links
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # the latest fetch of a product and the fetches of a product in a time range
+    op.create_index("ix_fetch_product_id_time", "fetch", ["product_id", "time"])
+    op.create_index("ix_offer_fetch_fetch_id", "offer_fetch", ["fetch_id"])
+    op.create_index("ix_offer_fetch_offer_id", "offer_fetch", ["offer_id"])
+    op.create_index("ix_offers_product_id", "offers", ["product_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_offers_product_id", table_name="offers")
+    op.drop_index("ix_offer_fetch_offer_id", table_name="offer_fetch")
+    op.drop_index("ix_offer_fetch_fetch_id", table_name="offer_fetch")
+    op.drop_index("ix_fetch_product_id_time", table_name="fetch")
@@ -0,0 +1,31 @@
+"""Deleted products and indexes for deleting fetches
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("products") as batch:
+        batch.add_column(sa.Column("deleted_at", sa.Float(), nullable=True))
+
+    # deleting a fetch or a summary checks the fetches that reference it
+    op.create_index("ix_fetch_snapshot_id", "fetch", ["snapshot_id"])
+    op.create_index("ix_fetch_offer_summary_id", "fetch", ["offer_summary_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_fetch_offer_summary_id", table_name="fetch")
+    op.drop_index("ix_fetch_snapshot_id", table_name="fetch")
+
+    with op.batch_alter_table("products") as batch:
+        batch.drop_column("deleted_at")
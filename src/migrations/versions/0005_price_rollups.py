@@ -0,0 +1,44 @@
+"""Hourly and daily rollups of the price history
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+The rollups of existing fetches are created with `python -m src.rollups`. Until then, the bucketed price
+history of ranges without rollups is combined from the fetches.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "price_rollup",
+        sa.Column(
+            "product_id",
+            sa.Uuid(),
+            sa.ForeignKey("products.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("resolution", sa.Integer(), primary_key=True),
+        sa.Column("bucket_start", sa.Float(), primary_key=True),
+        sa.Column("min_price", sa.Float()),
+        sa.Column("max_price", sa.Float()),
+        sa.Column("avg_price", sa.Float()),
+        sa.Column("median_price", sa.Float()),
+        sa.Column("fetch_count", sa.Integer()),
+        sa.Column("weighted_avg_price", sa.Float(), nullable=True),
+        sa.Column("weighted_median_price", sa.Float(), nullable=True),
+        sa.Column("offer_count", sa.Integer()),
+        sa.Column("weighted_count", sa.Integer()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("price_rollup")
@@ -0,0 +1,28 @@
+"""Compaction of expired offer snapshots
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("fetch") as batch:
+        batch.add_column(sa.Column("compacted_at", sa.Float(), nullable=True))
+
+    op.create_index("ix_fetch_compacted_at_time", "fetch", ["compacted_at", "time"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_fetch_compacted_at_time", table_name="fetch")
+
+    with op.batch_alter_table("fetch") as batch:
+        batch.drop_column("compacted_at")
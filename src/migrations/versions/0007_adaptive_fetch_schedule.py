@@ -0,0 +1,26 @@
+"""Adaptive fetch intervals of leased products
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("fetch_lease") as batch:
+        batch.add_column(sa.Column("interval", sa.Float(), nullable=True))
+        batch.add_column(sa.Column("fingerprint", sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("fetch_lease") as batch:
+        batch.drop_column("fingerprint")
+        batch.drop_column("interval")
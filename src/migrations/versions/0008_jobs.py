@@ -0,0 +1,44 @@
+"""Background jobs of asynchronously created products
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "job",
+        sa.Column("id", sa.Uuid(), primary_key=True),
+        sa.Column(
+            "product_id",
+            sa.Uuid(),
+            sa.ForeignKey("products.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("registered", sa.Boolean(), nullable=False),
+        sa.Column("fetched", sa.Boolean(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.Float(), nullable=False),
+        sa.Column("updated_at", sa.Float(), nullable=False),
+        sa.Column("run_after", sa.Float(), nullable=False),
+        sa.Column("owner", sa.String(), nullable=True),
+    )
+    op.create_index("ix_job_product_id", "job", ["product_id"])
+    op.create_index("ix_job_status_run_after", "job", ["status", "run_after"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_job_status_run_after", table_name="job")
+    op.drop_index("ix_job_product_id", table_name="job")
+    op.drop_table("job")
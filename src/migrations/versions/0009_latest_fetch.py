@@ -0,0 +1,36 @@
+"""Pointer from every product to its latest fetch
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("products") as batch:
+        batch.add_column(sa.Column("latest_fetch_id", sa.Uuid(), nullable=True))
+
+    products = sa.table("products", sa.column("id"), sa.column("latest_fetch_id"))
+    fetch = sa.table("fetch", sa.column("id"), sa.column("product_id"), sa.column("time"))
+    op.execute(
+        products.update().values(
+            latest_fetch_id=sa.select(fetch.c.id)
+            .where(fetch.c.product_id == products.c.id)
+            .order_by(fetch.c.time.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("products") as batch:
+        batch.drop_column("latest_fetch_id")
@@ -1,3 +1,5 @@
+import asyncio
+import hashlib
 import time
 from typing import List, Optional
 import uuid
@@ -5,9 +7,12 @@ import uuid
 import httpx
 import jwt
 from psycopg2 import DatabaseError
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
 from jwt.exceptions import InvalidTokenError
-from sqlalchemy.orm.session import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 from .exceptions.external import (
@@ -16,10 +21,16 @@ from .exceptions.external import (
     InvalidJwtTokenError,
     OffersFetchError,
     ProductRegistrationError,
+    UpstreamUnavailableError,
 )
-from .orm_models import Fetch, JwtToken, Offer, Product
+from .orm_models import Fetch, JwtToken, Offer, OfferSummary, Product, offer_fetch
 from .pydantic_models import OfferModel
-from .db import session_scope
+from .cache import ResultCache
+from .db import async_session_scope
+from .http_client import UpstreamClient
+from .resilience import UpstreamGuard
+from .rollups import update_rollups
+from .summary import summarize_offers
 import src.env as env
 from .logger import get_logger
 
@@ -27,7 +38,7 @@ from .logger import get_logger
 logger = get_logger(__name__)
 
 
-async def _fetch_token_from_db(session: Session) -> Optional[JwtToken]:
+async def _fetch_token_from_db(session: AsyncSession) -> Optional[JwtToken]:
     """
     Fetch the first JWT token from the database. If a SQLAlchemyError occurs, log the error and raise a DatabaseError.
 
@@ -35,19 +46,20 @@ async def _fetch_token_from_db(session: Session) -> Optional[JwtToken]:
         Optional[JwtToken]: Returns the first JWT token found in the database or None if no token is found.
     """
     try:
-        return session.query(JwtToken).first()
+        return (await session.scalars(select(JwtToken))).first()
     except SQLAlchemyError as e:
-        logger.error(f"Database query failed: {str(e)}")
+        logger.error("Database query failed: %s", e)
         raise DatabaseError(f"Database query failed: {str(e)}") from e
 
 
-def _is_token_valid(token: JwtToken) -> bool:
+def _is_token_valid(token: JwtToken, margin: float = 0) -> bool:
     """
     Check if the token is valid. A valid token is defined as not None, has a defined expiration, and the expiration time is in the future.
     This expects the token.expiration to be a UNIX timestamp and assumes that the endpoint accounts for clock skew.
 
     Args:
         token (JwtToken): JWT token object to be checked.
+        margin (float): Number of seconds the token has to remain valid for.
 
     Returns:
         bool: True if the token is valid, False otherwise.
@@ -55,7 +67,7 @@ def _is_token_valid(token: JwtToken) -> bool:
     return (
         token is not None
         and token.expiration is not None
-        and token.expiration > time.time()
+        and token.expiration > time.time() + margin
     )
 
 
@@ -68,36 +80,36 @@ async def _fetch_new_token_from_api() -> str:
         str: The JWT token.
     """
 
-    async with httpx.AsyncClient() as client:
-        headers = {"Bearer": env.TOKEN_SECRET}
+    client = UpstreamClient.get()
+    headers = {"Bearer": env.TOKEN_SECRET}
 
-        url = env.API_URL + "/auth"
-        try:
-            logger.debug(f"fetching new token from {url}")
-            response = await client.post(
+    url = env.API_URL + "/auth"
+    try:
+        logger.debug("fetching new token from %s", url)
+        response = await UpstreamGuard.call(
+            lambda: client.post(
                 url=url,
                 headers=headers,
             )
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 400:
-                logger.error(f"Offer service authentication failed: {e}")
-                if "detail" in e.response.json():
-                    raise AuthenticationFailedError(
-                        f"Offer service authentication failed: {e.response.json()['detail']}"
-                    )
-                else:
-                    raise AuthenticationFailedError(
-                        f"Offer service authentication failed"
-                    )
+        )
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 400:
+            logger.error("Offer service authentication failed: %s", e)
+            if "detail" in e.response.json():
+                raise AuthenticationFailedError(
+                    f"Offer service authentication failed: {e.response.json()['detail']}"
+                )
             else:
-                logger.error(f"HTTP request failed: {e}")
-                raise ApiRequestError(f"HTTP request failed: {str(e)}") from e
-
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP request failed: {e}")
+                raise AuthenticationFailedError(f"Offer service authentication failed")
+        else:
+            logger.error("HTTP request failed: %s", e)
             raise ApiRequestError(f"HTTP request failed: {str(e)}") from e
 
+    except httpx.HTTPError as e:
+        logger.error("HTTP request failed: %s", e)
+        raise ApiRequestError(f"HTTP request failed: {str(e)}") from e
+
     body = response.json()
 
     if not "access_token" in body:
@@ -105,7 +117,7 @@ async def _fetch_new_token_from_api() -> str:
 
     access_token = body["access_token"]
 
-    logger.debug(f"new token: {access_token}")
+    logger.debug("new token fetched")
 
     return access_token
 
@@ -128,12 +140,12 @@ def _decode_token(token: str):
         return decoded
 
     except Exception as e:
-        logger.error(f"JWT Token decoding failed: {str(e)}")
+        logger.error("JWT Token decoding failed: %s", e)
         raise InvalidJwtTokenError()
 
 
 async def _store_new_token_in_db(
-    token: JwtToken, session: Session
+    token: JwtToken, session: AsyncSession
 ) -> Optional[JwtToken]:
     """
     Store a new JWT token in the database. If the token already exists, update its value.
@@ -149,93 +161,168 @@ async def _store_new_token_in_db(
     # If we wanted to horizontally scale this part of the application, it would be better to slightly modify the database entry in the database to allow for storage of multiple tokens, each for a different instance of the application.
 
     try:
-        existing_token = session.query(JwtToken).first()
+        existing_token = (await session.scalars(select(JwtToken))).first()
         if existing_token:
             existing_token.expiration = token.expiration
             existing_token.token = token.token
         else:
             session.add(token)
-        session.commit()
+        await session.commit()
     except SQLAlchemyError as e:
-        logger.error(f"Failed to commit token to database: {str(e)}")
+        logger.error("Failed to commit token to database: %s", e)
         raise DatabaseError(f"Failed to commit token to database: {str(e)}") from e
 
 
-async def _get_valid_token(session: Session) -> JwtToken:
+class TokenCache:
     """
-    Get a valid JWT token. If no valid token exists in the database, fetch a new one from the API.
+    In-process cache of the offers API token.
 
-    Returns:
-        JwtToken: A valid JWT token.
+    The database is only read on a cold start. Once the cached token gets within 'UPSTREAM_TOKEN_REFRESH_MARGIN'
+    seconds of its expiration, a refresh is started in the background while callers keep using the still valid token.
+    All concurrent callers share the same in-flight refresh, so only one request is sent to '/auth' at a time.
+
+    Attributes:
+        _token (Optional[JwtToken]): The cached token, detached from any session.
+        _loaded (bool): Whether the database was already consulted.
+        _refresh_task (Optional[asyncio.Task]): The refresh that is currently running, if any.
     """
-    # Get token from db
-    db_token = await _fetch_token_from_db(session)
 
-    if _is_token_valid(db_token):
-        return db_token
+    _token: Optional[JwtToken] = None
+    _loaded = False
+    _refresh_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def clear(cls):
+        """
+        Forget the cached token, the next caller will load it from the database again.
+        """
+        cls._token = None
+        cls._loaded = False
+        cls._refresh_task = None
+
+    @classmethod
+    async def get(cls) -> JwtToken:
+        """
+        Get a valid token, refreshing it if needed.
+
+        Returns:
+            JwtToken: A valid JWT token.
+        """
+        token = cls._token
+
+        if _is_token_valid(token, env.UPSTREAM_TOKEN_REFRESH_MARGIN):
+            return token
+
+        if _is_token_valid(token):
+            # still usable, refresh it without making the caller wait
+            cls._start_refresh()
+            return token
+
+        # shield the shared refresh so that a cancelled caller does not cancel it for everybody else
+        return await asyncio.shield(cls._start_refresh())
+
+    @classmethod
+    def _start_refresh(cls) -> asyncio.Task:
+        task = cls._refresh_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(cls._refresh())
+            task.add_done_callback(cls._log_refresh_failure)
+            cls._refresh_task = task
+        return task
+
+    @staticmethod
+    def _log_refresh_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Token refresh failed: %s", task.exception())
+
+    @classmethod
+    async def _refresh(cls) -> JwtToken:
+        async with async_session_scope() as session:
+            if not cls._loaded:
+                db_token = await _fetch_token_from_db(session)
+                cls._loaded = True
+
+                if _is_token_valid(db_token, env.UPSTREAM_TOKEN_REFRESH_MARGIN):
+                    cls._token = JwtToken(
+                        token=db_token.token, expiration=db_token.expiration
+                    )
+                    return cls._token
 
-    logger.info("There is no token or it's invalid, requesting new token")
+            logger.info("There is no token or it's about to expire, requesting new token")
 
-    access_token = await _fetch_new_token_from_api()
+            access_token = await _fetch_new_token_from_api()
 
-    if not access_token:
-        raise AuthenticationFailedError("Could not authenticate")
+            if not access_token:
+                raise AuthenticationFailedError("Could not authenticate")
 
-    decoded_token = _decode_token(access_token)
-    expiration = decoded_token.get("expires")
+            decoded_token = _decode_token(access_token)
+            expiration = decoded_token.get("expires")
 
-    new_token = JwtToken(
-        token=access_token,
-        expiration=expiration,
-    )
+            await _store_new_token_in_db(
+                JwtToken(token=access_token, expiration=expiration), session
+            )
 
-    await _store_new_token_in_db(new_token, session)
+        # keep a copy that is not bound to the (now closed) session
+        cls._token = JwtToken(token=access_token, expiration=expiration)
+        return cls._token
 
-    return new_token
 
+async def _get_valid_token() -> JwtToken:
+    """
+    Get a valid JWT token. The token is cached in memory, if there is no cached token it is loaded from the
+    database and if no valid token exists there either, a new one is fetched from the API.
 
-async def register_product(product: Product, session: Session) -> None:
+    Returns:
+        JwtToken: A valid JWT token.
+    """
+    return await TokenCache.get()
+
+
+async def register_product(product: Product) -> None:
     """
     Register a product using the JWT token for authorization. If an error occurs during the HTTP request, log the error and return None.
 
     Args:
         product (Product): The product object to be registered.
     """
-    jwt_token = await _get_valid_token(session)
+    jwt_token = await _get_valid_token()
 
-    async with httpx.AsyncClient() as client:
-        headers = {"bearer": jwt_token.token}
+    client = UpstreamClient.get()
+    headers = {"bearer": jwt_token.token}
 
-        try:
-            response = await client.post(
+    try:
+        response = await UpstreamGuard.call(
+            lambda: client.post(
                 url=env.API_URL + "/products/register",
                 json=product.to_dict(),
                 headers=headers,
-            )
-        except httpx.HTTPError as http_err:
-            logger.error(f"HTTP error occurred: {http_err}")
-            raise ProductRegistrationError(
-                f"HTTP error occurred during product registration: {http_err}"
-            ) from http_err
-        except Exception as err:
-            logger.error(f"An error occurred: {err}")
-            raise ProductRegistrationError(
-                f"An unexpected error occurred during product registration: {err}"
-            ) from err
-
-        if not httpx.codes.is_success(response.status_code):
-            logger.error(f"Unsuccessful request, status code: {response.status_code}")
-
-            raise ProductRegistrationError(
-                f"Unsuccessful product offer registration, status code: {response.status_code}"
-            )
+            ),
+            idempotent=False,
+        )
+    except UpstreamUnavailableError:
+        raise
+    except httpx.HTTPError as http_err:
+        logger.error("HTTP error occurred: %s", http_err)
+        raise ProductRegistrationError(
+            f"HTTP error occurred during product registration: {http_err}"
+        ) from http_err
+    except Exception as err:
+        logger.error("An error occurred: %s", err)
+        raise ProductRegistrationError(
+            f"An unexpected error occurred during product registration: {err}"
+        ) from err
+
+    if not httpx.codes.is_success(response.status_code):
+        logger.error("Unsuccessful request, status code: %d", response.status_code)
+
+        raise ProductRegistrationError(
+            f"Unsuccessful product offer registration, status code: {response.status_code}"
+        )
 
-        logger.info(f"Product {product.id} registered successfully")
+    logger.info("Product %s registered successfully", product.id)
 
 
-async def _fetch_product_offers_from_api(
-    jwt_token: JwtToken, product: Product, session: Session
-):
+async def _fetch_product_offers_from_api(jwt_token: JwtToken, product: Product):
     """
     Fetch offers for a specific product from the API.
 
@@ -246,92 +333,251 @@ async def _fetch_product_offers_from_api(
     Returns:
         httpx.Response: Response object from the API call.
     """
-    async with httpx.AsyncClient() as client:
-        headers = {"bearer": jwt_token.token}
+    client = UpstreamClient.get()
+    headers = {"bearer": jwt_token.token}
 
-        try:
-            response = await client.get(
+    try:
+        response = await UpstreamGuard.call(
+            lambda: client.get(
                 url=env.API_URL + "/products/" + str(product.id) + "/offers",
                 headers=headers,
             )
-            data = response.json()
-            # if body = {'detail': 'Product does not exist'} register product
-            if "detail" in data and data["detail"] == "Product does not exist":
-                await register_product(product, session)
-
-                # fetch offers again
-                models: List[OfferModel] = await _fetch_product_offers_from_api(
-                    jwt_token, product, session
-                )
-                return models
-
-            models = [OfferModel(**entry, product_id=product.id) for entry in data]
+        )
+        if response.status_code >= 500:
+            raise OffersFetchError(
+                f"Offers request failed, status code: {response.status_code}"
+            )
+        data = response.json()
+        # if body = {'detail': 'Product does not exist'} register product
+        if "detail" in data and data["detail"] == "Product does not exist":
+            await register_product(product)
+
+            # fetch offers again
+            models: List[OfferModel] = await _fetch_product_offers_from_api(
+                jwt_token, product
+            )
             return models
 
-        except httpx.HTTPError as e:
-            logger.error(f"HTTP request failed: {str(e)}")
-            raise OffersFetchError(f"HTTP request failed: {str(e)}") from e
+        models = [OfferModel(**entry, product_id=product.id) for entry in data]
+        return models
+
+    except httpx.HTTPError as e:
+        logger.error("HTTP request failed: %s", e)
+        raise OffersFetchError(f"HTTP request failed: {str(e)}") from e
+
+
+def _fingerprint_offers(offerModels: list[OfferModel]) -> str:
+    """
+    Compute a content hash of a set of offers. The hash does not depend on the order of the offers.
+
+    Args:
+        offerModels (list[OfferModel]): The offers to hash.
+
+    Returns:
+        str: Hex digest of the sorted ids, prices and stock counts.
+    """
+    entries = sorted(
+        f"{model.id}:{model.price}:{model.items_in_stock}" for model in offerModels
+    )
+    return hashlib.sha256("\n".join(entries).encode()).hexdigest()
+
+
+async def _upsert_offers(rows: list[dict], session: AsyncSession) -> None:
+    """
+    Insert new offers and update the price and stock of existing ones using a single statement.
+
+    PostgreSQL and SQLite both support INSERT ... ON CONFLICT. For any other database, the existing ids are
+    looked up with one query and the offers are then updated and inserted in bulk.
+
+    Args:
+        rows (list[dict]): Column values of the offers, with unique ids.
+    """
+    dialect = session.get_bind().dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql_insert if dialect == "postgresql" else sqlite_insert
+        stmt = dialect_insert(Offer).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Offer.id],
+            set_={
+                "price": stmt.excluded.price,
+                "items_in_stock": stmt.excluded.items_in_stock,
+                "product_id": stmt.excluded.product_id,
+            },
+        )
+        await session.execute(stmt)
+        return
+
+    ids = [row["id"] for row in rows]
+    existing_ids = set(await session.scalars(select(Offer.id).where(Offer.id.in_(ids))))
 
+    existing = [row for row in rows if row["id"] in existing_ids]
+    new = [row for row in rows if row["id"] not in existing_ids]
 
-def _store_offers_in_db(
-    offerModels: list[OfferModel], prod: Product, session
+    if existing:
+        await session.execute(update(Offer), existing)
+    if new:
+        await session.execute(insert(Offer), new)
+
+
+async def _store_offers_in_db(
+    offerModels: list[OfferModel], prod: Product
 ) -> List[Offer]:
     """
     Store offers in the database. If a SQLAlchemyError occurs, log the error and raise a DatabaseError.
 
+    The fetch, its summary, the offers and the links between them are written with a constant number of
+    statements in a single transaction, no matter how many offers the product has. The rollups of the
+    buckets of the fetch are updated in the same transaction.
+
     Args:
         offers (list[OfferModel]): A list of Offer objects to be stored in the database.
         product (Product): The product object for which the offers are to be stored.
     """
+    fingerprint = _fingerprint_offers(offerModels)
+
     try:
-        with session_scope() as session:
-            # refresh product
-            product = session.query(Product).filter(Product.id == prod.id).first()
+        async with async_session_scope() as session:
+            # the product and its latest fetch in one lookup
+            product_row = (
+                await session.execute(
+                    select(
+                        Product.id,
+                        Fetch.id.label("fetch_id"),
+                        Fetch.fingerprint,
+                        Fetch.snapshot_id,
+                        Fetch.offer_summary_id,
+                    )
+                    .outerjoin(Fetch, Fetch.id == Product.latest_fetch_id)
+                    .where(Product.id == prod.id)
+                    .where(Product.deleted_at.is_(None))
+                )
+            ).first()
 
-            if not product:
+            if not product_row:
                 raise DatabaseError("Product not found in database")
 
-            # Create a new fetch
-            new_fetch = Fetch(
-                id=uuid.uuid4(),
-                time=time.time(),
-            )
+            previous_fetch = product_row if product_row.fetch_id is not None else None
+
+            fetch_id = uuid.uuid4()
+            fetch_time = time.time()
+
+            if previous_fetch and previous_fetch.fingerprint == fingerprint:
+                # nothing changed, only record that the previous snapshot is still valid
+                await session.execute(
+                    insert(Fetch).values(
+                        id=fetch_id,
+                        time=fetch_time,
+                        product_id=prod.id,
+                        fingerprint=fingerprint,
+                        snapshot_id=previous_fetch.snapshot_id or previous_fetch.fetch_id,
+                        offer_summary_id=previous_fetch.offer_summary_id,
+                    )
+                )
+            else:
+                await _insert_snapshot(
+                    offerModels, prod, fetch_id, fetch_time, fingerprint, session
+                )
+
+            await _set_latest_fetch(session, prod.id, fetch_id, fetch_time)
+            await update_rollups(session, prod.id, fetch_id, fetch_time)
+    except SQLAlchemyError as e:
+        logger.error(
+            "Failed to store offers for product %s in the database: %s", prod.id, e
+        )
+        raise DatabaseError("Failed to store offers in the database")
 
-            product.fetches.append(new_fetch)
+    # the fetch is committed, the cached results of the product are outdated
+    await ResultCache.invalidate(prod.id)
 
-            session.add(new_fetch)
+    return [model.to_offer() for model in offerModels]
 
-            session.commit()
 
-            offers = [model.to_offer() for model in offerModels]
+async def _set_latest_fetch(
+    session: AsyncSession, product_id: uuid.UUID, fetch_id: uuid.UUID, fetch_time: float
+) -> None:
+    """
+    Point the product to a new fetch, unless a concurrently stored fetch with a later time got there first.
+    The row of the product stays locked until the transaction ends, so the pointer can not go backwards.
+    """
+    current_time = (
+        select(Fetch.time)
+        .where(Fetch.id == Product.latest_fetch_id)
+        .scalar_subquery()
+    )
+    await session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .where(
+            Product.latest_fetch_id.is_(None)
+            | (func.coalesce(current_time, fetch_time) <= fetch_time)
+        )
+        .values(latest_fetch_id=fetch_id)
+    )
+
+
+def latest_offers_query(product_id: uuid.UUID):
+    """
+    Select the offers of the latest fetch of a product that was not deleted: one lookup of the product, its latest
+    fetch and the links of the snapshot of that fetch, no matter how many fetches the product has.
+    """
+    return (
+        select(Offer)
+        .select_from(Product)
+        .join(Fetch, Fetch.id == Product.latest_fetch_id)
+        .join(
+            offer_fetch,
+            offer_fetch.c.fetch_id == func.coalesce(Fetch.snapshot_id, Fetch.id),
+        )
+        .join(Offer, Offer.id == offer_fetch.c.offer_id)
+        .where(Product.id == product_id)
+        .where(Product.deleted_at.is_(None))
+    )
 
-            for offer in offers:
-                # if it already exists, update it
-                the_offer = session.query(Offer).filter(Offer.id == offer.id).first()
-                if the_offer:
-                    the_offer.price = offer.price
-                    the_offer.items_in_stock = offer.items_in_stock
-                else:  # else add it
-                    session.add(offer)
 
-            session.commit()
+async def _insert_snapshot(
+    offerModels: list[OfferModel],
+    prod: Product,
+    fetch_id: uuid.UUID,
+    fetch_time: float,
+    fingerprint: str,
+    session: AsyncSession,
+) -> None:
+    """
+    Insert a fetch with a new snapshot of the offers, together with its summary and the offers themselves.
+    """
+    # the upstream API should not return the same offer twice, but if it does, the last one wins
+    rows = list({model.id: model.model_dump() for model in offerModels}.values())
 
-            # Directly link the offers to the fetch
-            for offer in offers:
-                ofr = session.query(Offer).filter(Offer.id == offer.id).first()
-                new_fetch.offers.append(ofr)
+    # the summary is computed here once, so that reading the price history never has to load the offers
+    summary_id = uuid.uuid4()
+    summary = summarize_offers(
+        [row["price"] for row in rows], [row["items_in_stock"] for row in rows]
+    )
+    await session.execute(
+        insert(OfferSummary).values(id=summary_id, **summary.to_dict())
+    )
 
-            session.commit()
+    await session.execute(
+        insert(Fetch).values(
+            id=fetch_id,
+            time=fetch_time,
+            product_id=prod.id,
+            fingerprint=fingerprint,
+            offer_summary_id=summary_id,
+        )
+    )
 
-            return offers
-    except SQLAlchemyError as e:
-        logger.error(
-            f"Failed to store offers for product {prod.id} in the database: {str(e)}"
+    if rows:
+        await _upsert_offers(rows, session)
+
+        await session.execute(
+            offer_fetch.insert(),
+            [{"offer_id": row["id"], "fetch_id": fetch_id} for row in rows],
         )
-        raise DatabaseError("Failed to store offers in the database")
 
 
-async def fetch_products(product: Product, session: Session) -> list[Offer]:
+async def fetch_products(product: Product) -> list[Offer]:
     """
     Get offers for a specific product. This includes fetching the offers from the API, processing the response, and storing the offers in the database.
 
@@ -341,12 +587,13 @@ async def fetch_products(product: Product, session: Session) -> list[Offer]:
     Returns:
         list[Offer]: A list of Offer objects fetched from the API.
     """
-    logger.info(f"Fetching offers for product {product.id}")
+    logger.info("Fetching offers for product %s", product.id)
 
-    with session_scope() as session:
-        jwt_token = await _get_valid_token(session)
-        offerModels = await _fetch_product_offers_from_api(jwt_token, product, session)
+    # no session is held open while waiting for the API, the offers are stored in their own transaction.
+    # The functions open their own sessions, so they can run concurrently for different products.
+    jwt_token = await _get_valid_token()
+    offerModels = await _fetch_product_offers_from_api(jwt_token, product)
 
-        offers = _store_offers_in_db(offerModels, product, session)
+    offers = await _store_offers_in_db(offerModels, product)
 
     return offers
@@ -2,15 +2,13 @@ import uuid
 from dataclasses import dataclass
 from typing import List
 
-from sqlalchemy import Column, Float, Integer, String, ForeignKey, Table
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Boolean, Column, Float, Index, Integer, String, ForeignKey, Table, Text, Uuid
 from sqlalchemy.orm import declarative_base, relationship, Relationship
 
-from .env import TEST_ENV
-
 from . import db
 from .exceptions.internal import EntityNotFound
 from .logger import get_logger
+from .summary import summarize_offers
 
 
 logger = get_logger(__name__)
@@ -34,9 +32,9 @@ class JwtToken(Base):
 offer_fetch = Table(
     "offer_fetch",
     Base.metadata,
-    Column("offer_id", UUID, ForeignKey("offers.id", ondelete="CASCADE")),
-    Column("fetch_id", UUID, ForeignKey("fetch.id", ondelete="CASCADE")),
-    Column("id", UUID(as_uuid=True), primary_key=True, default=uuid.uuid4),
+    Column("offer_id", Uuid, ForeignKey("offers.id", ondelete="CASCADE"), index=True),
+    Column("fetch_id", Uuid, ForeignKey("fetch.id", ondelete="CASCADE"), index=True),
+    Column("id", Uuid, primary_key=True, default=uuid.uuid4),
 )
 
 
@@ -44,10 +42,12 @@ offer_fetch = Table(
 class Offer(Base):
     __tablename__ = "offers"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
     price = Column(Integer)
     items_in_stock = Column(Integer)
-    product_id = Column(UUID, ForeignKey("products.id", ondelete="CASCADE"))
+    product_id = Column(
+        Uuid, ForeignKey("products.id", ondelete="CASCADE"), index=True
+    )
     fetches = relationship("Fetch", secondary=offer_fetch, back_populates="offers")
 
     def __repr__(self):
@@ -56,53 +56,80 @@ class Offer(Base):
 
 class OfferSummary(Base):
     __tablename__ = "offer_summary"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
     min_price = Column(Float)
     max_price = Column(Float)
     avg_price = Column(Float)
     median_price = Column(Float)
     offer_count = Column(Integer)
+    # weighted by the number of items in stock, NULL if nothing is in stock
+    weighted_avg_price = Column(Float, nullable=True)
+    weighted_median_price = Column(Float, nullable=True)
+    total_stock = Column(Integer, nullable=True)
 
-    fetch = relationship("Fetch", back_populates="offer_summary", uselist=False)
+    # fetches that only confirmed an unchanged snapshot share the summary of the snapshot
+    fetches = relationship("Fetch", back_populates="offer_summary")
 
 
 @dataclass
 class Fetch(Base):
     __tablename__ = "fetch"
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # the latest fetch and the fetches in a time range are always looked up for one product
+    __table_args__ = (
+        Index("ix_fetch_product_id_time", "product_id", "time"),
+        # the oldest snapshots that were not compacted yet, see retention.py
+        Index("ix_fetch_compacted_at_time", "compacted_at", "time"),
+    )
+
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
     time = Column(Float)
-    product_id = Column(UUID, ForeignKey("products.id", ondelete="CASCADE"))
+    product_id = Column(Uuid, ForeignKey("products.id", ondelete="CASCADE"))
 
     offer_summary_id = Column(
-        UUID, ForeignKey("offer_summary.id"), nullable=True
+        Uuid, ForeignKey("offer_summary.id"), nullable=True, index=True
     )  # Optional
-    offer_summary = relationship("OfferSummary", back_populates="fetch")
+    offer_summary = relationship("OfferSummary", back_populates="fetches")
+
+    # content hash of the fetched offers, see offers._fingerprint_offers
+    fingerprint = Column(String(64), nullable=True)
+
+    # If the offers did not change since the previous fetch, no offers are linked to this fetch.
+    # It only records that the offers of the snapshot fetch were still valid at this fetch's time.
+    snapshot_id = Column(
+        Uuid, ForeignKey("fetch.id", ondelete="CASCADE"), nullable=True, index=True
+    )
+    snapshot = relationship("Fetch", remote_side=[id])
+
+    # set once the links to the offers were deleted by the retention policy, only the summary is left
+    compacted_at = Column(Float, nullable=True)
+
+    @property
+    def snapshot_offers(self) -> List["Offer"]:
+        """
+        The offers that were valid at the time of this fetch.
+        """
+        if self.snapshot is not None:
+            return self.snapshot.offers
+        return self.offers
 
     def calculate_summary(self) -> OfferSummary:
+        """
+        Get the summary of the fetch. Summaries are computed when the fetch is stored, this only computes
+        (and stores) it from the offers for fetches stored before that.
+        """
         # if the summary is already calculated, return
         if self.offer_summary:
             summary: OfferSummary = self.offer_summary
 
             return summary
 
-        # if there are no offers or it is a empty list, return
-        if not self.offers or len(self.offers) == 0:
-            OfferSummary(
-                min_price=0,
-                max_price=0,
-                avg_price=0,
-                median_price=0,
-                offer_count=0,
-            )
-
-        prices: List[int] = [offer.price for offer in self.offers]
+        offers = self.snapshot_offers
 
         summary = OfferSummary(
-            min_price=min(prices),
-            max_price=max(prices),
-            avg_price=sum(prices) / len(prices),
-            median_price=prices[len(prices) // 2],
-            offer_count=len(prices),
+            **summarize_offers(
+                [offer.price for offer in offers],
+                [offer.items_in_stock for offer in offers],
+            ).to_dict()
         )
 
         # add the summary to the fetch
@@ -115,9 +142,14 @@ class Fetch(Base):
 class Product(Base):
     __tablename__ = "products"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
     name = Column(String)
     description = Column(String)
+    # set when the product was deleted but its history is still being purged, see purge.py
+    deleted_at = Column(Float, nullable=True)
+    # the fetch with the greatest time, maintained by offers._store_offers_in_db. It is not a foreign key, so
+    # that products and fetches do not depend on each other. Purging removes the fetches of deleted products only.
+    latest_fetch_id = Column(Uuid, nullable=True)
 
     offers: Relationship[List[Offer]] = relationship(
         "Offer", back_populates="product", cascade="all, delete-orphan"
@@ -139,6 +171,86 @@ class Product(Base):
         }
 
 
+@dataclass
+class FetchLease(Base):
+    """
+    Claim of a worker on fetching the offers of a product, used to split the products between replicas.
+    A product can be claimed by another worker once its lease expires.
+    """
+
+    __tablename__ = "fetch_lease"
+
+    product_id = Column(
+        Uuid, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True
+    )
+    owner = Column(String, nullable=True)
+    expires_at = Column(Float, nullable=False, default=0, index=True)
+    # adaptive fetch interval of the product and fingerprint of its last fetched offers, see scheduler.py
+    interval = Column(Float, nullable=True)
+    fingerprint = Column(String(64), nullable=True)
+
+    def __repr__(self):
+        return f"<FetchLease(product_id={self.product_id}, owner={self.owner}, expires_at={self.expires_at})>"
+
+
+class PriceRollup(Base):
+    """
+    Summary of the fetches of a product in one bucket of 'resolution' seconds, see rollups.py.
+    The columns are those of 'OfferPriceSummary.aggregate' of the summaries of the fetches, plus the number of
+    offers and of fetches with stock-weighted prices, so that the averages of a day can be updated per fetch.
+    The medians of a day are NULL while the day is open.
+    """
+
+    __tablename__ = "price_rollup"
+
+    product_id = Column(
+        Uuid, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True
+    )
+    resolution = Column(Integer, primary_key=True)
+    bucket_start = Column(Float, primary_key=True)
+    min_price = Column(Float)
+    max_price = Column(Float)
+    avg_price = Column(Float)
+    median_price = Column(Float)
+    fetch_count = Column(Integer)
+    weighted_avg_price = Column(Float, nullable=True)
+    weighted_median_price = Column(Float, nullable=True)
+    offer_count = Column(Integer)
+    weighted_count = Column(Integer)
+
+    def __repr__(self):
+        return f"<PriceRollup(product_id={self.product_id}, resolution={self.resolution}, bucket_start={self.bucket_start})>"
+
+
+class Job(Base):
+    """
+    Work done in the background after a product was created asynchronously: its registration at the offers API
+    and the first fetch of its offers, see jobs.py.
+    """
+
+    __tablename__ = "job"
+    __table_args__ = (Index("ix_job_status_run_after", "status", "run_after"),)
+
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
+    product_id = Column(
+        Uuid, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    # pending, running, done or failed
+    status = Column(String(16), nullable=False, default="pending")
+    registered = Column(Boolean, nullable=False, default=False)
+    fetched = Column(Boolean, nullable=False, default=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+    # a pending job is not started before this time, a running one is taken over by another worker after it
+    run_after = Column(Float, nullable=False, default=0)
+    owner = Column(String, nullable=True)
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, product_id={self.product_id}, status={self.status})>"
+
+
 Offer.product: Relationship[Product] = relationship("Product", back_populates="offers")
 
 Fetch.product: Relationship[Product] = relationship("Product", back_populates="fetches")
@@ -147,9 +259,7 @@ Fetch.offers: Relationship[List[Offer]] = relationship(
     "Offer", secondary=offer_fetch, back_populates="fetches"
 )
 
-
-if not TEST_ENV:
-    Base.metadata.create_all(db.engine)
+# The schema is created and updated by the migrations in src/migrations, see src/migrate.py
 
 
 def link_offer_to_fetch(offer: Offer, fetch: Offer, session: db.Session):
@@ -0,0 +1,135 @@
+import uuid
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .db import async_session_scope
+from .orm_models import Fetch, Offer, OfferSummary, Product
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Deleting a product only marks it as deleted (products.deleted_at), deleted products are hidden everywhere.
+# Its history is then removed in batches, each in its own transaction, so that no single statement or
+# transaction has to touch the whole history of the product. The links between offers and fetches are removed
+# by the ON DELETE CASCADE of their foreign keys. The product row itself is deleted last.
+
+
+async def count_fetches(session: AsyncSession, product_id: uuid.UUID, limit: int) -> int:
+    """
+    Count the fetches of a product, but stop counting at 'limit'.
+    """
+    fetches = select(Fetch.id).where(Fetch.product_id == product_id).limit(limit)
+    return await session.scalar(select(func.count()).select_from(fetches.subquery()))
+
+
+async def delete_fetch_batch(
+    session: AsyncSession, product_id: uuid.UUID, batch_size: int
+) -> int:
+    """
+    Delete the newest 'batch_size' fetches of a product together with their summaries.
+
+    Fetches that only confirm an unchanged snapshot are always newer than the snapshot and share its summary,
+    so going from the newest fetch backwards, a summary is no longer used once its snapshot fetch is deleted.
+
+    Returns:
+        int: Number of deleted fetches, 0 if the product has no fetches left.
+    """
+    fetches = (
+        await session.execute(
+            select(Fetch.id, Fetch.snapshot_id, Fetch.offer_summary_id)
+            .where(Fetch.product_id == product_id)
+            .order_by(Fetch.time.desc())
+            .limit(batch_size)
+        )
+    ).all()
+    if not fetches:
+        return 0
+
+    await session.execute(
+        delete(Fetch).where(Fetch.id.in_([fetch.id for fetch in fetches]))
+    )
+
+    summary_ids = [
+        fetch.offer_summary_id
+        for fetch in fetches
+        if fetch.snapshot_id is None and fetch.offer_summary_id is not None
+    ]
+    if summary_ids:
+        await session.execute(delete(OfferSummary).where(OfferSummary.id.in_(summary_ids)))
+
+    return len(fetches)
+
+
+async def delete_offer_batch(
+    session: AsyncSession, product_id: uuid.UUID, batch_size: int
+) -> int:
+    """
+    Delete up to 'batch_size' offers of a product.
+
+    Returns:
+        int: Number of deleted offers, 0 if the product has no offers left.
+    """
+    offer_ids = (
+        await session.scalars(
+            select(Offer.id).where(Offer.product_id == product_id).limit(batch_size)
+        )
+    ).all()
+    if not offer_ids:
+        return 0
+
+    await session.execute(delete(Offer).where(Offer.id.in_(offer_ids)))
+    return len(offer_ids)
+
+
+async def purge_product(product_id: uuid.UUID, batch_size: int) -> None:
+    """
+    Remove a deleted product and all of its history, 'batch_size' rows per transaction.
+    """
+    logger.info("Purging product %s", product_id)
+
+    fetch_count = 0
+    while True:
+        async with async_session_scope() as session:
+            deleted = await delete_fetch_batch(session, product_id, batch_size)
+        if not deleted:
+            break
+        fetch_count += deleted
+
+    offer_count = 0
+    while True:
+        async with async_session_scope() as session:
+            deleted = await delete_offer_batch(session, product_id, batch_size)
+        if not deleted:
+            break
+        offer_count += deleted
+
+    async with async_session_scope() as session:
+        # the remaining rows that reference the product (e.g. its fetch lease) are removed by the cascade
+        await session.execute(delete(Product).where(Product.id == product_id))
+
+    logger.info(
+        "Purged product %s: %d fetches, %d offers", product_id, fetch_count, offer_count
+    )
+
+
+async def purge_deleted_products(batch_size: int) -> int:
+    """
+    Purge all products that were marked as deleted.
+
+    Returns:
+        int: Number of purged products.
+    """
+    async with async_session_scope() as session:
+        product_ids = (
+            await session.scalars(
+                select(Product.id).where(Product.deleted_at.is_not(None))
+            )
+        ).all()
+
+    for product_id in product_ids:
+        await purge_product(product_id, batch_size)
+
+    return len(product_ids)
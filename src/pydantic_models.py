@@ -1,9 +1,12 @@
+import math
+import statistics
 from typing import Optional
 import uuid
 
 from pydantic import BaseModel
 
-from .orm_models import Offer, OfferSummary, Product
+from .orm_models import Job, Offer, OfferSummary, Product
+from .summary import PriceSummary
 from .logger import get_logger
 
 logger = get_logger(__name__)
@@ -64,6 +67,59 @@ class ProductModel(CreateProductModel):
         )
 
 
+class JobModel(BaseModel):
+    """
+    Status of the background registration and first fetch of an asynchronously created product.
+    """
+
+    id: uuid.UUID
+    product_id: uuid.UUID
+    status: str
+    registered: bool
+    fetched: bool
+    attempts: int
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+    @staticmethod
+    def from_job(job: Job):
+        return JobModel(
+            id=job.id,
+            product_id=job.product_id,
+            status=job.status,
+            registered=job.registered,
+            fetched=job.fetched,
+            attempts=job.attempts,
+            error=job.error,
+            created_at=job.created_at,
+            updated_at=job.updated_at,
+        )
+
+
+class BulkItemResult(BaseModel):
+    """
+    Result of one item of a bulk import.
+
+    'status' is 'registered' (stored and registered at the offers API), 'created' (stored, but the registration
+    failed - it is repeated by the first fetch of the offers) or 'invalid' (not stored).
+    """
+
+    index: int
+    id: Optional[uuid.UUID] = None
+    status: str
+    error: Optional[str] = None
+
+
+class BulkImportResult(BaseModel):
+    registered: int = 0
+    created: int = 0
+    invalid: int = 0
+    # set if the body could not be parsed completely
+    error: Optional[str] = None
+    results: list[BulkItemResult] = []
+
+
 class AuthModel(BaseModel):
     username: str
     password: str
@@ -76,16 +132,63 @@ class OfferPriceSummary(BaseModel):
     avg: float
     median: float
     count: int
+    weighted_avg: Optional[float] = None
+    weighted_median: Optional[float] = None
 
     @staticmethod
-    def from_model(model: OfferSummary):
+    def from_model(model: OfferSummary | PriceSummary, time: float):
+        """
+        Create the summary from anything with the columns of 'OfferSummary', e.g. a model, a result row or a 'PriceSummary'.
+        """
         return OfferPriceSummary(
-            time=model.fetch.time,
+            time=time,
             min=model.min_price,
             max=model.max_price,
             avg=model.avg_price,
             median=model.median_price,
             count=model.offer_count,
+            weighted_avg=model.weighted_avg_price,
+            weighted_median=model.weighted_median_price,
+        )
+
+    @staticmethod
+    def aggregate(
+        summaries: list["OfferPriceSummary"], time: float
+    ) -> "OfferPriceSummary":
+        """
+        Combine the summaries of several fetches into one, e.g. for a time bucket.
+
+        The average is weighted by the number of offers of each fetch, the median is the median of the
+        medians of the fetches and the count is the number of combined fetches. The stock-weighted variants
+        are the mean and the median of the stock-weighted values of the fetches.
+
+        The result does not depend on the order of the summaries, so rollups computed in any order
+        give exactly the same values as combining the fetches at query time.
+        """
+        offers = sum(summary.count for summary in summaries)
+        weighted = [summary for summary in summaries if summary.weighted_avg is not None]
+
+        return OfferPriceSummary(
+            time=time,
+            min=min(summary.min for summary in summaries),
+            max=max(summary.max for summary in summaries),
+            avg=(
+                math.fsum(summary.avg * summary.count for summary in summaries) / offers
+                if offers
+                else 0
+            ),
+            median=statistics.median(summary.median for summary in summaries),
+            count=len(summaries),
+            weighted_avg=(
+                statistics.mean(summary.weighted_avg for summary in weighted)
+                if weighted
+                else None
+            ),
+            weighted_median=(
+                statistics.median(summary.weighted_median for summary in weighted)
+                if weighted
+                else None
+            ),
         )
 
 
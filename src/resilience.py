@@ -0,0 +1,340 @@
+import asyncio
+from dataclasses import dataclass
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from .exceptions.external import UpstreamUnavailableError
+import src.env as env
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Every request to the offers API goes through 'UpstreamGuard.call':
+#   - a token bucket shared by all callers keeps the request rate under UPSTREAM_RATE_LIMIT,
+#   - failed requests (connection errors, timeouts, 429 and 5xx responses) are retried with exponential backoff
+#     and full jitter, but only while the retry budget allows it, so that retries can not multiply the load
+#     on an API that is already struggling,
+#   - after UPSTREAM_BREAKER_THRESHOLD consecutive failures the circuit breaker opens and requests fail
+#     immediately with 'UpstreamUnavailableError' for UPSTREAM_BREAKER_RESET seconds. After that, one trial
+#     request is let through, and depending on its result the breaker closes or stays open for another period.
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Requests that are not idempotent (e.g. the product registration) are only retried when the API certainly did not
+# process them: the connection could not be made, or the API refused the request because it is overloaded.
+NOT_PROCESSED_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+NOT_PROCESSED_STATUS_CODES = {429, 503}
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Tokens are added at 'rate' per second up to 'capacity', every request takes one.
+
+    Attributes:
+        waits (int): Number of requests that had to wait for a token.
+        wait_time (float): Total time in seconds requests waited for a token.
+        max_wait (float): Longest time in seconds a request waited for a token.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """
+        Take a token, waiting until one is available.
+
+        Returns:
+            float: Number of seconds the caller waited.
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        start = time.monotonic()
+        # the lock makes the waiting callers take their tokens in the order they arrived
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            self.waits += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+            logger.debug("Waited %.3fs for the upstream rate limit", waited)
+        return waited
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of the requests. Every request deposits 'ratio' of a retry up to 'capacity',
+    every retry withdraws one. When the API fails persistently, the budget runs dry and only first attempts are sent.
+    """
+
+    def __init__(self, ratio: float, capacity: float):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._balance = capacity
+
+    def deposit(self):
+        self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker counting consecutive failures.
+
+    Attributes:
+        state (str): 'closed' (requests pass), 'open' (requests are rejected) or 'half_open' (a trial request passes).
+        opened (int): Number of times the breaker opened.
+        rejected (int): Number of requests rejected while it was open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """
+        Raises 'UpstreamUnavailableError' if the request may not be sent.
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise UpstreamUnavailableError()
+            self._set_state(self.HALF_OPEN)
+
+        if self.state == self.HALF_OPEN:
+            if self._trial_running:
+                self.rejected += 1
+                raise UpstreamUnavailableError()
+            self._trial_running = True
+
+    def record_success(self):
+        self._failures = 0
+        self._trial_running = False
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self._failures += 1
+        self._trial_running = False
+        if self.state == self.HALF_OPEN or (
+            self.threshold > 0 and self._failures >= self.threshold
+        ):
+            self._opened_at = time.monotonic()
+            if self.state != self.OPEN:
+                self.opened += 1
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state: str):
+        logger.warning("Offers API circuit breaker %s -> %s", self.state, state)
+        self.state = state
+
+
+@dataclass
+class UpstreamStats:
+    """
+    Snapshot of the state of the upstream guard.
+
+    Attributes:
+        breaker_state (str): State of the circuit breaker.
+        breaker_opened (int): Number of times the breaker opened.
+        rejected (int): Number of requests rejected by the open breaker.
+        limiter_waits (int): Number of requests that waited for the rate limiter.
+        limiter_wait_time (float): Total time in seconds requests waited for the rate limiter.
+        limiter_max_wait (float): Longest wait for the rate limiter in seconds.
+        retries (int): Number of retried requests.
+        retries_denied (int): Number of retries not made because the retry budget was spent.
+    """
+
+    breaker_state: str
+    breaker_opened: int
+    rejected: int
+    limiter_waits: int
+    limiter_wait_time: float
+    limiter_max_wait: float
+    retries: int
+    retries_denied: int
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Backoff before retry number 'attempt' (starting at 0): a random time up to the exponentially growing
+    delay ("full jitter"), so that callers that failed together do not retry together.
+    """
+    return random.uniform(
+        0, min(env.UPSTREAM_RETRY_MAX_DELAY, env.UPSTREAM_RETRY_BASE_DELAY * 2**attempt)
+    )
+
+
+class UpstreamGuard:
+    """
+    Rate limiter, retries and circuit breaker shared by all requests to the offers API.
+
+    Attributes:
+        limiter (Optional[TokenBucket]): The rate limiter, created on first use.
+        budget (Optional[RetryBudget]): The retry budget, created on first use.
+        breaker (Optional[CircuitBreaker]): The circuit breaker, created on first use.
+        retries (int): Number of retried requests.
+        retries_denied (int): Number of retries not made because the retry budget was spent.
+    """
+
+    limiter: Optional[TokenBucket] = None
+    budget: Optional[RetryBudget] = None
+    breaker: Optional[CircuitBreaker] = None
+    retries = 0
+    retries_denied = 0
+
+    @classmethod
+    def _ensure_started(cls):
+        if cls.limiter is None:
+            cls.limiter = TokenBucket(env.UPSTREAM_RATE_LIMIT, env.UPSTREAM_RATE_BURST)
+            cls.budget = RetryBudget(
+                env.UPSTREAM_RETRY_BUDGET, env.UPSTREAM_RETRY_BUDGET_CAPACITY
+            )
+            cls.breaker = CircuitBreaker(
+                env.UPSTREAM_BREAKER_THRESHOLD, env.UPSTREAM_BREAKER_RESET
+            )
+
+    @classmethod
+    def reset(cls):
+        """
+        Forget all state, the next request creates everything again from the current settings.
+        """
+        cls.limiter = None
+        cls.budget = None
+        cls.breaker = None
+        cls.retries = 0
+        cls.retries_denied = 0
+
+    @classmethod
+    def stats(cls) -> UpstreamStats:
+        cls._ensure_started()
+        return UpstreamStats(
+            breaker_state=cls.breaker.state,
+            breaker_opened=cls.breaker.opened,
+            rejected=cls.breaker.rejected,
+            limiter_waits=cls.limiter.waits,
+            limiter_wait_time=cls.limiter.wait_time,
+            limiter_max_wait=cls.limiter.max_wait,
+            retries=cls.retries,
+            retries_denied=cls.retries_denied,
+        )
+
+    @classmethod
+    async def call(
+        cls,
+        send: Callable[[], Awaitable[httpx.Response]],
+        idempotent: bool = True,
+    ) -> httpx.Response:
+        """
+        Send a request to the offers API.
+
+        Args:
+            send (Callable): Sends the request, called once per attempt.
+            idempotent (bool): Whether the request may be retried after the API possibly processed it.
+
+        Returns:
+            httpx.Response: The response of the last attempt. It may still be an error response
+                if the retries were exhausted.
+
+        Raises:
+            UpstreamUnavailableError: If the circuit breaker is open.
+            httpx.HTTPError: If the last attempt failed without a response.
+        """
+        cls._ensure_started()
+        cls.budget.deposit()
+
+        attempt = 0
+        while True:
+            # the token is taken before the breaker is asked, so a caller cancelled while waiting for the rate limit
+            # never holds the trial request of a half open breaker
+            await cls.limiter.acquire()
+            cls.breaker.before_call()
+
+            try:
+                response = await send()
+            except httpx.TransportError as e:
+                cls.breaker.record_failure()
+                retryable = idempotent or isinstance(e, NOT_PROCESSED_ERRORS)
+                if not await cls._retry(attempt, retryable, str(e)):
+                    raise
+            except BaseException:
+                # anything else (e.g. the caller's timeout cancelling the request) counts as a failure too,
+                # otherwise a cancelled trial request would leave the half open breaker waiting for its result forever
+                cls.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    cls.breaker.record_success()
+                    return response
+
+                cls.breaker.record_failure()
+                retryable = (
+                    idempotent or response.status_code in NOT_PROCESSED_STATUS_CODES
+                )
+                if not await cls._retry(
+                    attempt, retryable, f"status code {response.status_code}"
+                ):
+                    return response
+
+            attempt += 1
+
+    @classmethod
+    async def _retry(cls, attempt: int, retryable: bool, reason: str) -> bool:
+        """
+        Wait before the next attempt, if there should be one.
+        """
+        if not retryable or attempt >= env.UPSTREAM_RETRIES:
+            return False
+        if cls.breaker.state == CircuitBreaker.OPEN:
+            return False
+        if not cls.budget.withdraw():
+            cls.retries_denied += 1
+            return False
+
+        cls.retries += 1
+        delay = retry_delay(attempt)
+        logger.warning(
+            "Offers API request failed (%s), retrying in %.2fs", reason, delay
+        )
+        await asyncio.sleep(delay)
+        return True
@@ -0,0 +1,201 @@
+from collections import defaultdict
+from dataclasses import dataclass
+import time
+import uuid
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from .db import async_session_scope
+from .orm_models import Fetch, Offer, OfferSummary, offer_fetch
+from .summary import summarize_offers
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Raw snapshots (the links between a fetch and its offers) are only kept for SNAPSHOT_RETENTION_DAYS. After that,
+# only the fetch and its summary remain, which is all the price history and the rollups need. A snapshot is kept
+# for longer while it is still the current one of its product, i.e. the snapshot of the latest fetch, or of a
+# fetch within the retention period. Offers without any remaining link are deleted as well.
+
+
+@dataclass
+class CompactionStats:
+    """
+    What a compaction run reclaimed.
+
+    Attributes:
+        snapshots (int): Number of snapshot fetches whose links were deleted.
+        links (int): Number of deleted offer_fetch rows.
+        offers (int): Number of deleted offers that were no longer linked to any fetch.
+        summaries (int): Number of summaries computed for old fetches that did not have one yet.
+        wall_time (float): Duration of the run in seconds.
+    """
+
+    snapshots: int = 0
+    links: int = 0
+    offers: int = 0
+    summaries: int = 0
+    wall_time: float = 0.0
+
+
+def _expired_snapshots(cutoff: float, limit: int):
+    """
+    Select up to 'limit' of the oldest snapshot fetches before 'cutoff' that were not compacted yet
+    and are not used by the latest fetch of their product or by any fetch after 'cutoff'.
+    """
+    latest = aliased(Fetch)
+    latest_snapshot = (
+        select(func.coalesce(latest.snapshot_id, latest.id))
+        .where(latest.product_id == Fetch.product_id)
+        .order_by(latest.time.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+    marker = aliased(Fetch)
+    used_after_cutoff = (
+        select(marker.id)
+        .where(marker.snapshot_id == Fetch.id)
+        .where(marker.time >= cutoff)
+        .exists()
+    )
+
+    return (
+        select(Fetch.id, Fetch.offer_summary_id)
+        .where(Fetch.compacted_at.is_(None))
+        .where(Fetch.snapshot_id.is_(None))
+        .where(Fetch.time < cutoff)
+        .where(~used_after_cutoff)
+        .where(Fetch.id != latest_snapshot)
+        .order_by(Fetch.time)
+        .limit(limit)
+    )
+
+
+async def _summarize_before_compaction(
+    session: AsyncSession, fetch_ids: list[uuid.UUID]
+) -> int:
+    """
+    Store the summaries of fetches stored before summaries were computed at ingest, while their offers still exist.
+    Fetches that only confirmed one of these snapshots get the same summary.
+
+    Returns:
+        int: Number of stored summaries.
+    """
+    if not fetch_ids:
+        return 0
+
+    offers = (
+        await session.execute(
+            select(offer_fetch.c.fetch_id, Offer.price, Offer.items_in_stock)
+            .join(Offer, Offer.id == offer_fetch.c.offer_id)
+            .where(offer_fetch.c.fetch_id.in_(fetch_ids))
+        )
+    ).all()
+
+    offers_by_fetch = defaultdict(list)
+    for offer in offers:
+        offers_by_fetch[offer.fetch_id].append(offer)
+
+    for fetch_id in fetch_ids:
+        summary_id = uuid.uuid4()
+        summary = summarize_offers(
+            [offer.price for offer in offers_by_fetch[fetch_id]],
+            [offer.items_in_stock for offer in offers_by_fetch[fetch_id]],
+        )
+        await session.execute(
+            insert(OfferSummary).values(id=summary_id, **summary.to_dict())
+        )
+        await session.execute(
+            update(Fetch)
+            .where((Fetch.id == fetch_id) | (Fetch.snapshot_id == fetch_id))
+            .where(Fetch.offer_summary_id.is_(None))
+            .values(offer_summary_id=summary_id)
+        )
+
+    return len(fetch_ids)
+
+
+async def compact_batch(
+    session: AsyncSession, cutoff: float, batch_size: int
+) -> CompactionStats:
+    """
+    Delete the links (and the offers left without links) of up to 'batch_size' expired snapshots.
+    """
+    stats = CompactionStats()
+
+    snapshots = (await session.execute(_expired_snapshots(cutoff, batch_size))).all()
+    if not snapshots:
+        return stats
+
+    fetch_ids = [snapshot.id for snapshot in snapshots]
+    stats.snapshots = len(fetch_ids)
+
+    stats.summaries = await _summarize_before_compaction(
+        session,
+        [snapshot.id for snapshot in snapshots if snapshot.offer_summary_id is None],
+    )
+
+    offer_ids = (
+        await session.scalars(
+            select(offer_fetch.c.offer_id)
+            .where(offer_fetch.c.fetch_id.in_(fetch_ids))
+            .distinct()
+        )
+    ).all()
+
+    deleted_links = await session.execute(
+        delete(offer_fetch).where(offer_fetch.c.fetch_id.in_(fetch_ids))
+    )
+    stats.links = deleted_links.rowcount
+
+    await session.execute(
+        update(Fetch).where(Fetch.id.in_(fetch_ids)).values(compacted_at=time.time())
+    )
+
+    if offer_ids:
+        still_linked = (
+            select(offer_fetch.c.id)
+            .where(offer_fetch.c.offer_id == Offer.id)
+            .exists()
+        )
+        deleted_offers = await session.execute(
+            delete(Offer).where(Offer.id.in_(offer_ids)).where(~still_linked)
+        )
+        stats.offers = deleted_offers.rowcount
+
+    return stats
+
+
+async def compact_snapshots(
+    retention_days: float, batch_size: int, max_batches: int
+) -> CompactionStats:
+    """
+    Compact the snapshots older than 'retention_days', 'batch_size' snapshots per transaction,
+    so that no lock is held for long. Stops after 'max_batches' batches, the rest is left for the next run.
+
+    Returns:
+        CompactionStats: What was reclaimed.
+    """
+    stats = CompactionStats()
+    start = time.monotonic()
+    cutoff = time.time() - retention_days * 24 * 60 * 60
+
+    for _ in range(max_batches):
+        async with async_session_scope() as session:
+            batch = await compact_batch(session, cutoff, batch_size)
+
+        stats.snapshots += batch.snapshots
+        stats.links += batch.links
+        stats.offers += batch.offers
+        stats.summaries += batch.summaries
+
+        if batch.snapshots < batch_size:
+            break
+
+    stats.wall_time = time.monotonic() - start
+    return stats
@@ -0,0 +1,494 @@
+"""
+Rollups of the price history of products.
+
+The summaries of the fetches of a product are combined into buckets of one hour and one day (see
+'OfferPriceSummary.aggregate') and stored in the 'price_rollup' table, so that bucketed price history does not
+have to read every fetch. When a fetch is stored, the rollup of its hour is recomputed and the fetch is added to
+the rollup of its day. The medians of a day can not be updated that way, so the day stays open (without medians)
+until the first fetch of a later day closes it. Open days are combined from their fetches when they are read.
+
+Rollups of databases that had fetches before the rollups existed are created with (until then, the history of
+ranges with missing rollups is combined from the fetches):
+
+    python -m src.rollups                 # all products
+    python -m src.rollups <product_id>    # specific products
+"""
+import asyncio
+from collections import defaultdict
+from itertools import groupby
+import math
+import sys
+import uuid
+
+from sqlalchemy import Select, case, delete, func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .db import async_session_scope
+from .orm_models import Fetch, Offer, OfferSummary, PriceRollup, Product, offer_fetch
+from .pydantic_models import OfferPriceSummary
+from .summary import summarize_offers
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# the resolutions of the rollups, coarsest first. Every resolution has to divide the coarsest one.
+ROLLUP_RESOLUTIONS = (DAY, HOUR)
+
+
+def price_history_query(product_id: uuid.UUID, from_time: float, to_time: float):
+    """
+    Select the fetches of a product in a time range together with the columns of their summaries.
+    The summary columns are NULL for fetches stored before summaries were computed at ingest.
+    """
+    return (
+        select(
+            Fetch.time,
+            Fetch.id,
+            Fetch.snapshot_id,
+            OfferSummary.min_price,
+            OfferSummary.max_price,
+            OfferSummary.avg_price,
+            OfferSummary.median_price,
+            OfferSummary.offer_count,
+            OfferSummary.weighted_avg_price,
+            OfferSummary.weighted_median_price,
+        )
+        .outerjoin(OfferSummary, Fetch.offer_summary_id == OfferSummary.id)
+        .filter(Fetch.product_id == product_id)
+        .filter(Fetch.time >= from_time)
+        .filter(Fetch.time <= to_time)
+    )
+
+
+async def summarize_legacy_fetches(
+    session: AsyncSession, rows: list
+) -> dict[uuid.UUID, OfferPriceSummary]:
+    """
+    Compute the summaries of fetches stored before summaries were computed at ingest, without storing them.
+    """
+    if not rows:
+        return {}
+
+    snapshot_ids = {row.id: row.snapshot_id or row.id for row in rows}
+    offers = (
+        await session.execute(
+            select(offer_fetch.c.fetch_id, Offer.price, Offer.items_in_stock)
+            .join(Offer, Offer.id == offer_fetch.c.offer_id)
+            .where(offer_fetch.c.fetch_id.in_(set(snapshot_ids.values())))
+        )
+    ).all()
+
+    offers_by_fetch = defaultdict(list)
+    for offer in offers:
+        offers_by_fetch[offer.fetch_id].append(offer)
+
+    summaries = {}
+    for row in rows:
+        snapshot_offers = offers_by_fetch[snapshot_ids[row.id]]
+        summary = summarize_offers(
+            [offer.price for offer in snapshot_offers],
+            [offer.items_in_stock for offer in snapshot_offers],
+        )
+        summaries[row.id] = OfferPriceSummary.from_model(summary, row.time)
+    return summaries
+
+
+async def _read_fetch_summaries(
+    session: AsyncSession, query: Select
+) -> list[tuple[uuid.UUID, OfferPriceSummary]]:
+    """
+    Run a 'price_history_query' and get the ids and summaries of the fetches in the order of the query.
+    """
+    rows = (await session.execute(query)).all()
+
+    legacy_summaries = await summarize_legacy_fetches(
+        session, [row for row in rows if row.offer_count is None]
+    )
+
+    return [
+        (
+            row.id,
+            legacy_summaries[row.id]
+            if row.offer_count is None
+            else OfferPriceSummary.from_model(row, row.time),
+        )
+        for row in rows
+    ]
+
+
+async def read_summaries(session: AsyncSession, query: Select) -> list[OfferPriceSummary]:
+    """
+    Run a 'price_history_query' and get the summaries of the fetches in the order of the query.
+    """
+    return [summary for _, summary in await _read_fetch_summaries(session, query)]
+
+
+def _buckets(summaries: list[OfferPriceSummary], bucket: int):
+    # the summaries are ordered by time, so every bucket is one consecutive group
+    for bucket_start, bucket_summaries in groupby(
+        summaries, key=lambda summary: summary.time // bucket * bucket
+    ):
+        yield bucket_start, list(bucket_summaries)
+
+
+def combine_buckets(
+    summaries: list[OfferPriceSummary], bucket: int
+) -> list[OfferPriceSummary]:
+    """
+    Combine summaries ordered by time into buckets of 'bucket' seconds, in the same order.
+    The time of a bucket is the time it starts at.
+    """
+    return [
+        OfferPriceSummary.aggregate(bucket_summaries, bucket_start)
+        for bucket_start, bucket_summaries in _buckets(summaries, bucket)
+    ]
+
+
+def full_buckets(from_time: float, to_time: float, resolution: int) -> tuple[int, int]:
+    """
+    Get the range [start, end) of the buckets that lie completely within [from_time, to_time].
+    The range is empty (start >= end) if there is no such bucket.
+    """
+    return math.ceil(from_time / resolution) * resolution, int(
+        to_time // resolution * resolution
+    )
+
+
+async def read_rollups(
+    session: AsyncSession,
+    product_id: uuid.UUID,
+    resolution: int,
+    start: float,
+    end: float,
+) -> list[OfferPriceSummary]:
+    """
+    Get the summaries of the buckets of a product that start in [start, end) from the rollups, newest first.
+
+    Open days are combined from their fetches. If the rollups do not cover all fetches in the range (e.g. of
+    fetches stored before the rollups existed), the whole range is combined from the fetches.
+    """
+    rollups = (
+        await session.scalars(
+            select(PriceRollup)
+            .where(PriceRollup.product_id == product_id)
+            .where(PriceRollup.resolution == resolution)
+            .where(PriceRollup.bucket_start >= start)
+            .where(PriceRollup.bucket_start < end)
+            .order_by(PriceRollup.bucket_start.desc())
+        )
+    ).all()
+
+    fetches = await session.scalar(
+        select(func.count())
+        .select_from(Fetch)
+        .where(Fetch.product_id == product_id)
+        .where(Fetch.time >= start)
+        .where(Fetch.time < end)
+    )
+    if sum(rollup.fetch_count for rollup in rollups) != fetches:
+        return combine_buckets(
+            await _summaries_between(session, product_id, start, end), resolution
+        )
+
+    summaries = []
+    for rollup in rollups:
+        if rollup.median_price is None:
+            summaries.append(
+                OfferPriceSummary.aggregate(
+                    await _summaries_between(
+                        session,
+                        product_id,
+                        rollup.bucket_start,
+                        rollup.bucket_start + resolution,
+                    ),
+                    rollup.bucket_start,
+                )
+            )
+            continue
+        summaries.append(
+            OfferPriceSummary(
+                time=rollup.bucket_start,
+                min=rollup.min_price,
+                max=rollup.max_price,
+                avg=rollup.avg_price,
+                median=rollup.median_price,
+                count=rollup.fetch_count,
+                weighted_avg=rollup.weighted_avg_price,
+                weighted_median=rollup.weighted_median_price,
+            )
+        )
+    return summaries
+
+
+def _rollup_row(
+    product_id: uuid.UUID,
+    resolution: int,
+    summaries: list[OfferPriceSummary],
+    bucket_start: float,
+) -> dict:
+    """
+    The rollup of the summaries of the fetches in one bucket.
+    """
+    summary = OfferPriceSummary.aggregate(summaries, bucket_start)
+    return {
+        "product_id": product_id,
+        "resolution": resolution,
+        "bucket_start": summary.time,
+        "min_price": summary.min,
+        "max_price": summary.max,
+        "avg_price": summary.avg,
+        "median_price": summary.median,
+        "fetch_count": summary.count,
+        "weighted_avg_price": summary.weighted_avg,
+        "weighted_median_price": summary.weighted_median,
+        "offer_count": sum(summary.count for summary in summaries),
+        "weighted_count": len(
+            [summary for summary in summaries if summary.weighted_avg is not None]
+        ),
+    }
+
+
+def _dialect_insert(session: AsyncSession):
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql_insert
+    return sqlite_insert
+
+
+async def _upsert_rollups(session: AsyncSession, rows: list[dict]) -> None:
+    if not rows:
+        return
+
+    statement = _dialect_insert(session)(PriceRollup)
+    await session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[
+                PriceRollup.product_id,
+                PriceRollup.resolution,
+                PriceRollup.bucket_start,
+            ],
+            set_={
+                column: statement.excluded[column]
+                for column in rows[0]
+                if column not in ("product_id", "resolution", "bucket_start")
+            },
+        ),
+        rows,
+    )
+
+
+async def _summaries_between(
+    session: AsyncSession, product_id: uuid.UUID, start: float, end: float
+) -> list[OfferPriceSummary]:
+    """
+    Get the summaries of the fetches of a product in [start, end), newest first like the price history.
+    """
+    return await read_summaries(
+        session,
+        price_history_query(product_id, start, end)
+        .filter(Fetch.time < end)
+        .order_by(Fetch.time.desc()),
+    )
+
+
+async def _add_to_day(
+    session: AsyncSession,
+    product_id: uuid.UUID,
+    day_start: float,
+    summary: OfferPriceSummary,
+) -> int:
+    """
+    Add the summary of a new fetch to the rollup of its day, which is opened by clearing its medians.
+
+    Returns:
+        int: Number of fetches of the day, including the new one.
+    """
+    row = _rollup_row(product_id, DAY, [summary], day_start)
+    row.update(median_price=None, weighted_median_price=None)
+
+    if session.get_bind().dialect.name == "postgresql":
+        least, greatest = func.least, func.greatest
+    else:
+        least, greatest = func.min, func.max
+
+    statement = _dialect_insert(session)(PriceRollup).values(row)
+    new = statement.excluded
+    offers = PriceRollup.offer_count + new.offer_count
+    weighted = PriceRollup.weighted_count + new.weighted_count
+    statement = statement.on_conflict_do_update(
+        index_elements=[
+            PriceRollup.product_id,
+            PriceRollup.resolution,
+            PriceRollup.bucket_start,
+        ],
+        set_={
+            "min_price": least(PriceRollup.min_price, new.min_price),
+            "max_price": greatest(PriceRollup.max_price, new.max_price),
+            "avg_price": case(
+                (
+                    offers > 0,
+                    (
+                        PriceRollup.avg_price * PriceRollup.offer_count
+                        + new.avg_price * new.offer_count
+                    )
+                    / offers,
+                ),
+                else_=0,
+            ),
+            "median_price": None,
+            "fetch_count": PriceRollup.fetch_count + new.fetch_count,
+            "offer_count": offers,
+            "weighted_avg_price": case(
+                (
+                    weighted > 0,
+                    (
+                        func.coalesce(PriceRollup.weighted_avg_price, 0)
+                        * PriceRollup.weighted_count
+                        + func.coalesce(new.weighted_avg_price, 0) * new.weighted_count
+                    )
+                    / weighted,
+                ),
+                else_=None,
+            ),
+            "weighted_median_price": None,
+            "weighted_count": weighted,
+        },
+    ).returning(PriceRollup.fetch_count)
+    return (await session.execute(statement)).scalar_one()
+
+
+async def close_days(session: AsyncSession, product_id: uuid.UUID, before: float) -> None:
+    """
+    Compute the medians of the open days of a product that start before 'before' from their fetches.
+    """
+    open_days = (
+        await session.scalars(
+            select(PriceRollup.bucket_start)
+            .where(PriceRollup.product_id == product_id)
+            .where(PriceRollup.resolution == DAY)
+            .where(PriceRollup.bucket_start < before)
+            .where(PriceRollup.median_price.is_(None))
+        )
+    ).all()
+
+    rows = []
+    for day_start in open_days:
+        summaries = await _summaries_between(
+            session, product_id, day_start, day_start + DAY
+        )
+        if summaries:
+            rows.append(_rollup_row(product_id, DAY, summaries, day_start))
+    await _upsert_rollups(session, rows)
+
+
+async def update_rollups(
+    session: AsyncSession, product_id: uuid.UUID, fetch_id: uuid.UUID, fetch_time: float
+) -> None:
+    """
+    Update the rollups of a product after the fetch 'fetch_id' was stored.
+
+    Only the rollup of the hour of the fetch is recomputed from its fetches. The fetch is added to the rollup
+    of its day, and the first fetch of a day closes the open days before it.
+    """
+    hour_start = fetch_time // HOUR * HOUR
+    fetches = await _read_fetch_summaries(
+        session,
+        price_history_query(product_id, hour_start, hour_start + HOUR).filter(
+            Fetch.time < hour_start + HOUR
+        ),
+    )
+    await _upsert_rollups(
+        session,
+        [_rollup_row(product_id, HOUR, [summary for _, summary in fetches], hour_start)],
+    )
+
+    day_start = fetch_time // DAY * DAY
+    summary = next(summary for id, summary in fetches if id == fetch_id)
+    if await _add_to_day(session, product_id, day_start, summary) == 1:
+        await close_days(session, product_id, day_start)
+
+
+async def rebuild_rollups(product_id: uuid.UUID) -> int:
+    """
+    Recreate all rollups of a product from its fetches, one coarsest bucket per transaction.
+
+    Returns:
+        int: Number of rollups written.
+    """
+    coarsest = ROLLUP_RESOLUTIONS[0]
+
+    async with async_session_scope() as session:
+        first_time, last_time = (
+            await session.execute(
+                select(func.min(Fetch.time), func.max(Fetch.time)).where(
+                    Fetch.product_id == product_id
+                )
+            )
+        ).one()
+
+        # rollups outside of the history, e.g. of fetches that no longer exist
+        stale = delete(PriceRollup).where(PriceRollup.product_id == product_id)
+        if first_time is not None:
+            stale = stale.where(
+                (PriceRollup.bucket_start < first_time // coarsest * coarsest)
+                | (PriceRollup.bucket_start > last_time)
+            )
+        await session.execute(stale)
+
+    if first_time is None:
+        return 0
+
+    written = 0
+    start = first_time // coarsest * coarsest
+    while start <= last_time:
+        async with async_session_scope() as session:
+            summaries = await _summaries_between(
+                session, product_id, start, start + coarsest
+            )
+
+            await session.execute(
+                delete(PriceRollup)
+                .where(PriceRollup.product_id == product_id)
+                .where(PriceRollup.bucket_start >= start)
+                .where(PriceRollup.bucket_start < start + coarsest)
+            )
+
+            rows = [
+                _rollup_row(product_id, resolution, bucket_summaries, bucket_start)
+                for resolution in ROLLUP_RESOLUTIONS
+                for bucket_start, bucket_summaries in _buckets(summaries, resolution)
+            ]
+            await _upsert_rollups(session, rows)
+            written += len(rows)
+
+        start += coarsest
+
+    return written
+
+
+async def rebuild_all_rollups(product_ids: list[uuid.UUID] | None = None) -> None:
+    """
+    Recreate the rollups of the given products, or of all products if None.
+    """
+    if product_ids is None:
+        async with async_session_scope() as session:
+            product_ids = (
+                await session.scalars(
+                    select(Product.id).where(Product.deleted_at.is_(None))
+                )
+            ).all()
+
+    for product_id in product_ids:
+        written = await rebuild_rollups(product_id)
+        logger.info("Rebuilt %d rollups of product %s", written, product_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        rebuild_all_rollups([uuid.UUID(arg) for arg in sys.argv[1:]] or None)
+    )
@@ -0,0 +1,241 @@
+from dataclasses import dataclass
+import heapq
+import itertools
+import random
+from typing import Optional
+import uuid
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .orm_models import Fetch, FetchLease, Offer, Product
+from .offers import _fingerprint_offers
+import src.env as env
+from .logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Every product is fetched on its own interval. The interval starts at PERIODIC_FETCH_INTERVAL, it shrinks whenever
+# a fetch finds changed offers and grows whenever the offers stayed the same, within FETCH_MIN_INTERVAL and
+# FETCH_MAX_INTERVAL. Products whose prices change often are polled more frequently, stable ones less.
+# Every due time is jittered by FETCH_JITTER, so that products added at the same time drift apart instead of
+# being fetched in bursts.
+
+# factors the interval is multiplied with after a fetch that found changed / unchanged offers
+INTERVAL_DECREASE = 0.5
+INTERVAL_INCREASE = 1.5
+# shortest sleep of the worker between two rounds, so that it does not spin on products claimed by other replicas
+MIN_SLEEP = 1.0
+
+
+def next_interval(interval: float, changed: Optional[bool]) -> float:
+    """
+    Adapt the fetch interval of a product to the result of its last fetch.
+
+    Args:
+        interval (float): The current interval in seconds.
+        changed (Optional[bool]): Whether the offers changed since the previous fetch, None if that is unknown.
+    """
+    if changed is None:
+        return interval
+    if changed:
+        interval *= INTERVAL_DECREASE
+    else:
+        interval *= INTERVAL_INCREASE
+    return min(max(interval, env.FETCH_MIN_INTERVAL), env.FETCH_MAX_INTERVAL)
+
+
+def jittered(interval: float) -> float:
+    """
+    Randomly lengthen or shorten an interval by up to FETCH_JITTER of its length.
+    """
+    return interval * (1 + random.uniform(-env.FETCH_JITTER, env.FETCH_JITTER))
+
+
+def offers_changed(fingerprint: Optional[str], offers: list[Offer]) -> tuple[Optional[bool], str]:
+    """
+    Compare fetched offers with the fingerprint of the previous fetch.
+
+    Returns:
+        tuple[Optional[bool], str]: Whether the offers changed (None if there was no previous fingerprint)
+            and the fingerprint of the fetched offers.
+    """
+    new_fingerprint = _fingerprint_offers(offers)
+    if fingerprint is None:
+        return None, new_fingerprint
+    return new_fingerprint != fingerprint, new_fingerprint
+
+
+@dataclass
+class ProductSchedule:
+    """
+    When a product is due to be fetched next.
+
+    Attributes:
+        product_id (uuid.UUID): The product.
+        due (float): Time (as in 'time.time()') the product is due at.
+        interval (float): The current fetch interval of the product in seconds.
+        fingerprint (Optional[str]): Fingerprint of the offers of the last fetch, if known.
+    """
+
+    product_id: uuid.UUID
+    due: float
+    interval: float
+    fingerprint: Optional[str] = None
+
+
+class FetchScheduler:
+    """
+    Priority queue of products keyed by the time they are due to be fetched at.
+
+    Products taken out with 'pop_due' are in flight until they are put back with 'reschedule'.
+    Entries of the heap are not removed when a product is rescheduled or removed, they are skipped when they
+    come up instead.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, uuid.UUID]] = []
+        self._entries: dict[uuid.UUID, ProductSchedule] = {}
+        self._in_flight: set[uuid.UUID] = set()
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, product_id: uuid.UUID) -> bool:
+        return product_id in self._entries
+
+    def product_ids(self) -> set[uuid.UUID]:
+        return set(self._entries)
+
+    def schedule(self, entry: ProductSchedule) -> None:
+        """
+        Add a product or move it to 'entry.due'.
+        """
+        self._entries[entry.product_id] = entry
+        self._in_flight.discard(entry.product_id)
+        heapq.heappush(self._heap, (entry.due, next(self._counter), entry.product_id))
+
+    def remove(self, product_id: uuid.UUID) -> None:
+        self._entries.pop(product_id, None)
+        self._in_flight.discard(product_id)
+
+    def _is_current(self, due: float, product_id: uuid.UUID) -> bool:
+        entry = self._entries.get(product_id)
+        return (
+            entry is not None
+            and entry.due == due
+            and product_id not in self._in_flight
+        )
+
+    def next_due(self) -> Optional[float]:
+        """
+        The earliest due time of the products that are not in flight, None if there are none.
+        """
+        while self._heap and not self._is_current(self._heap[0][0], self._heap[0][2]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float, limit: int) -> list[ProductSchedule]:
+        """
+        Take out up to 'limit' products that are due at 'now', the most overdue first.
+        """
+        due = []
+        while len(due) < limit:
+            next_due = self.next_due()
+            if next_due is None or next_due > now:
+                break
+            _, _, product_id = heapq.heappop(self._heap)
+            self._in_flight.add(product_id)
+            due.append(self._entries[product_id])
+        return due
+
+    def reschedule(
+        self, entry: ProductSchedule, offers: Optional[list[Offer]], now: float
+    ) -> ProductSchedule:
+        """
+        Put a product that was taken out with 'pop_due' back, after a fetch.
+
+        Args:
+            entry (ProductSchedule): The entry returned by 'pop_due'.
+            offers (Optional[list[Offer]]): The fetched offers, None if the fetch failed.
+            now (float): The time of the fetch.
+        """
+        if entry.product_id not in self._entries:
+            # removed while it was being fetched
+            return entry
+
+        interval, fingerprint = entry.interval, entry.fingerprint
+        if offers is not None:
+            changed, fingerprint = offers_changed(entry.fingerprint, offers)
+            interval = next_interval(interval, changed)
+
+        new_entry = ProductSchedule(
+            product_id=entry.product_id,
+            due=now + jittered(interval),
+            interval=interval,
+            fingerprint=fingerprint,
+        )
+        self.schedule(new_entry)
+        return new_entry
+
+
+async def sync_schedule(session: AsyncSession, scheduler: FetchScheduler) -> None:
+    """
+    Add the products that are not scheduled yet and remove the deleted ones.
+
+    A new product is due one interval after its last fetch, so after a restart the products that were not
+    fetched for the longest time come first. Products that were never fetched come before all of them.
+    """
+    latest_fetch = (
+        select(Fetch.time, Fetch.fingerprint)
+        .where(Fetch.product_id == Product.id)
+        .order_by(Fetch.time.desc())
+        .limit(1)
+    )
+    products = (
+        await session.execute(
+            select(
+                Product.id,
+                latest_fetch.with_only_columns(Fetch.time).scalar_subquery(),
+                latest_fetch.with_only_columns(Fetch.fingerprint).scalar_subquery(),
+            ).where(Product.deleted_at.is_(None))
+        )
+    ).all()
+
+    scheduled = scheduler.product_ids()
+    for product_id in scheduled - {product.id for product in products}:
+        scheduler.remove(product_id)
+
+    added = 0
+    for product_id, last_time, fingerprint in products:
+        if product_id in scheduled:
+            continue
+        interval = env.PERIODIC_FETCH_INTERVAL
+        # products that were never fetched are the stalest ones
+        due = 0 if last_time is None else last_time + jittered(interval)
+        scheduler.schedule(ProductSchedule(product_id, due, interval, fingerprint))
+        added += 1
+
+    if added:
+        logger.debug("Scheduled %d new products", added)
+
+
+async def reschedule_lease(
+    session: AsyncSession, lease: FetchLease, owner: str, offers: list[Offer], now: float
+) -> None:
+    """
+    Adapt the interval of a leased product after a successful fetch. The lease of the product expires when
+    the product is due again, so the leases are the shared schedule of all replicas.
+    """
+    changed, fingerprint = offers_changed(lease.fingerprint, offers)
+    interval = next_interval(lease.interval or env.PERIODIC_FETCH_INTERVAL, changed)
+
+    await session.execute(
+        update(FetchLease)
+        .where(FetchLease.product_id == lease.product_id)
+        .where(FetchLease.owner == owner)
+        .values(expires_at=now + jittered(interval), interval=interval, fingerprint=fingerprint)
+    )
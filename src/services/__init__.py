@@ -1 +1,2 @@
 from .product import ProductService
+from .job import JobService
@@ -0,0 +1,15 @@
+import uuid
+
+from ..db import async_session_scope
+from ..orm_models import Job
+from ..pydantic_models import JobModel
+from ..exceptions.internal import EntityNotFound
+
+
+class JobService:
+    async def get_job(self, job_id: uuid.UUID) -> JobModel:
+        async with async_session_scope() as session:
+            job = await session.get(Job, job_id)
+            if job is None:
+                raise EntityNotFound(detail="Job not found")
+            return JobModel.from_job(job)
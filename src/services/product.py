@@ -1,20 +1,44 @@
-from typing import List
+import asyncio
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Optional
 import uuid
 
 from fastapi import APIRouter
-
-
-from ..db import session_scope
-from ..orm_models import Fetch, Offer, Product, offer_fetch
+from pydantic import ValidationError
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+
+from ..background import JobWorker, PurgeWorker
+from ..bulk import BulkFormatError
+from ..cache import ResultCache
+from ..db import async_session_scope
+from ..orm_models import Fetch, Product
+from ..jobs import create_job
+from ..purge import count_fetches, purge_product
+from ..rollups import (
+    ROLLUP_RESOLUTIONS,
+    combine_buckets,
+    full_buckets,
+    price_history_query,
+    read_rollups,
+    read_summaries,
+    summarize_legacy_fetches,
+)
 from ..pydantic_models import (
+    BulkImportResult,
+    BulkItemResult,
     CreateProductModel,
+    JobModel,
     OfferModel,
     OfferPriceDiff,
     OfferPriceSummary,
     ProductModel,
 )
-from ..offers import fetch_products, register_product
+from ..offers import fetch_products, latest_offers_query, register_product
 from ..logger import get_logger
+import src.env as env
 from ..exceptions.internal import (
     CustomException,
     InvalidProductData,
@@ -26,146 +50,413 @@ logger = get_logger(__name__)
 router = APIRouter()
 
 
+async def _get_product(session: AsyncSession, product_id: uuid.UUID) -> Product:
+    """
+    Get a product that was not deleted.
+
+    Raises:
+        EntityNotFound: If the product does not exist or was deleted.
+    """
+    product = await session.get(Product, product_id)
+    if not product or product.deleted_at is not None:
+        raise EntityNotFound(detail="Product not found")
+    return product
+
+
+def _bulk_product(item: Any) -> Product | str:
+    """
+    Create the product of an item of a bulk import, or describe why the item is invalid.
+    """
+    if isinstance(item, ValueError):
+        return str(item)
+    try:
+        data = CreateProductModel.model_validate(item)
+    except ValidationError as e:
+        return "; ".join(
+            f"{'.'.join(str(loc) for loc in error['loc']) or 'item'}: {error['msg']}"
+            for error in e.errors()
+        )
+    if not data.name or not data.description:
+        return "Product name and description required"
+    return Product(id=uuid.uuid4(), name=data.name, description=data.description)
+
+
 class ProductService:
-    async def read_products(self) -> list[ProductModel]:
-        with session_scope() as session:
-            all_products = session.query(Product).all()
-            logger.info(f"Found {len(all_products)} products")
+    async def read_products(
+        self, limit: Optional[int] = None, after: Optional[uuid.UUID] = None
+    ) -> list[ProductModel]:
+        """
+        Get products ordered by id.
+
+        Args:
+            limit (Optional[int]): Maximum number of products to return, all products if None.
+            after (Optional[uuid.UUID]): Only return products with a greater id (keyset pagination cursor).
+        """
+        query = (
+            select(Product).where(Product.deleted_at.is_(None)).order_by(Product.id)
+        )
+        if after is not None:
+            query = query.where(Product.id > after)
+        if limit is not None:
+            query = query.limit(limit)
+
+        async with async_session_scope() as session:
+            all_products = (await session.scalars(query)).all()
+            logger.info("Found %d products", len(all_products))
             models = [ProductModel.from_product(product) for product in all_products]
         return models
 
+    async def stream_products(
+        self, batch_size: int = 1000
+    ) -> AsyncGenerator[ProductModel, None]:
+        """
+        Yield all products ordered by id. The products are read from a server-side cursor
+        in batches of 'batch_size', so only one batch is held in memory at a time.
+        """
+        async with async_session_scope() as session:
+            result = await session.stream_scalars(
+                select(Product)
+                .where(Product.deleted_at.is_(None))
+                .order_by(Product.id)
+                .execution_options(yield_per=batch_size)
+            )
+            async for product in result:
+                yield ProductModel.from_product(product)
+
     async def create_product(self, data: CreateProductModel) -> ProductModel:
         if not data.name or not data.description:
             raise InvalidProductData(detail="Product name and description required")
-        with session_scope() as session:
+        async with async_session_scope() as session:
             db_product: Product = Product(name=data.name, description=data.description)
             session.add(db_product)
-            session.commit()
+            await session.commit()
 
-            session.refresh(db_product)
+            await session.refresh(db_product)
 
-            await register_product(db_product, session)
+            await register_product(db_product)
 
-            await fetch_products(db_product, session)
+            await fetch_products(db_product)
 
             product_model = ProductModel.from_product(db_product)
 
         return product_model
 
+    async def create_product_async(self, data: CreateProductModel) -> JobModel:
+        """
+        Create a product and leave its registration and the first fetch of its offers to a background job,
+        see 'jobs'. Returns right after the product and the job are stored.
+        """
+        if not data.name or not data.description:
+            raise InvalidProductData(detail="Product name and description required")
+        async with async_session_scope() as session:
+            db_product = Product(
+                id=uuid.uuid4(), name=data.name, description=data.description
+            )
+            session.add(db_product)
+            await session.flush()
+            job = await create_job(session, db_product.id)
+
+        JobWorker.submit(job.id)
+        return JobModel.from_job(job)
+
+    async def import_products(self, items: AsyncIterator[Any]) -> BulkImportResult:
+        """
+        Create the products of a bulk import, see 'bulk'.
+
+        The products are inserted in transactions of 'BULK_IMPORT_BATCH' products. Every batch is registered at the
+        offers API, at most 'BULK_REGISTER_CONCURRENCY' products at the same time, while the next batch is received
+        and inserted. The offers of the products are fetched by the OfferWorker like those of any other product.
+
+        If the body can not be parsed any further, the products received so far are still created and the
+        problem is reported in 'error' of the result.
+        """
+        result = BulkImportResult()
+        semaphore = asyncio.Semaphore(max(1, env.BULK_REGISTER_CONCURRENCY))
+        registrations: list[asyncio.Task] = []
+        batch: list[tuple[BulkItemResult, Product]] = []
+
+        async def register(item: BulkItemResult, product: Product):
+            async with semaphore:
+                try:
+                    await register_product(product)
+                    item.status = "registered"
+                except Exception as e:
+                    item.error = getattr(e, "detail", None) or str(e)
+
+        async def register_batch(batch: list[tuple[BulkItemResult, Product]]):
+            await asyncio.gather(*(register(item, product) for item, product in batch))
+
+        async def insert_batch():
+            async with async_session_scope() as session:
+                await session.execute(
+                    insert(Product),
+                    [
+                        {"id": product.id, "name": product.name, "description": product.description}
+                        for _, product in batch
+                    ],
+                )
+            registrations.append(asyncio.create_task(register_batch(list(batch))))
+            batch.clear()
+
+            # at most one batch is registered while the next one is received, the rest of the body waits
+            while len(registrations) > 1:
+                await registrations.pop(0)
+
+        try:
+            index = 0
+            try:
+                async for item in items:
+                    product = _bulk_product(item)
+                    if isinstance(product, Product):
+                        item_result = BulkItemResult(index=index, id=product.id, status="created")
+                        batch.append((item_result, product))
+                    else:
+                        item_result = BulkItemResult(index=index, status="invalid", error=product)
+                    result.results.append(item_result)
+                    index += 1
+
+                    if len(batch) >= env.BULK_IMPORT_BATCH:
+                        await insert_batch()
+            except BulkFormatError as e:
+                result.error = f"{str(e)}, only the first {index} items were imported"
+
+            if batch:
+                await insert_batch()
+            await asyncio.gather(*registrations)
+        finally:
+            for task in registrations:
+                task.cancel()
+
+        for item_result in result.results:
+            setattr(result, item_result.status, getattr(result, item_result.status) + 1)
+        logger.info(
+            "Imported %d products, %d not registered, %d invalid",
+            result.registered + result.created,
+            result.created,
+            result.invalid,
+        )
+        return result
+
     async def update_product(
         self, product_id: uuid.UUID, new_product: CreateProductModel
     ) -> ProductModel:
-        with session_scope() as session:
-            session.query(Product).filter(Product.id == product_id).update(
-                {
-                    Product.name: new_product.name,
-                    Product.description: new_product.description,
-                }
+        async with async_session_scope() as session:
+            await session.execute(
+                update(Product)
+                .where(Product.id == product_id)
+                .where(Product.deleted_at.is_(None))
+                .values(
+                    {
+                        Product.name: new_product.name,
+                        Product.description: new_product.description,
+                    }
+                )
             )
-            session.commit()
+            await session.commit()
 
-            db_product = session.query(Product).filter(Product.id == product_id).first()
+            db_product = await session.get(Product, product_id, populate_existing=True)
 
-            if not db_product:
+            if not db_product or db_product.deleted_at is not None:
                 raise EntityNotFound(detail="Product not found")
 
             product_model = ProductModel.from_product(db_product)
         return product_model
 
     async def delete_product(self, product_id: uuid.UUID):
-        with session_scope() as session:
-            # Find fetches for the product
-            fetches = session.query(Fetch).filter(Fetch.product_id == product_id).all()
-
-            # Delete offer-fetch associations for these fetches
-            for fetch in fetches:
-                for offer in fetch.offers:
-                    session.execute(
-                        offer_fetch.delete().where(
-                            (offer_fetch.c.fetch_id == fetch.id)
-                            & (offer_fetch.c.offer_id == offer.id)
-                        )
-                    )
-
-            # Now you can safely delete the fetches
-            session.query(Fetch).filter(Fetch.product_id == product_id).delete()
-
-            session.commit()
-
-            delete_stmt = (
-                session.query(Product).filter(Product.id == product_id).delete()
+        """
+        Delete a product and its history.
+
+        The product is marked as deleted right away. Products with at most 'PRODUCT_PURGE_BATCH' fetches are
+        purged before returning, larger ones are purged in the background by the 'PurgeWorker'.
+        """
+        async with async_session_scope() as session:
+            delete_result = await session.execute(
+                update(Product)
+                .where(Product.id == product_id)
+                .where(Product.deleted_at.is_(None))
+                .values(deleted_at=time.time())
             )
 
-            if not delete_stmt:
-                raise EntityNotFound(detail="Product not found")
-
-            session.commit()
-        return
-
-    async def get_offers(self, product_id: uuid.UUID) -> list[OfferModel]:
-        with session_scope() as session:
-            product = session.query(Product).filter(Product.id == product_id).first()
-            if not product:
+            if not delete_result.rowcount:
                 raise EntityNotFound(detail="Product not found")
 
-            last_fetch_of_product = (
-                session.query(Fetch)
-                .filter(Fetch.product_id == product_id)
-                .order_by(Fetch.time.desc())
-                .first()
+            fetch_count = await count_fetches(
+                session, product_id, env.PRODUCT_PURGE_BATCH + 1
             )
 
-            if not last_fetch_of_product:
-                raise CustomException(message="No offers found")
+        await ResultCache.invalidate(product_id)
 
-            last_fetch = max(product.fetches, key=lambda f: f.time)
+        if fetch_count > env.PRODUCT_PURGE_BATCH:
+            logger.info("Product %s has a large history, purging it in the background", product_id)
+            PurgeWorker.wake()
+        else:
+            await purge_product(product_id, env.PRODUCT_PURGE_BATCH)
 
-            offers: List[Offer] = last_fetch.offers
+    async def get_offers(self, product_id: uuid.UUID) -> list[OfferModel]:
+        return await ResultCache.get_or_load(
+            product_id,
+            ("offers",),
+            lambda: self._get_offers(product_id),
+            list[OfferModel],
+        )
 
-            models = [OfferModel.from_offer(offer, product_id) for offer in offers]
+    async def _get_offers(self, product_id: uuid.UUID) -> list[OfferModel]:
+        async with async_session_scope() as session:
+            offers = (await session.scalars(latest_offers_query(product_id))).all()
 
-            return models
+            if not offers:
+                # find out why, this is not the common case
+                product = await _get_product(session, product_id)
+                if product.latest_fetch_id is None:
+                    raise CustomException(status_code=404, detail="No offers found")
+
+            return [OfferModel.from_offer(offer, product_id) for offer in offers]
 
     async def get_price_history(
-        self, product_id: str, from_time: float, to_time: float
+        self,
+        product_id: str,
+        from_time: float,
+        to_time: float,
+        bucket: Optional[int] = None,
     ) -> list[OfferPriceSummary]:
-        with session_scope() as session:
-            product = session.query(Product).filter(Product.id == product_id).first()
-            if not product:
-                raise EntityNotFound(detail="Product not found")
+        """
+        Get the price summaries of the fetches of a product in a time range, newest first.
+
+        Args:
+            bucket (Optional[int]): If set, the summaries are combined into buckets of this many seconds,
+                see 'OfferPriceSummary.aggregate'. The time of a bucket is the time it starts at.
+        """
+        return await ResultCache.get_or_load(
+            product_id,
+            ("price_history", from_time, to_time, bucket),
+            lambda: self._get_price_history(product_id, from_time, to_time, bucket),
+            list[OfferPriceSummary],
+        )
+
+    async def _get_price_history(
+        self,
+        product_id: str,
+        from_time: float,
+        to_time: float,
+        bucket: Optional[int],
+    ) -> list[OfferPriceSummary]:
+        async with async_session_scope() as session:
+            await _get_product(session, product_id)
+
+            if bucket in ROLLUP_RESOLUTIONS:
+                start, end = full_buckets(from_time, to_time, bucket)
+                if start < end:
+                    return await self._get_rolled_up_price_history(
+                        session, product_id, from_time, to_time, bucket, start, end
+                    )
 
-            fetches = (
-                session.query(Fetch)
-                .filter(Fetch.product_id == product_id)
-                .filter(Fetch.time >= from_time)
-                .filter(Fetch.time <= to_time)
-                .order_by(Fetch.time.desc())
-                .all()
+            calculated_prices = await read_summaries(
+                session,
+                price_history_query(product_id, from_time, to_time).order_by(
+                    Fetch.time.desc()
+                ),
             )
 
-            calculated_prices = [
-                OfferPriceSummary.from_model(fetch.calculate_summary())
-                for fetch in fetches
-            ]
-
+        if bucket is None:
             return calculated_prices
 
+        return combine_buckets(calculated_prices, bucket)
+
+    async def _get_rolled_up_price_history(
+        self,
+        session: AsyncSession,
+        product_id: uuid.UUID,
+        from_time: float,
+        to_time: float,
+        bucket: int,
+        start: int,
+        end: int,
+    ) -> list[OfferPriceSummary]:
+        """
+        Get the bucketed price history with the buckets in [start, end) read from the rollups.
+        The partial buckets at the edges of the time range are combined from their fetches.
+        """
+        newer = await read_summaries(
+            session,
+            price_history_query(product_id, end, to_time).order_by(Fetch.time.desc()),
+        )
+        rolled_up = await read_rollups(session, product_id, bucket, start, end)
+        older = await read_summaries(
+            session,
+            price_history_query(product_id, from_time, start)
+            .filter(Fetch.time < start)
+            .order_by(Fetch.time.desc()),
+        )
+
+        return (
+            combine_buckets(newer, bucket) + rolled_up + combine_buckets(older, bucket)
+        )
+
+    async def stream_price_history(
+        self,
+        product_id: uuid.UUID,
+        from_time: float,
+        to_time: float,
+        batch_size: int = 1000,
+    ) -> AsyncGenerator[OfferPriceSummary, None]:
+        """
+        Get the price summaries of the fetches of a product in a time range, oldest first, as an async generator.
+
+        The product is checked right away, so a missing product raises before anything is streamed.
+        The summaries are read from a server-side cursor in batches of 'batch_size'.
+        """
+        async with async_session_scope() as session:
+            await _get_product(session, product_id)
+
+        return self._iter_price_history(product_id, from_time, to_time, batch_size)
+
+    async def _iter_price_history(
+        self, product_id: uuid.UUID, from_time: float, to_time: float, batch_size: int
+    ) -> AsyncGenerator[OfferPriceSummary, None]:
+        async with async_session_scope() as session:
+            result = await session.stream(
+                price_history_query(product_id, from_time, to_time)
+                .order_by(Fetch.time.asc())
+                .execution_options(yield_per=batch_size)
+            )
+            async for rows in result.partitions():
+                # the legacy fetches of a batch are summarized with one query
+                legacy = await summarize_legacy_fetches(
+                    session, [row for row in rows if row.offer_count is None]
+                )
+                for row in rows:
+                    if row.offer_count is None:
+                        yield legacy[row.id]
+                    else:
+                        yield OfferPriceSummary.from_model(row, row.time)
+
     async def get_price_change(
         self, product_id: str, from_time: float, to_time: float
     ) -> OfferPriceDiff:
-        with session_scope() as session:
-            product = session.query(Product).filter(Product.id == product_id).first()
-            if not product:
-                raise EntityNotFound(detail="Product not found")
+        return await ResultCache.get_or_load(
+            product_id,
+            ("price_change", from_time, to_time),
+            lambda: self._get_price_change(product_id, from_time, to_time),
+            OfferPriceDiff,
+        )
+
+    async def _get_price_change(
+        self, product_id: str, from_time: float, to_time: float
+    ) -> OfferPriceDiff:
+        async with async_session_scope() as session:
+            await _get_product(session, product_id)
 
             # Get the last fetch before the from_time
             last_fetch_before_from_time = (
-                session.query(Fetch)
-                .filter(Fetch.product_id == product_id)
-                .filter(Fetch.time <= from_time)
-                .order_by(Fetch.time.desc())
-                .first()
-            )
+                await session.scalars(
+                    select(Fetch)
+                    .options(joinedload(Fetch.offer_summary))
+                    .filter(Fetch.product_id == product_id)
+                    .filter(Fetch.time <= from_time)
+                    .order_by(Fetch.time.desc())
+                    .limit(1)
+                )
+            ).first()
 
             # throw error if no fetch before from_time
             if not last_fetch_before_from_time:
@@ -174,19 +465,26 @@ class ProductService:
             # Get the last fetch before the to_time
 
             last_fetch_before_to_time = (
-                session.query(Fetch)
-                .filter(Fetch.product_id == product_id)
-                .filter(Fetch.time <= to_time)
-                .order_by(Fetch.time.desc())
-                .first()
-            )
+                await session.scalars(
+                    select(Fetch)
+                    .options(joinedload(Fetch.offer_summary))
+                    .filter(Fetch.product_id == product_id)
+                    .filter(Fetch.time <= to_time)
+                    .order_by(Fetch.time.desc())
+                    .limit(1)
+                )
+            ).first()
 
             # throw error if the last fetch before to_time is the same as the last fetch before from_time
             if last_fetch_before_from_time.id == last_fetch_before_to_time.id:
                 raise CustomException(message="No fetch before the specified time")
 
             # Get the offer summaries for for both fetches
-            start_summary = last_fetch_before_from_time.calculate_summary()
-            end_summary = last_fetch_before_to_time.calculate_summary()
+            start_summary, end_summary = await session.run_sync(
+                lambda _: (
+                    last_fetch_before_from_time.calculate_summary(),
+                    last_fetch_before_to_time.calculate_summary(),
+                )
+            )
 
             return OfferPriceDiff.calculate(start_summary, end_summary)
@@ -0,0 +1,126 @@
+from dataclasses import asdict, dataclass
+import statistics
+from typing import Optional, Sequence
+
+from .logger import get_logger
+
+try:
+    import numpy as np
+except ImportError:  # numpy is an optional dependency, the pure python path is used without it
+    np = None
+
+
+logger = get_logger(__name__)
+
+# Offer lists of at least this size are summarized with numpy (if installed)
+VECTORIZED_THRESHOLD = 256
+
+
+@dataclass
+class PriceSummary:
+    """
+    Price statistics of the offers of one fetch. The fields match the columns of 'OfferSummary'.
+
+    The weighted variants weigh every offer by its number of items in stock,
+    they are None if no offer has any items in stock.
+    """
+
+    min_price: float = 0
+    max_price: float = 0
+    avg_price: float = 0
+    median_price: float = 0
+    offer_count: int = 0
+    weighted_avg_price: Optional[float] = None
+    weighted_median_price: Optional[float] = None
+    total_stock: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _weighted_median(sorted_prices: Sequence[float], sorted_stocks: Sequence[int]) -> float:
+    """
+    The lowest price at which at least half of all items in stock are offered.
+    """
+    half = sum(sorted_stocks) / 2
+    cumulative = 0
+    for price, stock in zip(sorted_prices, sorted_stocks):
+        cumulative += stock
+        if cumulative >= half:
+            return price
+    return sorted_prices[-1]
+
+
+def _summarize_python(prices: Sequence[int], stocks: Sequence[int]) -> PriceSummary:
+    total_stock = sum(stocks)
+    summary = PriceSummary(
+        min_price=min(prices),
+        max_price=max(prices),
+        avg_price=sum(prices) / len(prices),
+        median_price=statistics.median(prices),
+        offer_count=len(prices),
+        total_stock=total_stock,
+    )
+
+    if total_stock > 0:
+        pairs = sorted(zip(prices, stocks))
+        summary.weighted_avg_price = (
+            sum(price * stock for price, stock in pairs) / total_stock
+        )
+        summary.weighted_median_price = _weighted_median(
+            [price for price, _ in pairs], [stock for _, stock in pairs]
+        )
+
+    return summary
+
+
+def _summarize_numpy(prices: Sequence[int], stocks: Sequence[int]) -> PriceSummary:
+    price_array = np.asarray(prices, dtype=np.float64)
+    stock_array = np.asarray(stocks, dtype=np.int64)
+    total_stock = int(stock_array.sum())
+
+    summary = PriceSummary(
+        min_price=float(price_array.min()),
+        max_price=float(price_array.max()),
+        avg_price=float(price_array.mean()),
+        median_price=float(np.median(price_array)),
+        offer_count=len(price_array),
+        total_stock=total_stock,
+    )
+
+    if total_stock > 0:
+        order = np.argsort(price_array, kind="stable")
+        sorted_prices = price_array[order]
+        cumulative = np.cumsum(stock_array[order])
+        summary.weighted_avg_price = float(
+            np.dot(price_array, stock_array) / total_stock
+        )
+        summary.weighted_median_price = float(
+            sorted_prices[np.searchsorted(cumulative, total_stock / 2)]
+        )
+
+    return summary
+
+
+def summarize_offers(prices: Sequence[int], stocks: Sequence[int]) -> PriceSummary:
+    """
+    Compute the price statistics of a list of offers.
+
+    Large lists are summarized with numpy when it is installed, both paths give the same results.
+
+    Args:
+        prices (Sequence[int]): Prices of the offers.
+        stocks (Sequence[int]): Items in stock of the offers, in the same order as the prices.
+
+    Returns:
+        PriceSummary: The statistics, all zero for an empty list.
+    """
+    if len(prices) == 0:
+        return PriceSummary()
+
+    # negative stock counts are treated as out of stock
+    stocks = [max(stock or 0, 0) for stock in stocks]
+
+    if np is not None and len(prices) >= VECTORIZED_THRESHOLD:
+        return _summarize_numpy(prices, stocks)
+    return _summarize_python(prices, stocks)
@@ -10,7 +10,7 @@ def time_func(func, *args):
     result = func(*args)
     end_time = time.time()
     logger.info(
-        f"Function {func.__name__} took {end_time - start_time} seconds to execute."
+        "Function %s took %s seconds to execute.", func.__name__, end_time - start_time
     )
     return result
 
@@ -20,6 +20,27 @@ async def time_coro(coro, *args):
     result = await coro(*args)
     end_time = time.time()
     logger.info(
-        f"Function {coro.__name__} took {end_time - start_time} seconds to execute."
+        "Function %s took %s seconds to execute.", coro.__name__, end_time - start_time
     )
     return result
+
+
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_bucket(bucket: str) -> int:
+    """
+    Parse a bucket size like '30s', '5m', '1h' or '1d' into a number of seconds.
+
+    Raises:
+        ValueError: If the bucket size is not valid.
+    """
+    bucket = bucket.strip().lower()
+    unit = bucket[-1:]
+    if unit not in BUCKET_UNITS or not bucket[:-1].isdigit():
+        raise ValueError(f"Invalid bucket size: {bucket}")
+
+    seconds = int(bucket[:-1]) * BUCKET_UNITS[unit]
+    if seconds <= 0:
+        raise ValueError(f"Invalid bucket size: {bucket}")
+    return seconds
@@ -1,6 +1,7 @@
 import time
 
 import pytest
+import pytest_asyncio
 
 MOCKED_TIME = 1599999999.9
 PAST = MOCKED_TIME - 1
@@ -19,3 +20,38 @@ def mock_time(monkeypatch):
             return MOCKED_TIME
 
     monkeypatch.setattr(time, "time", mytime.time)
+
+
+# Creates the schema in the in-memory test database and removes it after the test.
+# The async engine keeps a single connection to the in-memory SQLite database,
+# so every session created through src.db sees the same tables.
+@pytest_asyncio.fixture
+async def database():
+    from src import db
+    from src.orm_models import Base
+
+    async with db.get_async_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield db
+    async with db.get_async_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+
+
+# Results cached by one test must not leak into the next one
+@pytest.fixture(autouse=True)
+def result_cache():
+    from src.cache import ResultCache
+
+    ResultCache.reset()
+    yield ResultCache
+    ResultCache.reset()
+
+
+# The rate limiter, retry budget and circuit breaker of the offers API are shared by all requests of the process
+@pytest.fixture(autouse=True)
+def upstream_guard():
+    from src.resilience import UpstreamGuard
+
+    UpstreamGuard.reset()
+    yield UpstreamGuard
+    UpstreamGuard.reset()
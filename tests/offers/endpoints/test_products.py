@@ -5,7 +5,12 @@ from fastapi.testclient import TestClient
 import pytest
 from src.auth import auth_wrapper
 from src.main import app
-from src.pydantic_models import CreateProductModel, OfferPriceDiff, ProductModel
+from src.pydantic_models import (
+    CreateProductModel,
+    OfferPriceDiff,
+    OfferPriceSummary,
+    ProductModel,
+)
 from src.services import ProductService
 
 client = TestClient(app)
@@ -20,10 +25,14 @@ id = uuid.uuid4()
 
 
 class MockProductService:
-    async def read_products(self):
+    async def read_products(self, limit=None, after=None):
         # Predefined data to return when mocked method is called
         return [ProductModel(id=uuid.uuid4(), name="test", description="test")]
 
+    async def stream_products(self):
+        for i in range(3):
+            yield ProductModel(id=uuid.uuid4(), name=f"test {i}", description="test")
+
     async def create_product(self, data: CreateProductModel):
         # Predefined data to return when mocked method is called
         return ProductModel(
@@ -33,6 +42,17 @@ class MockProductService:
     async def get_price_change(self, product_id: str, from_time: float, to_time: float):
         return test_price_diff
 
+    async def stream_price_history(
+        self, product_id: str, from_time: float, to_time: float
+    ):
+        async def summaries():
+            for time in (from_time, to_time):
+                yield OfferPriceSummary(
+                    time=time, min=1.0, max=3.0, avg=2.0, median=2.0, count=2
+                )
+
+        return summaries()
+
 
 async def auth_wrapper_override(token: str = "token"):
     return "johndoe"
@@ -123,3 +143,106 @@ def test_get_price_diff_422():
         )
 
     assert response.status_code == 422
+
+
+def test_get_price_history_invalid_bucket():
+    response = client.get(
+        f"/products/{id}/price-history",
+        params={"from_time": 1, "to_time": 2, "bucket": "1w"},
+    )
+
+    assert response.status_code == 400
+
+
+def test_read_products_next_cursor():
+    with patch.object(
+        ProductService, "read_products", MockProductService.read_products
+    ):
+        response = client.get("/products/", params={"limit": 1})
+
+    assert response.status_code == 200
+    assert response.headers["X-Next-Cursor"] == response.json()[0]["id"]
+
+
+def test_read_products_last_page_has_no_cursor():
+    with patch.object(
+        ProductService, "read_products", MockProductService.read_products
+    ):
+        response = client.get("/products/", params={"limit": 2})
+
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_read_products_stream():
+    with patch.object(
+        ProductService, "stream_products", MockProductService.stream_products
+    ):
+        response = client.get("/products/", params={"stream": True})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["test 0", "test 1", "test 2"]
+
+
+def test_export_price_history_ndjson():
+    with patch.object(
+        ProductService, "stream_price_history", MockProductService.stream_price_history
+    ):
+        response = client.get(
+            f"/products/{id}/price-history/export",
+            params={"from_time": 100, "to_time": 200},
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["time"] for line in lines] == [100, 200]
+    assert lines[0]["avg"] == 2.0
+
+
+def test_export_price_history_csv():
+    with patch.object(
+        ProductService, "stream_price_history", MockProductService.stream_price_history
+    ):
+        response = client.get(
+            f"/products/{id}/price-history/export",
+            params={"from_time": 100, "to_time": 200, "format": "csv"},
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    header, first, second = response.text.splitlines()
+    assert header == "time,min,max,avg,median,count,weighted_avg,weighted_median"
+    assert first == "100.0,1.0,3.0,2.0,2.0,2,,"
+    assert second.startswith("200.0,")
+
+
+def test_export_empty_price_history_csv():
+    async def stream_nothing(self, product_id: str, from_time: float, to_time: float):
+        async def summaries():
+            return
+            yield
+
+        return summaries()
+
+    with patch.object(ProductService, "stream_price_history", stream_nothing):
+        response = client.get(
+            f"/products/{id}/price-history/export",
+            params={"from_time": 100, "to_time": 200, "format": "csv"},
+        )
+
+    assert response.status_code == 200
+    assert response.text.splitlines() == [
+        "time,min,max,avg,median,count,weighted_avg,weighted_median"
+    ]
+
+
+def test_export_price_history_invalid_format():
+    response = client.get(
+        f"/products/{id}/price-history/export",
+        params={"from_time": 100, "to_time": 200, "format": "xml"},
+    )
+
+    assert response.status_code == 422
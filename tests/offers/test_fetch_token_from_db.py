@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import AsyncMock, MagicMock
 from psycopg2 import DatabaseError
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -11,12 +11,11 @@ from tests.conftest import FUTURE
 
 
 @pytest.mark.asyncio
-@patch("src.offers.Session")
-async def test_success(mocked_session):
-    session_instance = mocked_session.return_value
-    session_instance.query.return_value.first.return_value = JwtToken(
-        token="test_token", expiration=FUTURE
-    )
+async def test_success():
+    session_instance = MagicMock()
+    result = MagicMock()
+    result.first.return_value = JwtToken(token="test_token", expiration=FUTURE)
+    session_instance.scalars = AsyncMock(return_value=result)
 
     result = await _fetch_token_from_db(session=session_instance)
 
@@ -26,10 +25,9 @@ async def test_success(mocked_session):
 
 
 @pytest.mark.asyncio
-@patch("src.offers.Session")
-async def test_failure(mocked_session):
-    session_instance = mocked_session.return_value
-    session_instance.query.return_value.first.side_effect = SQLAlchemyError("error")
+async def test_failure():
+    session_instance = MagicMock()
+    session_instance.scalars = AsyncMock(side_effect=SQLAlchemyError("error"))
 
     with pytest.raises(DatabaseError, match="Database query failed"):
         await _fetch_token_from_db(session=session_instance)
@@ -0,0 +1,167 @@
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, func, select
+
+from src.db import async_session_scope
+from src.offers import _store_offers_in_db
+from src.orm_models import Fetch, Offer, Product, offer_fetch
+from src.pydantic_models import OfferModel
+from src.services.product import ProductService
+
+
+@pytest_asyncio.fixture
+async def product(database):
+    product_id = uuid4()
+    async with async_session_scope() as session:
+        session.add(Product(id=product_id, name="test", description="test"))
+    # a copy that is not bound to the closed session, like the worker passes around
+    return Product(id=product_id, name="test", description="test")
+
+
+def make_models(product: Product, count: int) -> list[OfferModel]:
+    return [
+        OfferModel(id=uuid4(), price=100 + i, items_in_stock=i, product_id=product.id)
+        for i in range(count)
+    ]
+
+
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    return statements, lambda: event.remove(
+        engine, "before_cursor_execute", before_cursor_execute
+    )
+
+
+@pytest.mark.asyncio
+async def test_offers_are_inserted_and_linked(database, product):
+    models = make_models(product, 5)
+
+    await _store_offers_in_db(models, product)
+
+    async with async_session_scope() as session:
+        fetch = (await session.scalars(select(Fetch))).one()
+        assert fetch.product_id == product.id
+        offers = await session.run_sync(lambda _: fetch.offers)
+        assert {offer.id for offer in offers} == {model.id for model in models}
+        assert all(offer.product_id == product.id for offer in offers)
+
+
+@pytest.mark.asyncio
+async def test_existing_offers_are_updated(database, product):
+    models = make_models(product, 3)
+    await _store_offers_in_db(models, product)
+
+    models[0].price = 999
+    models[0].items_in_stock = 42
+    await _store_offers_in_db(models, product)
+
+    async with async_session_scope() as session:
+        assert await session.scalar(select(func.count()).select_from(Offer)) == 3
+        assert await session.scalar(select(func.count()).select_from(Fetch)) == 2
+        assert await session.scalar(select(func.count()).select_from(offer_fetch)) == 6
+
+        offer = await session.get(Offer, models[0].id)
+        assert offer.price == 999
+        assert offer.items_in_stock == 42
+
+
+@pytest.mark.asyncio
+async def test_round_trips_do_not_depend_on_offer_count(database, product):
+    # the first fetch of a day also closes the days before it
+    await _store_offers_in_db(make_models(product, 1), product)
+    statements, stop = count_statements(database.async_engine.sync_engine)
+    try:
+        await _store_offers_in_db(make_models(product, 2), product)
+        few = len(statements)
+        statements.clear()
+
+        await _store_offers_in_db(make_models(product, 50), product)
+        many = len(statements)
+    finally:
+        stop()
+
+    assert few == many
+
+
+@pytest.mark.asyncio
+async def test_empty_offer_list(database, product):
+    assert await _store_offers_in_db([], product) == []
+
+    async with async_session_scope() as session:
+        assert await session.scalar(select(func.count()).select_from(Fetch)) == 1
+
+
+@pytest.mark.asyncio
+async def test_unchanged_offers_only_record_a_marker(database, product):
+    models = make_models(product, 4)
+
+    await _store_offers_in_db(models, product)
+    # same offers in a different order
+    await _store_offers_in_db(list(reversed(models)), product)
+    await _store_offers_in_db(models, product)
+
+    async with async_session_scope() as session:
+        fetches = (await session.scalars(select(Fetch))).all()
+        [snapshot] = [fetch for fetch in fetches if fetch.snapshot_id is None]
+        markers = [fetch for fetch in fetches if fetch.snapshot_id is not None]
+
+        assert len(markers) == 2
+        assert all(marker.snapshot_id == snapshot.id for marker in markers)
+        assert await session.scalar(select(func.count()).select_from(offer_fetch)) == 4
+
+        offers = await session.run_sync(lambda _: markers[0].snapshot_offers)
+        assert {offer.id for offer in offers} == {model.id for model in models}
+
+        marker_summary, snapshot_summary = await session.run_sync(
+            lambda _: (markers[0].calculate_summary(), snapshot.calculate_summary())
+        )
+        assert marker_summary.median_price == snapshot_summary.median_price
+
+
+async def latest_fetch(product: Product) -> Fetch:
+    async with async_session_scope() as session:
+        db_product = await session.get(Product, product.id)
+        return await session.get(Fetch, db_product.latest_fetch_id)
+
+
+@pytest.mark.asyncio
+async def test_latest_fetch_is_maintained(database, product, monkeypatch):
+    models = make_models(product, 2)
+    await _store_offers_in_db(models, product)
+    first = await latest_fetch(product)
+
+    monkeypatch.setattr("time.time", lambda: first.time + 60)
+    await _store_offers_in_db(models, product)
+    second = await latest_fetch(product)
+    assert second.time == first.time + 60
+    assert second.snapshot_id == first.id
+
+    # a fetch stored late with an earlier time does not move the pointer back
+    monkeypatch.setattr("time.time", lambda: first.time + 30)
+    await _store_offers_in_db(make_models(product, 1), product)
+    assert (await latest_fetch(product)).id == second.id
+
+
+@pytest.mark.asyncio
+async def test_get_offers_does_not_depend_on_history(database, product, monkeypatch):
+    statements, stop = count_statements(database.async_engine.sync_engine)
+    try:
+        for i in range(20):
+            monkeypatch.setattr("time.time", lambda: 1000.0 + i)
+            models = make_models(product, 3)
+            await _store_offers_in_db(models, product)
+
+        statements.clear()
+        offers = await ProductService()._get_offers(product.id)
+    finally:
+        stop()
+
+    assert len(statements) == 1
+    assert {offer.id for offer in offers} == {model.id for model in models}
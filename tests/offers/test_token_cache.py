@@ -0,0 +1,87 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from src.offers import TokenCache, _get_valid_token
+from src.orm_models import JwtToken
+from tests.conftest import MOCKED_TIME
+
+VALID_FOR_LONG = MOCKED_TIME + 3600
+ABOUT_TO_EXPIRE = MOCKED_TIME + 1
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    TokenCache.clear()
+    yield
+    TokenCache.clear()
+
+
+def mock_api(expiration: float):
+    async def fetch_new_token():
+        # give the other callers a chance to pile up
+        await asyncio.sleep(0.01)
+        return "new_token"
+
+    return (
+        patch("src.offers._fetch_new_token_from_api", side_effect=fetch_new_token),
+        patch("src.offers._decode_token", return_value={"expires": expiration}),
+        patch("src.offers._store_new_token_in_db", new_callable=AsyncMock),
+    )
+
+
+@pytest.mark.asyncio
+async def test_db_is_only_read_on_cold_start():
+    db_token = JwtToken(token="db_token", expiration=VALID_FOR_LONG)
+
+    with patch(
+        "src.offers._fetch_token_from_db", new_callable=AsyncMock
+    ) as fetch_from_db:
+        fetch_from_db.return_value = db_token
+
+        for _ in range(5):
+            token = await _get_valid_token()
+            assert token.token == "db_token"
+
+    fetch_from_db.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_refresh():
+    api, decode, store = mock_api(VALID_FOR_LONG)
+
+    with patch(
+        "src.offers._fetch_token_from_db", new_callable=AsyncMock, return_value=None
+    ), api as fetch_new_token, decode, store as store_token:
+        tokens = await asyncio.gather(*(_get_valid_token() for _ in range(10)))
+
+    assert all(token.token == "new_token" for token in tokens)
+    fetch_new_token.assert_called_once()
+    store_token.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_token_close_to_expiry_is_refreshed_in_background():
+    db_token = JwtToken(token="old_token", expiration=ABOUT_TO_EXPIRE)
+    api, decode, store = mock_api(VALID_FOR_LONG)
+
+    with patch(
+        "src.offers._fetch_token_from_db", new_callable=AsyncMock, return_value=db_token
+    ), api as fetch_new_token, decode, store:
+        # cold start: the db token is about to expire, so a new one is fetched
+        token = await _get_valid_token()
+        assert token.token == "new_token"
+
+        TokenCache._token = JwtToken(token="old_token", expiration=ABOUT_TO_EXPIRE)
+
+        # the old token is still valid, the caller does not wait for the refresh
+        token = await _get_valid_token()
+        assert token.token == "old_token"
+
+        await TokenCache._refresh_task
+
+        token = await _get_valid_token()
+        assert token.token == "new_token"
+
+    assert fetch_new_token.call_count == 2
@@ -1,8 +1,9 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 from uuid import uuid4
 import pytest
 
 
+from src.db import async_session_scope
 from src.exceptions.external import ApiRequestError
 from src.services.product import ProductService
 from src.orm_models import Product
@@ -18,50 +19,57 @@ logger = get_logger(__name__)
 
 
 @pytest.mark.asyncio
-@patch("src.db.SessionMkr")
-async def test_valid(mock_session, service):
+async def test_valid(database, service):
     prod = [
         {
-            "id": str(uuid4()),
+            "id": uuid4(),
             "name": f"Test Product {i}",
             "description": f"This is a test product {i}.",
         }
         for i in range(10)
     ]
 
-    mock_products = []
-    for model in prod:
-        mock_product = MagicMock()
-        mock_product.id = model["id"]
-        mock_product.name = model["name"]
-        mock_product.description = model["description"]
-        mock_products.append(mock_product)
+    async with async_session_scope() as session:
+        session.add_all([Product(**model) for model in prod])
 
-    mock_query = MagicMock()
-    mock_query.all.return_value = mock_products
+    data = await service.read_products()
 
-    # Make session.query(Product) return our mock query object
-    mock_session.return_value.query.return_value = mock_query
+    assert sorted(model.id for model in data) == sorted(model["id"] for model in prod)
+    assert {model.name for model in data} == {model["name"] for model in prod}
 
-    data = await service.read_products()
 
-    # Check the function is called
-    mock_session.return_value.query.assert_called_once_with(Product)
-    mock_query.all.assert_called_once()
+@pytest.mark.asyncio
+async def test_error(service):
+    with patch(
+        "src.services.product.async_session_scope",
+        side_effect=ApiRequestError("mock exc"),
+    ):
+        with pytest.raises(ApiRequestError):
+            data = await service.read_products()
 
 
 @pytest.mark.asyncio
-@patch("src.db.SessionMkr")
-async def test_error(mock_session, service):
-    mock_query = MagicMock()
-    mock_query.all.side_effect = ApiRequestError("mock exc")
+async def test_keyset_pagination(database, service):
+    ids = [uuid4() for _ in range(5)]
+    async with async_session_scope() as session:
+        session.add_all([Product(id=id, name="test", description="test") for id in ids])
+
+    first_page = await service.read_products(limit=2)
+    second_page = await service.read_products(limit=2, after=first_page[-1].id)
+    last_page = await service.read_products(limit=2, after=second_page[-1].id)
 
-    # Make session.query(Product) return our mock query object
-    mock_session.return_value.query.return_value = mock_query
+    paged = [model.id for model in first_page + second_page + last_page]
+    assert len(last_page) == 1
+    assert paged == [model.id for model in await service.read_products()]
+    assert sorted(paged) == sorted(ids)
+
+
+@pytest.mark.asyncio
+async def test_stream_products(database, service):
+    ids = [uuid4() for _ in range(5)]
+    async with async_session_scope() as session:
+        session.add_all([Product(id=id, name="test", description="test") for id in ids])
 
-    with pytest.raises(ApiRequestError):
-        data = await service.read_products()
+    streamed = [model.id async for model in service.stream_products(batch_size=2)]
 
-    # Check the function is called
-    mock_session.return_value.query.assert_called_once_with(Product)
-    mock_query.all.assert_called_once()
+    assert streamed == [model.id for model in await service.read_products()]
@@ -0,0 +1,147 @@
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, update
+
+from src.db import async_session_scope
+from src.exceptions.internal import EntityNotFound
+from src.offers import _store_offers_in_db
+from src.orm_models import Fetch, Product
+from src.pydantic_models import OfferModel
+from src.services.product import ProductService
+from tests.conftest import MOCKED_TIME
+
+
+@pytest_asyncio.fixture
+async def product(database):
+    product_id = uuid4()
+    async with async_session_scope() as session:
+        session.add(Product(id=product_id, name="test", description="test"))
+    return Product(id=product_id, name="test", description="test")
+
+
+@pytest.mark.asyncio
+async def test_price_history_does_not_load_offers(database, product):
+    models = [
+        OfferModel(id=uuid4(), price=price, items_in_stock=stock, product_id=product.id)
+        for price, stock in [(300, 1), (100, 2), (200, 1), (400, 0)]
+    ]
+    await _store_offers_in_db(models, product)
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = database.async_engine.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        [summary] = await ProductService().get_price_history(
+            product.id, MOCKED_TIME - 1, MOCKED_TIME + 1
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    assert not any("offer_fetch" in statement for statement in statements)
+    assert summary.time == MOCKED_TIME
+    assert summary.min == 100
+    assert summary.max == 400
+    assert summary.avg == 250
+    assert summary.median == 250
+    assert summary.count == 4
+    assert summary.weighted_avg == 175
+    assert summary.weighted_median == 100
+
+
+@pytest.mark.asyncio
+async def test_price_history_buckets(database, product, monkeypatch):
+    # three fetches in the first hour, one in the second
+    for fetch_time, prices in [
+        (3600 * 10, [100, 200]),
+        (3600 * 10 + 60, [300, 400]),
+        (3600 * 10 + 120, [100, 200]),
+        (3600 * 11, [500, 700]),
+    ]:
+        monkeypatch.setattr("time.time", lambda: fetch_time)
+        models = [
+            OfferModel(id=uuid4(), price=price, items_in_stock=1, product_id=product.id)
+            for price in prices
+        ]
+        await _store_offers_in_db(models, product)
+
+    second_hour, first_hour = await ProductService().get_price_history(
+        product.id, 0, 3600 * 12, bucket=3600
+    )
+
+    assert first_hour.time == 3600 * 10
+    assert first_hour.count == 3
+    assert first_hour.min == 100
+    assert first_hour.max == 400
+    assert first_hour.avg == pytest.approx((150 + 350 + 150) / 3)
+    assert first_hour.median == 150
+
+    assert second_hour.time == 3600 * 11
+    assert second_hour.count == 1
+    assert second_hour.avg == 600
+
+
+@pytest.mark.asyncio
+async def test_stream_price_history_oldest_first(database, product, monkeypatch):
+    for fetch_time, prices in [(100, [100, 200]), (200, [300, 400]), (300, [500])]:
+        monkeypatch.setattr("time.time", lambda: fetch_time)
+        models = [
+            OfferModel(id=uuid4(), price=price, items_in_stock=1, product_id=product.id)
+            for price in prices
+        ]
+        await _store_offers_in_db(models, product)
+
+    summaries = await ProductService().stream_price_history(
+        product.id, 150, 300, batch_size=1
+    )
+
+    assert [(summary.time, summary.avg) async for summary in summaries] == [
+        (200, 350),
+        (300, 500),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_stream_price_history_missing_product(database):
+    with pytest.raises(EntityNotFound):
+        await ProductService().stream_price_history(uuid4(), 0, 1)
+
+
+@pytest.mark.asyncio
+async def test_stream_price_history_summarizes_legacy_fetches_per_batch(
+    database, product, monkeypatch
+):
+    for fetch_time in range(1, 6):
+        monkeypatch.setattr("time.time", lambda: fetch_time)
+        models = [
+            OfferModel(id=uuid4(), price=price, items_in_stock=1, product_id=product.id)
+            for price in (100 * fetch_time, 100 * fetch_time + 50)
+        ]
+        await _store_offers_in_db(models, product)
+    # fetches stored before summaries were computed at ingest
+    async with async_session_scope() as session:
+        await session.execute(update(Fetch).values(offer_summary_id=None))
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = database.async_engine.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        summaries = await ProductService().stream_price_history(
+            product.id, 0, 10, batch_size=2
+        )
+        history = [(summary.time, summary.avg) async for summary in summaries]
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    assert history == [(time, 100 * time + 25) for time in range(1, 6)]
+    # one query for the offers of every batch of 2 fetches
+    assert len([statement for statement in statements if "offer_fetch" in statement]) == 3
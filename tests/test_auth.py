@@ -0,0 +1,140 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+
+import src.env as env
+from src.auth import (
+    PasswordVerifier,
+    VerifiedTokenCache,
+    create_token,
+    fake_users_db,
+    parse_token,
+)
+from src.exceptions.internal import (
+    JWTInvalidTokenError,
+    JWTSignatureExpiredError,
+    LoginUnavailableError,
+)
+
+
+@pytest.fixture(autouse=True)
+def token_cache():
+    VerifiedTokenCache.clear()
+    yield VerifiedTokenCache
+    VerifiedTokenCache.clear()
+
+
+def token(username: str, expires_in: timedelta) -> str:
+    return jwt.encode(
+        {"sub": username, "exp": datetime.now(tz=timezone.utc) + expires_in},
+        env.JWT_SECRET,
+        algorithm=env.ALGORITHM,
+    )
+
+
+def test_verified_token_is_cached(token_cache, monkeypatch):
+    bearer = create_token("johndoe")
+
+    assert parse_token(bearer).username == "johndoe"
+
+    def decode(*args, **kwargs):
+        raise AssertionError("the token was verified again")
+
+    monkeypatch.setattr(jwt, "decode", decode)
+    assert parse_token(bearer).username == "johndoe"
+    assert (token_cache.hits, token_cache.misses) == (1, 1)
+
+
+def test_cached_token_expires_at_its_exp(token_cache, monkeypatch):
+    bearer = token("johndoe", timedelta(seconds=60))
+    parse_token(bearer)
+
+    later = datetime.now(tz=timezone.utc) + timedelta(seconds=61)
+    monkeypatch.setattr("src.auth._now", lambda: later.timestamp())
+
+    # the entry expired, so the token is verified again
+    parse_token(bearer)
+    assert (token_cache.hits, token_cache.misses) == (0, 2)
+
+
+def test_expired_token_is_rejected(token_cache):
+    with pytest.raises(JWTSignatureExpiredError):
+        parse_token(token("johndoe", timedelta(seconds=-1)))
+    assert (token_cache.hits, token_cache.misses) == (0, 1)
+
+
+def test_invalid_tokens_are_not_cached(token_cache):
+    for _ in range(2):
+        with pytest.raises(JWTInvalidTokenError):
+            parse_token("not a token")
+
+    assert (token_cache.hits, token_cache.misses) == (0, 2)
+
+
+def test_cache_is_bounded(token_cache, monkeypatch):
+    monkeypatch.setattr(env, "AUTH_TOKEN_CACHE_SIZE", 2)
+    tokens = [token(name, timedelta(minutes=5)) for name in ("a", "b", "c")]
+    for bearer in tokens:
+        parse_token(bearer)
+
+    # the least recently used token was evicted
+    parse_token(tokens[0])
+    parse_token(tokens[2])
+    assert (token_cache.hits, token_cache.misses) == (1, 4)
+
+
+def test_credentials_are_loaded_from_file(tmp_path, monkeypatch):
+    import src.auth as auth
+
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({"carol": auth.fake_users_db["alice"]}))
+    monkeypatch.setattr(env, "CREDENTIALS_FILE", str(path))
+    monkeypatch.setattr(auth, "_credentials", None)
+
+    credentials = auth.get_credentials()
+
+    assert list(credentials) == ["carol"]
+    assert auth.validate_password("Alice123", credentials["carol"])
+    # the file is only read once
+    path.unlink()
+    assert auth.get_credentials() is credentials
+
+
+@pytest.fixture
+def verifier(monkeypatch):
+    monkeypatch.setattr(env, "AUTH_VERIFY_WORKERS", 1)
+    monkeypatch.setattr(env, "AUTH_VERIFY_QUEUE", 0)
+    PasswordVerifier.rejected = 0
+    yield PasswordVerifier
+    PasswordVerifier.stop()
+
+
+@pytest.mark.asyncio
+async def test_passwords_are_verified_in_the_pool(verifier):
+    hashed = fake_users_db["alice"]
+
+    assert await verifier.verify("Alice123", hashed)
+    assert not await verifier.verify("wrong", hashed)
+
+
+@pytest.mark.asyncio
+async def test_saturated_pool_rejects_logins(verifier, monkeypatch):
+    # the thread pool is enough to keep the single slot busy
+    monkeypatch.setattr(env, "AUTH_VERIFY_WORKERS", 0)
+    hashed = fake_users_db["alice"]
+
+    results = await asyncio.gather(
+        verifier.verify("Alice123", hashed),
+        verifier.verify("Alice123", hashed),
+        return_exceptions=True,
+    )
+
+    assert results[0] is True
+    assert isinstance(results[1], LoginUnavailableError)
+    assert results[1].status_code == 503
+    assert verifier.rejected == 1
+    # the slot is free again
+    assert await verifier.verify("Alice123", hashed)
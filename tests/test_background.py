@@ -0,0 +1,106 @@
+import asyncio
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+
+import src.env as env
+from src.background import FetchCycleStats, OfferWorker
+from src.orm_models import Product
+
+
+def make_products(count: int) -> list[Product]:
+    return [Product(id=uuid4(), name="test", description="test") for _ in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_fetch_cycle_runs_concurrently(monkeypatch):
+    monkeypatch.setattr(env, "FETCH_CONCURRENCY", 3)
+    running = 0
+    max_running = 0
+
+    async def fake_fetch(product):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    with patch("src.background.fetch_products", fake_fetch):
+        stats = await OfferWorker.fetch_cycle(make_products(10))
+
+    assert max_running == 3
+    assert stats.done == 10
+    assert stats.failed == 0
+    assert stats.skipped == 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_cycle_failure_does_not_stop_others(monkeypatch):
+    monkeypatch.setattr(env, "FETCH_CONCURRENCY", 2)
+    products = make_products(5)
+
+    async def fake_fetch(product):
+        if product is products[0]:
+            raise Exception("upstream failed")
+
+    with patch("src.background.fetch_products", fake_fetch):
+        stats = await OfferWorker.fetch_cycle(products)
+
+    assert stats.done == 4
+    assert stats.failed == 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_cycle_slow_product_times_out(monkeypatch):
+    monkeypatch.setattr(env, "FETCH_CONCURRENCY", 2)
+    monkeypatch.setattr(env, "FETCH_PRODUCT_TIMEOUT", 0.05)
+    products = make_products(4)
+
+    async def fake_fetch(product):
+        if product is products[0]:
+            await asyncio.sleep(10)
+
+    with patch("src.background.fetch_products", fake_fetch):
+        stats = await OfferWorker.fetch_cycle(products)
+
+    assert stats.done == 3
+    assert stats.failed == 1
+    assert stats.wall_time < 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_cycle_skips_products_after_deadline(monkeypatch):
+    monkeypatch.setattr(env, "FETCH_CONCURRENCY", 1)
+    monkeypatch.setattr(env, "FETCH_CYCLE_TIMEOUT", 0.05)
+
+    async def fake_fetch(product):
+        await asyncio.sleep(10)
+
+    with patch("src.background.fetch_products", fake_fetch):
+        stats = await OfferWorker.fetch_cycle(make_products(5))
+
+    # the first product hits the cycle deadline, the rest never start
+    assert stats.done == 0
+    assert stats.failed == 1
+    assert stats.skipped == 4
+
+
+@pytest.mark.asyncio
+async def test_failed_cycle_does_not_stop_periodic_fetching(monkeypatch):
+    monkeypatch.setattr(env, "FETCH_COORDINATION", "lease")
+    monkeypatch.setattr(env, "PERIODIC_FETCH_INTERVAL", 0)
+    cycles = []
+
+    async def flaky_cycle():
+        cycles.append(1)
+        if len(cycles) == 1:
+            raise ConnectionResetError("connection reset by peer")
+        OfferWorker._is_running = False
+        return FetchCycleStats()
+
+    monkeypatch.setattr(OfferWorker, "_is_running", True)
+    with patch.object(OfferWorker, "leased_fetch_cycle", flaky_cycle):
+        await OfferWorker.periodic_fetch_offers()
+
+    assert len(cycles) == 2
@@ -0,0 +1,150 @@
+import json
+from unittest.mock import patch
+import uuid
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import func, select
+
+import src.env as env
+from src.auth import auth_wrapper
+from src.bulk import BulkFormatError, iter_items, iter_json_array, iter_ndjson
+from src.db import async_session_scope
+from src.exceptions.external import ProductRegistrationError
+from src.main import app
+from src.orm_models import Product
+from src.pydantic_models import BulkImportResult, BulkItemResult
+from src.services import ProductService
+
+
+PRODUCTS = [{"name": f"product {i}", "description": "ěščř"} for i in range(10)]
+
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+async def parse(parser, data: bytes, size: int) -> list:
+    return [item async for item in parser(chunked(data, size))]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [1, 7, 1000])
+async def test_json_array_split_anywhere(size):
+    data = json.dumps(PRODUCTS + [123, [1]], indent=2).encode()
+
+    assert await parse(iter_json_array, data, size) == PRODUCTS + [123, [1]]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "data", [b'{"name": "a"}', b'[{"name": "a"}', b'[{"name": "a"}] x', b"[{nope}]"]
+)
+async def test_invalid_json_array(data):
+    with pytest.raises(BulkFormatError):
+        await parse(iter_json_array, data, 3)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [1, 7, 1000])
+async def test_ndjson_invalid_line_fails_only_its_item(size):
+    lines = [json.dumps(product) for product in PRODUCTS[:2]]
+    data = "\n".join([lines[0], "{nope", "", lines[1]]).encode()
+
+    items = await parse(iter_ndjson, data, size)
+
+    assert items[0] == PRODUCTS[0]
+    assert isinstance(items[1], ValueError)
+    assert items[2] == PRODUCTS[1]
+
+
+@pytest.mark.asyncio
+async def test_content_type_selects_parser():
+    data = b'{"name": "a"}\n{"name": "b"}\n'
+
+    items = iter_items(chunked(data, 5), "application/x-ndjson; charset=utf-8")
+
+    assert [item async for item in items] == [{"name": "a"}, {"name": "b"}]
+
+
+@pytest.mark.asyncio
+async def test_import_products(database, monkeypatch):
+    monkeypatch.setattr(env, "BULK_IMPORT_BATCH", 3)
+    monkeypatch.setattr(env, "BULK_REGISTER_CONCURRENCY", 2)
+    registered = []
+
+    async def register_product(product):
+        if product.name == "product 4":
+            raise ProductRegistrationError("upstream failed")
+        registered.append(product.name)
+
+    items = PRODUCTS[:5] + [{"name": "no description"}, ValueError("Invalid JSON")]
+    items += PRODUCTS[5:]
+
+    async def body():
+        for item in items:
+            yield item
+
+    with patch("src.services.product.register_product", register_product):
+        result = await ProductService().import_products(body())
+
+    assert (result.registered, result.created, result.invalid) == (9, 1, 2)
+    assert [item.index for item in result.results] == list(range(12))
+    assert result.results[4].status == "created"
+    assert result.results[4].error == "upstream failed"
+    assert result.results[5].status == "invalid"
+    assert result.results[5].error == "description: Field required"
+    assert result.results[6].error == "Invalid JSON"
+    assert len(registered) == 9
+
+    async with async_session_scope() as session:
+        names = set(await session.scalars(select(Product.name)))
+        assert names == {product["name"] for product in PRODUCTS}
+        assert await session.get(Product, result.results[0].id) is not None
+
+
+@pytest.mark.asyncio
+async def test_import_stops_at_malformed_body(database):
+    async def register_product(product):
+        pass
+
+    with patch("src.services.product.register_product", register_product):
+        result = await ProductService().import_products(
+            iter_json_array(chunked(json.dumps(PRODUCTS[:2]).encode()[:-1] + b"x", 4))
+        )
+
+    assert result.registered == 2
+    assert result.error == "Invalid JSON array, only the first 2 items were imported"
+    async with async_session_scope() as session:
+        assert await session.scalar(select(func.count()).select_from(Product)) == 2
+
+
+def test_bulk_endpoint():
+    app.dependency_overrides[auth_wrapper] = lambda: "johndoe"
+    client = TestClient(app)
+
+    async def import_products(self, items):
+        return BulkImportResult(
+            results=[
+                BulkItemResult(index=i, id=uuid.uuid4(), status="registered")
+                async for i, _ in _enumerate(items)
+            ]
+        )
+
+    with patch.object(ProductService, "import_products", import_products):
+        response = client.post(
+            "/products/bulk",
+            content="\n".join(json.dumps(product) for product in PRODUCTS),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+    assert response.status_code == 200
+    assert len(response.json()["results"]) == len(PRODUCTS)
+
+
+async def _enumerate(items):
+    index = 0
+    async for item in items:
+        yield index, item
+        index += 1
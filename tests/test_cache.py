@@ -0,0 +1,173 @@
+import asyncio
+import time
+from uuid import uuid4
+
+import pytest
+
+from src.cache import MISSING, MemoryCacheBackend, ResultCache
+from src.offers import _store_offers_in_db
+from src.orm_models import Product
+from src.db import async_session_scope
+from src.pydantic_models import OfferModel
+from src.services.product import ProductService
+from tests.conftest import MOCKED_TIME
+
+
+def counting_loader(value="value", delay=0):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return value
+
+    return loader, calls
+
+
+async def store(backend: MemoryCacheBackend, product_id: str, value: str):
+    await backend.set(product_id, await backend.generation(product_id), "key", str, value)
+
+
+async def load(backend: MemoryCacheBackend, product_id: str):
+    return await backend.get(product_id, await backend.generation(product_id), "key", str)
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2, ttl=60)
+    await store(backend, "a", "a")
+    await store(backend, "b", "b")
+    await load(backend, "a")  # a is now more recent than b
+    await store(backend, "c", "c")
+
+    assert len(backend) == 2
+    assert await load(backend, "a") == "a"
+    assert await load(backend, "c") == "c"
+    assert await load(backend, "b") is MISSING
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_expires_entries(monkeypatch):
+    backend = MemoryCacheBackend(max_entries=10, ttl=60)
+    await store(backend, "a", "a")
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+
+    assert await load(backend, "a") is MISSING
+    assert len(backend) == 0
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_invalidates_only_the_product():
+    backend = MemoryCacheBackend(max_entries=10, ttl=60)
+    await store(backend, "a", "a")
+    await store(backend, "b", "b")
+    generation = await backend.generation("a")
+
+    await backend.invalidate("a")
+
+    assert await backend.generation("a") != generation
+    assert await load(backend, "a") is MISSING
+    assert await load(backend, "b") == "b"
+
+    # a value computed before the invalidation is not stored
+    await backend.set("a", generation, "key", str, "stale")
+    assert len(backend) == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_bounds_generations():
+    backend = MemoryCacheBackend(max_entries=2, ttl=60)
+    for i in range(100):
+        await store(backend, str(i), "value")
+        # products that are only read do not keep a generation either
+        await load(backend, f"read-{i}")
+
+    assert len(backend._generations) <= 2
+    assert len(backend) <= 2
+
+    # a dropped generation is not handed out again, so a value computed with it is not stored
+    generation = await backend.generation("a")
+    await backend.invalidate("a")
+    await backend.set("a", generation, "key", str, "stale")
+    assert await load(backend, "a") is MISSING
+
+
+@pytest.mark.asyncio
+async def test_cache_hit():
+    ResultCache.configure(MemoryCacheBackend(max_entries=10, ttl=60))
+    loader, calls = counting_loader()
+
+    assert await ResultCache.get_or_load("a", "key", loader, str) == "value"
+    assert await ResultCache.get_or_load("a", "key", loader, str) == "value"
+
+    assert len(calls) == 1
+    assert ResultCache.hits == 1
+    assert ResultCache.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_coalesces_concurrent_requests():
+    ResultCache.configure(MemoryCacheBackend(max_entries=10, ttl=60))
+    loader, calls = counting_loader(delay=0.05)
+
+    results = await asyncio.gather(
+        *(ResultCache.get_or_load("a", "key", loader, str) for _ in range(5))
+    )
+
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert ResultCache.coalesced == 4
+
+
+@pytest.mark.asyncio
+async def test_cache_does_not_store_errors():
+    ResultCache.configure(MemoryCacheBackend(max_entries=10, ttl=60))
+
+    async def failing_loader():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await ResultCache.get_or_load("a", "key", failing_loader, str)
+
+    loader, calls = counting_loader()
+    assert await ResultCache.get_or_load("a", "key", loader, str) == "value"
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_disabled():
+    ResultCache.configure(None)
+    loader, calls = counting_loader()
+
+    await ResultCache.get_or_load("a", "key", loader, str)
+    await ResultCache.get_or_load("a", "key", loader, str)
+    await ResultCache.invalidate("a")
+
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_stored_fetch_invalidates_cached_offers(database, monkeypatch):
+    ResultCache.configure(MemoryCacheBackend(max_entries=10, ttl=60))
+    product = Product(id=uuid4(), name="test", description="test")
+    async with async_session_scope() as session:
+        session.add(Product(id=product.id, name="test", description="test"))
+
+    def offers(price):
+        return [
+            OfferModel(id=uuid4(), price=price, items_in_stock=1, product_id=product.id)
+        ]
+
+    await _store_offers_in_db(offers(100), product)
+    [first] = await ProductService().get_offers(product.id)
+    [cached] = await ProductService().get_offers(product.id)
+    assert ResultCache.hits == 1
+    assert first.price == cached.price == 100
+
+    monkeypatch.setattr(time, "time", lambda: MOCKED_TIME + 60)
+    await _store_offers_in_db(offers(200), product)
+    [second] = await ProductService().get_offers(product.id)
+    assert ResultCache.misses == 2
+    assert second.price == 200
@@ -0,0 +1,40 @@
+import pytest
+import pytest_asyncio
+
+import src.env as env
+from src.http_client import UpstreamClient
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def reset_client():
+    await UpstreamClient.stop()
+    yield
+    await UpstreamClient.stop()
+
+
+@pytest.mark.asyncio
+async def test_client_is_shared():
+    client = UpstreamClient.start()
+
+    assert UpstreamClient.get() is client
+    assert UpstreamClient.get() is client
+
+
+@pytest.mark.asyncio
+async def test_stop_closes_client():
+    client = UpstreamClient.start()
+
+    await UpstreamClient.stop()
+
+    assert client.is_closed
+    assert UpstreamClient.get() is not client
+
+
+@pytest.mark.asyncio
+async def test_http2_without_h2_falls_back(monkeypatch):
+    monkeypatch.setattr(env, "UPSTREAM_HTTP2", True)
+    monkeypatch.setattr("src.http_client._http2_available", lambda: False)
+
+    client = UpstreamClient.start()
+
+    assert not client._transport._pool._http2
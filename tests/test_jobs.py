@@ -0,0 +1,188 @@
+from unittest.mock import AsyncMock, patch
+import uuid
+
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import event, update
+
+import src.env as env
+from src.auth import auth_wrapper
+from src.db import async_session_scope
+from src.exceptions.external import UpstreamUnavailableError
+from src.jobs import DONE, FAILED, PENDING, RUNNING, claim_job, due_job_ids, run_job
+from src.main import app
+from src.orm_models import Product
+from src.pydantic_models import CreateProductModel, JobModel
+from src.services import JobService, ProductService
+from tests.conftest import MOCKED_TIME
+
+
+async def create_job() -> JobModel:
+    return await ProductService().create_product_async(
+        CreateProductModel(name="test", description="test")
+    )
+
+
+async def get_job(job_id: uuid.UUID) -> JobModel:
+    return await JobService().get_job(job_id)
+
+
+@pytest.mark.asyncio
+async def test_create_product_async_does_not_call_upstream(database):
+    register, fetch = AsyncMock(), AsyncMock()
+    with patch("src.jobs.register_product", register), patch(
+        "src.jobs.fetch_products", fetch
+    ):
+        job = await create_job()
+
+    assert job.status == PENDING
+    async with async_session_scope() as session:
+        assert await session.get(Product, job.product_id) is not None
+    register.assert_not_awaited()
+    fetch.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_run_job(database):
+    job = await create_job()
+    register, fetch = AsyncMock(), AsyncMock()
+
+    with patch("src.jobs.register_product", register), patch(
+        "src.jobs.fetch_products", fetch
+    ):
+        assert await run_job(job.id, "worker") == DONE
+        # a finished job is not run again
+        assert await run_job(job.id, "worker") is None
+
+    job = await get_job(job.id)
+    assert (job.status, job.registered, job.fetched, job.attempts) == (DONE, True, True, 1)
+    register.assert_awaited_once()
+    fetch.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_run_job_holds_no_connection_during_upstream_calls(database):
+    job = await create_job()
+    engine = database.async_engine.sync_engine
+    connections = [0]
+    checked_out = []
+
+    def checkout(*args):
+        connections[0] += 1
+
+    def checkin(*args):
+        connections[0] -= 1
+
+    async def upstream_call(product):
+        checked_out.append(connections[0])
+
+    event.listen(engine, "checkout", checkout)
+    event.listen(engine, "checkin", checkin)
+    try:
+        with patch("src.jobs.register_product", upstream_call), patch(
+            "src.jobs.fetch_products", upstream_call
+        ):
+            assert await run_job(job.id, "worker") == DONE
+    finally:
+        event.remove(engine, "checkout", checkout)
+        event.remove(engine, "checkin", checkin)
+
+    assert checked_out == [0, 0]
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_retried(database, monkeypatch):
+    monkeypatch.setattr(env, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(env, "JOB_RETRY_DELAY", 10)
+    job = await create_job()
+    register = AsyncMock()
+    fetch = AsyncMock(side_effect=UpstreamUnavailableError())
+
+    with patch("src.jobs.register_product", register), patch(
+        "src.jobs.fetch_products", fetch
+    ):
+        assert await run_job(job.id, "worker") == PENDING
+        # not due before the retry delay
+        assert await run_job(job.id, "worker") is None
+
+        failed = await get_job(job.id)
+        assert failed.registered
+        assert failed.error == "Offers API is unavailable, try again later"
+
+        monkeypatch.setattr("time.time", lambda: MOCKED_TIME + 10)
+        assert await run_job(job.id, "worker") == FAILED
+
+    # the registration succeeded in the first attempt, it is not repeated
+    register.assert_awaited_once()
+    assert fetch.await_count == 2
+    assert (await get_job(job.id)).status == FAILED
+
+
+@pytest.mark.asyncio
+async def test_running_job_is_taken_over_after_lease(database, monkeypatch):
+    monkeypatch.setattr(env, "JOB_LEASE_TTL", 60)
+    job = await create_job()
+
+    async with async_session_scope() as session:
+        assert await claim_job(session, job.id, "dying")
+    async with async_session_scope() as session:
+        assert not await claim_job(session, job.id, "other")
+        assert await due_job_ids(session, 10) == []
+
+    monkeypatch.setattr("time.time", lambda: MOCKED_TIME + 60)
+    async with async_session_scope() as session:
+        assert await due_job_ids(session, 10) == [job.id]
+        assert await claim_job(session, job.id, "other")
+
+    job = await get_job(job.id)
+    assert (job.status, job.attempts) == (RUNNING, 2)
+
+
+@pytest.mark.asyncio
+async def test_job_of_deleted_product_fails(database):
+    job = await create_job()
+    async with async_session_scope() as session:
+        await session.execute(
+            update(Product)
+            .where(Product.id == job.product_id)
+            .values(deleted_at=MOCKED_TIME)
+        )
+
+    assert await run_job(job.id, "worker") == FAILED
+    assert (await get_job(job.id)).error == "Product was deleted"
+
+
+def test_job_endpoints():
+    app.dependency_overrides[auth_wrapper] = lambda: "johndoe"
+    client = TestClient(app)
+    job = JobModel(
+        id=uuid.uuid4(),
+        product_id=uuid.uuid4(),
+        status=PENDING,
+        registered=False,
+        fetched=False,
+        attempts=0,
+        created_at=MOCKED_TIME,
+        updated_at=MOCKED_TIME,
+    )
+
+    async def create_product_async(self, data):
+        return job
+
+    async def get_job(self, job_id):
+        assert job_id == job.id
+        return job
+
+    with patch.object(
+        ProductService, "create_product_async", create_product_async
+    ), patch.object(JobService, "get_job", get_job):
+        created = client.post(
+            "/products/?async=true", json={"name": "test", "description": "test"}
+        )
+        status = client.get(created.headers["Location"])
+
+    assert created.status_code == 202
+    assert created.json()["id"] == str(job.id)
+    assert created.json()["product_id"] == str(job.product_id)
+    assert status.status_code == 200
+    assert status.json() == created.json()
@@ -0,0 +1,91 @@
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select, update
+
+import src.env as env
+from src.background import OfferWorker
+from src.db import async_session_scope
+from src.leases import claim_products, ensure_leases, release_leases
+from src.orm_models import FetchLease, Product
+from tests.conftest import MOCKED_TIME
+
+
+@pytest_asyncio.fixture
+async def product_ids(database):
+    ids = [uuid4() for _ in range(10)]
+    async with async_session_scope() as session:
+        session.add_all([Product(id=id, name="test", description="test") for id in ids])
+        await session.flush()
+        await ensure_leases(session)
+    return ids
+
+
+async def claim(owner: str, limit: int = 100):
+    async with async_session_scope() as session:
+        return await claim_products(session, owner, ttl=60, limit=limit)
+
+
+@pytest.mark.asyncio
+async def test_ensure_leases_is_idempotent(product_ids):
+    async with async_session_scope() as session:
+        await ensure_leases(session)
+        leases = (await session.scalars(select(FetchLease))).all()
+
+    assert sorted(lease.product_id for lease in leases) == sorted(product_ids)
+
+
+@pytest.mark.asyncio
+async def test_workers_claim_disjoint_products(product_ids):
+    first = await claim("first", limit=4)
+    second = await claim("second")
+    third = await claim("third")
+
+    assert len(first) == 4
+    assert len(second) == 6
+    assert third == []
+    assert set(first) | set(second) == set(product_ids)
+
+
+@pytest.mark.asyncio
+async def test_expired_leases_are_taken_over(product_ids):
+    await claim("dead")
+
+    # the dead worker's leases expired
+    async with async_session_scope() as session:
+        await session.execute(
+            update(FetchLease).values(expires_at=MOCKED_TIME - 1)
+        )
+
+    assert sorted(await claim("alive")) == sorted(product_ids)
+
+
+@pytest.mark.asyncio
+async def test_released_leases_can_be_claimed(product_ids):
+    await claim("leaving")
+
+    async with async_session_scope() as session:
+        await release_leases(session, "leaving")
+
+    assert sorted(await claim("staying")) == sorted(product_ids)
+
+
+@pytest.mark.asyncio
+async def test_leased_fetch_cycle_fetches_every_product_once(product_ids, monkeypatch):
+    monkeypatch.setattr(env, "FETCH_LEASE_BATCH", 3)
+    fetched = []
+
+    async def fake_fetch(product):
+        fetched.append(product.id)
+
+    with patch("src.background.fetch_products", fake_fetch):
+        stats = await OfferWorker.leased_fetch_cycle()
+        # everything is leased now, a second replica gets nothing
+        monkeypatch.setattr(env, "WORKER_ID", "other")
+        other_stats = await OfferWorker.leased_fetch_cycle()
+
+    assert sorted(fetched) == sorted(product_ids)
+    assert stats.done == 10
+    assert other_stats.done == 0
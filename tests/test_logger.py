@@ -0,0 +1,87 @@
+import json
+import logging
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from src.logger import (
+    JsonFormatter,
+    RepeatSampler,
+    TextFormatter,
+    get_logger,
+    setup_logging,
+)
+
+
+def record(msg: str, *args, level: int = logging.ERROR, name: str = "src.test"):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_one_handler_per_process():
+    handler = setup_logging()
+
+    for name in ("src.a", "src.b", "src.a"):
+        assert get_logger(name).handlers == []
+    assert logging.getLogger().handlers.count(handler) == 1
+    assert setup_logging() is handler
+
+
+def test_disabled_levels_are_not_formatted():
+    class Expensive:
+        formatted = 0
+
+        def __str__(self):
+            Expensive.formatted += 1
+            return "expensive"
+
+    logger = get_logger("src.test")
+    with patch.object(logger, "level", logging.INFO):
+        logger.debug("value: %s", Expensive())
+
+    assert Expensive.formatted == 0
+
+
+def test_sampler_limits_repeated_errors():
+    sampler = RepeatSampler(burst=2, window=60)
+    passed = [sampler.filter(record("Fetching %s failed", i)) for i in range(5)]
+    # other messages and info records have their own allowance
+    assert sampler.filter(record("Other failure"))
+    assert all(
+        sampler.filter(record("Fetching %s failed", i, level=logging.INFO))
+        for i in range(5)
+    )
+
+    assert passed == [True, True, False, False, False]
+
+    with patch("src.logger.time.monotonic", return_value=1e12):
+        next_window = record("Fetching %s failed", 6)
+        assert sampler.filter(next_window)
+    assert next_window.suppressed == 3
+
+
+@pytest.mark.parametrize("formatter", [JsonFormatter(), TextFormatter()])
+def test_formatters_report_suppressed_messages(formatter):
+    entry = record("Fetching %s failed", "abc")
+    entry.suppressed = 3
+
+    output = formatter.format(entry)
+
+    assert "Fetching abc failed" in output
+    assert "3" in output
+
+
+def test_json_format():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        entry = logging.LogRecord(
+            "src.test", logging.ERROR, __file__, 1, "Failed %d times", (2,), sys.exc_info()
+        )
+
+    output = json.loads(JsonFormatter().format(entry))
+
+    assert output["level"] == "ERROR"
+    assert output["logger"] == "src.test"
+    assert output["message"] == "Failed 2 times"
+    assert "ValueError: boom" in output["exception"]
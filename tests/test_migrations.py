@@ -0,0 +1,146 @@
+from uuid import uuid4
+
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine, delete, inspect, select, text
+from sqlalchemy.dialects import sqlite
+
+from src.migrate import alembic_config, migrate
+from src.offers import latest_offers_query
+from src.orm_models import Base, Fetch, Offer, offer_fetch
+from src.rollups import price_history_query
+
+
+HEAD = ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'migrations.db'}"
+
+
+def current_revision(url: str) -> str:
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        revision = MigrationContext.configure(connection).get_current_revision()
+    engine.dispose()
+    return revision
+
+
+def test_migrations_match_models(database_url):
+    migrate(url=database_url)
+
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        diff = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    engine.dispose()
+
+    assert diff == []
+
+
+def test_legacy_database_is_stamped_and_upgraded(database_url):
+    # a database created by create_all before the migrations existed has the tables, but no revision
+    migrate("0001", url=database_url)
+    engine = create_engine(database_url)
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE alembic_version"))
+
+    migrate(url=database_url)
+
+    assert current_revision(database_url) == HEAD
+    indexes = {index["name"] for index in inspect(engine).get_indexes("fetch")}
+    assert "ix_fetch_product_id_time" in indexes
+    engine.dispose()
+
+
+def test_latest_fetch_is_backfilled(database_url):
+    migrate("0008", url=database_url)
+    engine = create_engine(database_url)
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO products (id, name, description) VALUES ('p1', 'a', 'a')")
+        )
+        connection.execute(
+            text(
+                "INSERT INTO fetch (id, product_id, time) "
+                "VALUES ('f1', 'p1', 1), ('f2', 'p1', 3), ('f3', 'p1', 2)"
+            )
+        )
+
+    migrate(url=database_url)
+
+    with engine.connect() as connection:
+        latest = connection.scalar(text("SELECT latest_fetch_id FROM products"))
+    engine.dispose()
+    assert latest == "f2"
+
+
+def test_partially_created_database_is_upgraded(database_url):
+    # create_all may already have added the columns and tables of later revisions
+    migrate("0002", url=database_url)
+    engine = create_engine(database_url)
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE alembic_version"))
+    engine.dispose()
+
+    migrate(url=database_url)
+
+    assert current_revision(database_url) == HEAD
+
+
+product_id = uuid4()
+
+# queries that run for every request or every stored fetch, with the index they have to use
+INDEXED_QUERIES = {
+    "latest fetch": (
+        select(Fetch.id)
+        .where(Fetch.product_id == product_id)
+        .order_by(Fetch.time.desc())
+        .limit(1),
+        "ix_fetch_product_id_time",
+    ),
+    "latest offers": (
+        latest_offers_query(product_id),
+        "ix_offer_fetch_fetch_id",
+    ),
+    "price history": (
+        price_history_query(product_id, 0, 100).order_by(Fetch.time.desc()),
+        "ix_fetch_product_id_time",
+    ),
+    "offers of a fetch": (
+        select(Offer.price)
+        .join(offer_fetch, Offer.id == offer_fetch.c.offer_id)
+        .where(offer_fetch.c.fetch_id == uuid4()),
+        "ix_offer_fetch_fetch_id",
+    ),
+    "fetches of an offer": (
+        select(offer_fetch.c.fetch_id).where(offer_fetch.c.offer_id == uuid4()),
+        "ix_offer_fetch_offer_id",
+    ),
+    "offers of a product": (
+        delete(Offer).where(Offer.product_id == product_id),
+        "ix_offers_product_id",
+    ),
+}
+
+
+@pytest.mark.parametrize("name", INDEXED_QUERIES)
+def test_query_plan_uses_index(database_url, name):
+    statement, index = INDEXED_QUERIES[name]
+    migrate(url=database_url)
+
+    sql = statement.compile(
+        dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        plan = [
+            row.detail
+            for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+        ]
+    engine.dispose()
+
+    assert any(index in step for step in plan), plan
+    assert not any(step.startswith("SCAN fetch") for step in plan), plan
@@ -0,0 +1,118 @@
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+
+import src.env as env
+from src.background import PurgeWorker
+from src.db import async_session_scope
+from src.exceptions.internal import EntityNotFound
+from src.leases import ensure_leases
+from src.offers import _store_offers_in_db
+from src.orm_models import (
+    Fetch,
+    FetchLease,
+    Offer,
+    OfferSummary,
+    PriceRollup,
+    Product,
+    offer_fetch,
+)
+from src.purge import purge_deleted_products
+from src.pydantic_models import OfferModel
+from src.services.product import ProductService
+from tests.conftest import MOCKED_TIME
+
+
+OFFER_IDS = {price: [uuid4(), uuid4()] for price in [100, 200, 300]}
+
+
+@pytest_asyncio.fixture
+async def product(database, monkeypatch):
+    """
+    A product with 5 fetches: 3 snapshots, the first two followed by a fetch that found the same offers.
+    """
+    product_id = uuid4()
+    async with async_session_scope() as session:
+        session.add(Product(id=product_id, name="test", description="test"))
+        await session.flush()
+        await ensure_leases(session)
+
+    product = Product(id=product_id, name="test", description="test")
+    for i, price in enumerate([100, 100, 200, 200, 300]):
+        monkeypatch.setattr("time.time", lambda: MOCKED_TIME + i)
+        models = [
+            OfferModel(id=offer_id, price=price, items_in_stock=1, product_id=product_id)
+            for offer_id in OFFER_IDS[price]
+        ]
+        await _store_offers_in_db(models, product)
+
+    monkeypatch.setattr("time.time", lambda: MOCKED_TIME + 10)
+    return product
+
+
+async def row_counts() -> dict:
+    async with async_session_scope() as session:
+        return {
+            table.name: await session.scalar(select(func.count()).select_from(table))
+            for table in [
+                Product.__table__,
+                Fetch.__table__,
+                OfferSummary.__table__,
+                Offer.__table__,
+                offer_fetch,
+                FetchLease.__table__,
+                PriceRollup.__table__,
+            ]
+        }
+
+
+@pytest.mark.asyncio
+async def test_product_fixture(product):
+    assert await row_counts() == {
+        "products": 1,
+        "fetch": 5,
+        "offer_summary": 3,
+        "offers": 6,
+        "offer_fetch": 6,
+        "fetch_lease": 1,
+        "price_rollup": 2,
+    }
+
+
+@pytest.mark.asyncio
+async def test_small_product_is_purged_immediately(product, monkeypatch):
+    monkeypatch.setattr(env, "PRODUCT_PURGE_BATCH", 100)
+
+    await ProductService().delete_product(product.id)
+
+    assert set((await row_counts()).values()) == {0}
+
+
+@pytest.mark.asyncio
+async def test_large_product_is_purged_in_background(product, monkeypatch):
+    monkeypatch.setattr(env, "PRODUCT_PURGE_BATCH", 2)
+    woken = []
+    monkeypatch.setattr(PurgeWorker, "wake", lambda: woken.append(True))
+
+    await ProductService().delete_product(product.id)
+
+    # the product is hidden, but its history is still there
+    assert woken == [True]
+    assert (await row_counts())["fetch"] == 5
+    assert await ProductService().read_products() == []
+    with pytest.raises(EntityNotFound):
+        await ProductService().get_offers(product.id)
+    with pytest.raises(EntityNotFound):
+        await ProductService().delete_product(product.id)
+
+    assert await purge_deleted_products(batch_size=2) == 1
+
+    assert set((await row_counts()).values()) == {0}
+
+
+@pytest.mark.asyncio
+async def test_delete_missing_product(database):
+    with pytest.raises(EntityNotFound):
+        await ProductService().delete_product(uuid4())
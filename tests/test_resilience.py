@@ -0,0 +1,208 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, Mock, patch
+
+import httpx
+import pytest
+
+import src.env as env
+from src.exceptions.external import UpstreamUnavailableError
+from src.resilience import CircuitBreaker, RetryBudget, TokenBucket, retry_delay
+
+
+def response(status_code: int) -> Mock:
+    return Mock(status_code=status_code)
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(env, "UPSTREAM_RATE_LIMIT", 0)
+    monkeypatch.setattr(env, "UPSTREAM_RETRIES", 3)
+    monkeypatch.setattr(env, "UPSTREAM_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(env, "UPSTREAM_RETRY_BUDGET_CAPACITY", 10)
+    monkeypatch.setattr(env, "UPSTREAM_BREAKER_THRESHOLD", 5)
+    monkeypatch.setattr(env, "UPSTREAM_BREAKER_RESET", 30)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, capacity=2)
+
+    start = time.monotonic()
+    for _ in range(6):
+        await bucket.acquire()
+
+    # two requests use the burst, the other four wait 10ms each
+    assert time.monotonic() - start >= 0.035
+    assert bucket.waits >= 3
+    assert bucket.wait_time >= 0.035
+    assert 0 < bucket.max_wait < 0.1
+
+
+def test_retry_delay_is_bounded(monkeypatch):
+    monkeypatch.setattr(env, "UPSTREAM_RETRY_BASE_DELAY", 1)
+    monkeypatch.setattr(env, "UPSTREAM_RETRY_MAX_DELAY", 5)
+
+    assert all(0 <= retry_delay(0) <= 1 for _ in range(100))
+    assert all(0 <= retry_delay(2) <= 4 for _ in range(100))
+    assert all(0 <= retry_delay(10) <= 5 for _ in range(100))
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, capacity=2)
+
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+@pytest.mark.asyncio
+async def test_failed_requests_are_retried(upstream_guard):
+    send = AsyncMock(
+        side_effect=[httpx.ConnectTimeout("timeout"), response(502), response(200)]
+    )
+
+    result = await upstream_guard.call(send)
+
+    assert result.status_code == 200
+    assert send.await_count == 3
+    assert upstream_guard.stats().retries == 2
+    assert upstream_guard.stats().breaker_state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_retries_are_bounded(upstream_guard):
+    send = AsyncMock(return_value=response(500))
+
+    result = await upstream_guard.call(send)
+
+    assert result.status_code == 500
+    assert send.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried(upstream_guard):
+    send = AsyncMock(return_value=response(404))
+
+    assert (await upstream_guard.call(send)).status_code == 404
+    assert send.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_non_idempotent_requests_are_retried_only_if_not_processed(
+    upstream_guard,
+):
+    send = AsyncMock(return_value=response(500))
+    assert (await upstream_guard.call(send, idempotent=False)).status_code == 500
+    assert send.await_count == 1
+
+    send = AsyncMock(side_effect=[httpx.ConnectError("refused"), response(200)])
+    assert (await upstream_guard.call(send, idempotent=False)).status_code == 200
+    assert send.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_retry_budget_limits_retries(upstream_guard, monkeypatch):
+    monkeypatch.setattr(env, "UPSTREAM_RETRY_BUDGET_CAPACITY", 2)
+    monkeypatch.setattr(env, "UPSTREAM_BREAKER_THRESHOLD", 0)
+    send = AsyncMock(return_value=response(503))
+
+    await upstream_guard.call(send)
+    await upstream_guard.call(send)
+
+    # the first request spends the whole budget after two retries, the second one is not retried
+    assert send.await_count == 4
+    assert upstream_guard.stats().retries == 2
+    assert upstream_guard.stats().retries_denied == 2
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_recovers(upstream_guard, monkeypatch):
+    monkeypatch.setattr(env, "UPSTREAM_RETRIES", 0)
+    monkeypatch.setattr(env, "UPSTREAM_BREAKER_THRESHOLD", 2)
+    send = AsyncMock(return_value=response(500))
+
+    await upstream_guard.call(send)
+    await upstream_guard.call(send)
+    assert upstream_guard.stats().breaker_state == CircuitBreaker.OPEN
+
+    # fails fast while open
+    with pytest.raises(UpstreamUnavailableError):
+        await upstream_guard.call(send)
+    assert send.await_count == 2
+    assert upstream_guard.stats().rejected == 1
+
+    # after the reset timeout, a successful trial request closes the breaker
+    now = time.monotonic()
+    monkeypatch.setattr("time.monotonic", lambda: now + 31)
+    send.return_value = response(200)
+    assert (await upstream_guard.call(send)).status_code == 200
+    assert upstream_guard.stats().breaker_state == CircuitBreaker.CLOSED
+    assert upstream_guard.stats().breaker_opened == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_trial_reopens_breaker(upstream_guard, monkeypatch):
+    monkeypatch.setattr(env, "UPSTREAM_RETRIES", 0)
+    monkeypatch.setattr(env, "UPSTREAM_BREAKER_THRESHOLD", 1)
+    send = AsyncMock(return_value=response(500))
+    await upstream_guard.call(send)
+
+    now = time.monotonic()
+    monkeypatch.setattr("time.monotonic", lambda: now + 31)
+    await upstream_guard.call(send)
+
+    assert upstream_guard.stats().breaker_state == CircuitBreaker.OPEN
+    with pytest.raises(UpstreamUnavailableError):
+        await upstream_guard.call(send)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_trial_does_not_block_breaker(upstream_guard, monkeypatch):
+    monkeypatch.setattr(env, "UPSTREAM_RETRIES", 0)
+    monkeypatch.setattr(env, "UPSTREAM_BREAKER_THRESHOLD", 1)
+    await upstream_guard.call(AsyncMock(return_value=response(500)))
+
+    # the event loop runs on time.monotonic, so the reset timeout is passed by moving the opening into the past
+    upstream_guard.breaker._opened_at -= 31
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(upstream_guard.call(hang), 0.01)
+    # the cancelled trial reopened the breaker
+    assert upstream_guard.stats().breaker_state == CircuitBreaker.OPEN
+
+    # and the next trial after the reset timeout is let through
+    upstream_guard.breaker._opened_at -= 31
+    send = AsyncMock(return_value=response(200))
+    assert (await upstream_guard.call(send)).status_code == 200
+    assert upstream_guard.stats().breaker_state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_trial_cancelled_during_rate_limit_wait_does_not_block_breaker(
+    upstream_guard, monkeypatch
+):
+    monkeypatch.setattr(env, "UPSTREAM_RETRIES", 0)
+    monkeypatch.setattr(env, "UPSTREAM_BREAKER_THRESHOLD", 1)
+    await upstream_guard.call(AsyncMock(return_value=response(500)))
+    upstream_guard.breaker._opened_at -= 31
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    send = AsyncMock(return_value=response(200))
+    with patch.object(upstream_guard.limiter, "acquire", hang):
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(upstream_guard.call(send), 0.01)
+    assert send.await_count == 0
+
+    # the cancelled call never became the trial, the next one is let through
+    assert (await upstream_guard.call(send)).status_code == 200
+    assert upstream_guard.stats().breaker_state == CircuitBreaker.CLOSED
@@ -0,0 +1,116 @@
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select, update
+
+from src.db import async_session_scope
+from src.offers import _store_offers_in_db
+from src.orm_models import Fetch, Offer, Product, offer_fetch
+from src.pydantic_models import OfferModel
+from src.retention import compact_snapshots
+from src.services.product import ProductService
+from tests.conftest import MOCKED_TIME
+
+DAY = 24 * 60 * 60
+
+OFFER_IDS = [uuid4() for _ in range(7)]
+
+
+async def store(product: Product, days_ago: int, offers: list[int], monkeypatch):
+    monkeypatch.setattr("time.time", lambda: MOCKED_TIME - days_ago * DAY)
+    models = [
+        OfferModel(
+            id=OFFER_IDS[offer], price=100 + offer, items_in_stock=1, product_id=product.id
+        )
+        for offer in offers
+    ]
+    await _store_offers_in_db(models, product)
+
+
+@pytest_asyncio.fixture
+async def products(database, monkeypatch):
+    """
+    Product A:
+    - 50 days ago: legacy snapshot (no summary) with offer 5
+    - 40 days ago: snapshot with offers 0 and 1
+    - 35 days ago: snapshot with offers 1 and 2
+    - 5 days ago: the offers of 35 days ago did not change
+    - 3 days ago: snapshot with offer 3
+
+    Product B:
+    - 60 days ago: snapshot with offer 4, the latest one of the product
+    """
+    a = Product(id=uuid4(), name="a", description="a")
+    b = Product(id=uuid4(), name="b", description="b")
+    async with async_session_scope() as session:
+        session.add_all(
+            [
+                Product(id=a.id, name="a", description="a"),
+                Product(id=b.id, name="b", description="b"),
+            ]
+        )
+
+    await store(a, 50, [5], monkeypatch)
+    async with async_session_scope() as session:
+        await session.execute(
+            update(Fetch)
+            .where(Fetch.time == MOCKED_TIME - 50 * DAY)
+            .values(offer_summary_id=None)
+        )
+
+    await store(a, 40, [0, 1], monkeypatch)
+    await store(a, 35, [1, 2], monkeypatch)
+    await store(a, 5, [1, 2], monkeypatch)
+    await store(a, 3, [3], monkeypatch)
+    await store(b, 60, [4], monkeypatch)
+
+    monkeypatch.setattr("time.time", lambda: MOCKED_TIME)
+    return a, b
+
+
+async def remaining_offers() -> set[int]:
+    async with async_session_scope() as session:
+        ids = (await session.scalars(select(Offer.id))).all()
+    return {OFFER_IDS.index(id) for id in ids}
+
+
+async def link_count() -> int:
+    async with async_session_scope() as session:
+        return await session.scalar(select(func.count()).select_from(offer_fetch))
+
+
+@pytest.mark.asyncio
+async def test_compaction(products, result_cache):
+    # compare the results computed before and after the compaction, not cached ones
+    result_cache.configure(None)
+    a, b = products
+    history = await ProductService().get_price_history(a.id, 0, MOCKED_TIME)
+    assert await link_count() == 7
+
+    stats = await compact_snapshots(retention_days=30, batch_size=1, max_batches=10)
+
+    # the snapshots of 50 and 40 days ago are compacted, the one of 35 days ago is still used 5 days ago
+    assert stats.snapshots == 2
+    assert stats.links == 3
+    assert stats.summaries == 1
+    assert stats.offers == 2
+    assert await remaining_offers() == {1, 2, 3, 4}
+    assert await link_count() == 4
+
+    # the price history is answered from the summaries
+    assert await ProductService().get_price_history(a.id, 0, MOCKED_TIME) == history
+    assert [offer.price for offer in await ProductService().get_offers(b.id)] == [104]
+
+    # nothing left to compact
+    stats = await compact_snapshots(retention_days=30, batch_size=1, max_batches=10)
+    assert stats.snapshots == 0
+
+
+@pytest.mark.asyncio
+async def test_compaction_stops_after_max_batches(products):
+    stats = await compact_snapshots(retention_days=30, batch_size=1, max_batches=1)
+
+    assert stats.snapshots == 1
+    assert stats.summaries == 1
+    assert await remaining_offers() == {0, 1, 2, 3, 4}
@@ -0,0 +1,189 @@
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, event, select
+
+from src.db import async_session_scope
+from src.offers import _store_offers_in_db
+from src.orm_models import Fetch, PriceRollup, Product
+from src.pydantic_models import OfferModel
+from src.rollups import (
+    DAY,
+    HOUR,
+    combine_buckets,
+    full_buckets,
+    price_history_query,
+    read_summaries,
+    rebuild_all_rollups,
+)
+from src.services.product import ProductService
+
+
+# fetches every 30 minutes over two days, with a price that keeps changing
+FETCH_TIMES = [DAY * 100 + i * 30 * 60 for i in range(2 * 24 * 2)]
+
+
+@pytest_asyncio.fixture
+async def product(database, monkeypatch):
+    product_id = uuid4()
+    async with async_session_scope() as session:
+        session.add(Product(id=product_id, name="test", description="test"))
+
+    product = Product(id=product_id, name="test", description="test")
+    for i, fetch_time in enumerate(FETCH_TIMES):
+        monkeypatch.setattr("time.time", lambda: fetch_time)
+        models = [
+            OfferModel(
+                id=uuid4(),
+                price=100 + (i * 37 + j * 11) % 90,
+                items_in_stock=j,
+                product_id=product_id,
+            )
+            for j in range(1 + i % 3)
+        ]
+        await _store_offers_in_db(models, product)
+    return product
+
+
+async def raw_history(product_id, from_time, to_time, bucket):
+    async with async_session_scope() as session:
+        summaries = await read_summaries(
+            session,
+            price_history_query(product_id, from_time, to_time).order_by(
+                Fetch.time.desc()
+            ),
+        )
+    return combine_buckets(summaries, bucket)
+
+
+async def rollups() -> list[tuple]:
+    async with async_session_scope() as session:
+        return [
+            (
+                rollup.resolution,
+                rollup.bucket_start,
+                rollup.min_price,
+                rollup.max_price,
+                rollup.avg_price,
+                rollup.median_price,
+                rollup.fetch_count,
+                rollup.weighted_avg_price,
+                rollup.weighted_median_price,
+                rollup.offer_count,
+                rollup.weighted_count,
+            )
+            for rollup in await session.scalars(
+                select(PriceRollup).order_by(
+                    PriceRollup.resolution, PriceRollup.bucket_start
+                )
+            )
+        ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("bucket", [HOUR, DAY])
+@pytest.mark.parametrize(
+    "from_time, to_time",
+    [
+        (FETCH_TIMES[0], FETCH_TIMES[-1]),
+        # the edges cut through buckets
+        (FETCH_TIMES[0] + 30 * 60, FETCH_TIMES[-1] - 90 * 60),
+        (DAY * 100 + 5 * HOUR + 1, DAY * 101 + 19 * HOUR),
+    ],
+)
+async def test_rollups_match_raw_history(
+    database, product, bucket, from_time, to_time
+):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = database.async_engine.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        history = await ProductService().get_price_history(
+            product.id, from_time, to_time, bucket=bucket
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    # the rollups are used whenever at least one bucket lies completely within the time range
+    start, end = full_buckets(from_time, to_time, bucket)
+    assert any("price_rollup" in statement for statement in statements) == (start < end)
+    assert history == await raw_history(product.id, from_time, to_time, bucket)
+
+
+@pytest.mark.asyncio
+async def test_rollups_are_maintained_per_fetch(product):
+    stored = await rollups()
+
+    assert len([rollup for rollup in stored if rollup[0] == DAY]) == 2
+    assert len([rollup for rollup in stored if rollup[0] == HOUR]) == 2 * 24
+    assert all(rollup[6] == 2 for rollup in stored if rollup[0] == HOUR)
+    assert all(rollup[6] == 2 * 24 for rollup in stored if rollup[0] == DAY)
+    # the first fetch of the second day closed the first one, the second one is still open
+    assert [rollup[5] is None for rollup in stored if rollup[0] == DAY] == [False, True]
+
+
+@pytest.mark.asyncio
+async def test_ingest_reads_one_hour(product, monkeypatch):
+    ranges = []
+
+    def recording_query(product_id, from_time, to_time):
+        ranges.append(to_time - from_time)
+        return price_history_query(product_id, from_time, to_time)
+
+    monkeypatch.setattr("src.rollups.price_history_query", recording_query)
+    monkeypatch.setattr("time.time", lambda: FETCH_TIMES[-1] + 60)
+    models = [OfferModel(id=uuid4(), price=150, items_in_stock=1, product_id=product.id)]
+    await _store_offers_in_db(models, product)
+
+    assert ranges == [HOUR]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("bucket", [HOUR, DAY])
+async def test_missing_and_open_rollups_are_read_from_fetches(product, bucket):
+    from_time, to_time = DAY * 100, DAY * 102
+    async with async_session_scope() as session:
+        # e.g. fetches stored before the rollups existed
+        await session.execute(
+            delete(PriceRollup).where(PriceRollup.bucket_start == DAY * 100 + HOUR)
+        )
+
+    history = await ProductService().get_price_history(
+        product.id, from_time, to_time, bucket=bucket
+    )
+
+    assert history == await raw_history(product.id, from_time, to_time, bucket)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_rollups(product):
+    maintained = await rollups()
+
+    async with async_session_scope() as session:
+        await session.execute(delete(PriceRollup))
+        # a stale rollup of a bucket without fetches
+        session.add(
+            PriceRollup(
+                product_id=product.id,
+                resolution=HOUR,
+                bucket_start=0,
+                fetch_count=1,
+            )
+        )
+
+    await rebuild_all_rollups()
+
+    rebuilt = await rollups()
+    # the rollups of the hours and of the closed day are computed the same way at ingest
+    assert rebuilt[:-1] == maintained[:-1]
+    # the open day is updated per fetch, the rebuild computes its medians as well
+    assert rebuilt[-1][:5] == pytest.approx(maintained[-1][:5])
+    assert maintained[-1][5] is None and rebuilt[-1][5] is not None
+    assert rebuilt[-1][6:] == pytest.approx(
+        (*maintained[-1][6:8], rebuilt[-1][8], *maintained[-1][9:])
+    )
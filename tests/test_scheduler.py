@@ -0,0 +1,239 @@
+import asyncio
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select, update
+
+import src.env as env
+from src.background import FetchCycleStats, OfferWorker
+from src.db import async_session_scope
+from src.orm_models import Fetch, FetchLease, Offer, Product
+from src.scheduler import (
+    FetchScheduler,
+    ProductSchedule,
+    jittered,
+    next_interval,
+    sync_schedule,
+)
+from tests.conftest import MOCKED_TIME
+
+
+OFFER_ID = uuid4()
+
+
+def offers(price: int) -> list[Offer]:
+    return [Offer(id=OFFER_ID, price=price, items_in_stock=1)]
+
+
+@pytest.fixture(autouse=True)
+def intervals(monkeypatch):
+    monkeypatch.setattr(env, "PERIODIC_FETCH_INTERVAL", 60)
+    monkeypatch.setattr(env, "FETCH_MIN_INTERVAL", 30)
+    monkeypatch.setattr(env, "FETCH_MAX_INTERVAL", 600)
+    monkeypatch.setattr(env, "FETCH_JITTER", 0)
+
+
+def test_pop_due_takes_most_overdue_first():
+    scheduler = FetchScheduler()
+    ids = [uuid4() for _ in range(4)]
+    for id, due in zip(ids, [30, 10, 20, 100]):
+        scheduler.schedule(ProductSchedule(id, due, 60))
+
+    assert [entry.product_id for entry in scheduler.pop_due(50, 2)] == [ids[1], ids[2]]
+    assert [entry.product_id for entry in scheduler.pop_due(50, 10)] == [ids[0]]
+    # products in flight are not due again until they are rescheduled
+    assert scheduler.pop_due(50, 10) == []
+    assert scheduler.next_due() == 100
+
+
+def test_rescheduled_and_removed_products_are_skipped():
+    scheduler = FetchScheduler()
+    moved, removed = uuid4(), uuid4()
+    scheduler.schedule(ProductSchedule(moved, 10, 60))
+    scheduler.schedule(ProductSchedule(removed, 20, 60))
+
+    scheduler.schedule(ProductSchedule(moved, 200, 60))
+    scheduler.remove(removed)
+
+    assert scheduler.pop_due(100, 10) == []
+    assert scheduler.next_due() == 200
+    assert len(scheduler) == 1
+
+
+def test_interval_adapts_within_bounds():
+    assert next_interval(60, None) == 60
+    assert next_interval(60, True) == 30
+    assert next_interval(40, True) == 30
+    assert next_interval(60, False) == 90
+    assert next_interval(500, False) == 600
+
+
+def test_jitter_spreads_due_times(monkeypatch):
+    monkeypatch.setattr(env, "FETCH_JITTER", 0.1)
+    intervals = [jittered(100) for _ in range(100)]
+
+    assert all(90 <= interval <= 110 for interval in intervals)
+    assert len(set(intervals)) > 1
+
+
+def test_reschedule_adapts_to_changes():
+    scheduler = FetchScheduler()
+    product_id = uuid4()
+    scheduler.schedule(ProductSchedule(product_id, 0, 60))
+
+    # the first fetch only records the offers
+    entry = scheduler.reschedule(scheduler.pop_due(0, 1)[0], offers(100), 0)
+    assert (entry.due, entry.interval) == (60, 60)
+
+    entry = scheduler.reschedule(scheduler.pop_due(60, 1)[0], offers(100), 60)
+    assert (entry.due, entry.interval) == (150, 90)
+
+    entry = scheduler.reschedule(scheduler.pop_due(150, 1)[0], offers(120), 150)
+    assert (entry.due, entry.interval) == (195, 45)
+
+    # a failed fetch is retried after the current interval
+    entry = scheduler.reschedule(scheduler.pop_due(195, 1)[0], None, 195)
+    assert (entry.due, entry.interval) == (240, 45)
+
+
+@pytest_asyncio.fixture
+async def products(database):
+    """
+    Products fetched 100 and 10 seconds ago, one never fetched and one deleted.
+    """
+    products = [Product(id=uuid4(), name="test", description="test") for _ in range(4)]
+    products[3].deleted_at = MOCKED_TIME
+    async with async_session_scope() as session:
+        session.add_all(products)
+        await session.flush()
+        session.add_all(
+            [
+                Fetch(id=uuid4(), product_id=products[0].id, time=MOCKED_TIME - 100),
+                Fetch(id=uuid4(), product_id=products[1].id, time=MOCKED_TIME - 10),
+            ]
+        )
+    return products
+
+
+@pytest.mark.asyncio
+async def test_sync_schedule_is_staleness_first(products):
+    scheduler = FetchScheduler()
+    async with async_session_scope() as session:
+        await sync_schedule(session, scheduler)
+
+    assert products[3].id not in scheduler
+    due = scheduler.pop_due(MOCKED_TIME + 50, 10)
+    assert [entry.product_id for entry in due] == [
+        products[2].id,
+        products[0].id,
+        products[1].id,
+    ]
+    assert [entry.due for entry in due] == [0, MOCKED_TIME - 40, MOCKED_TIME + 50]
+
+    async with async_session_scope() as session:
+        await session.execute(
+            update(Product)
+            .where(Product.id == products[0].id)
+            .values(deleted_at=MOCKED_TIME)
+        )
+        await sync_schedule(session, scheduler)
+    assert products[0].id not in scheduler
+    assert len(scheduler) == 2
+
+
+async def run_due_fetches(scheduler: FetchScheduler) -> FetchCycleStats:
+    stats = FetchCycleStats()
+    tasks = set()
+    OfferWorker.start_due_fetches(scheduler, tasks, stats)
+    await asyncio.gather(*tasks)
+    return stats
+
+
+@pytest.mark.asyncio
+async def test_due_products_are_fetched(products, monkeypatch):
+    scheduler = FetchScheduler()
+    async with async_session_scope() as session:
+        await sync_schedule(session, scheduler)
+    fetched = []
+
+    async def fake_fetch(product):
+        fetched.append(product.id)
+        if product.id == products[0].id:
+            raise Exception("upstream failed")
+        return offers(100)
+
+    with patch("src.background.fetch_products", fake_fetch):
+        stats = await run_due_fetches(scheduler)
+        # nothing is due until the next interval
+        assert (await run_due_fetches(scheduler)).done == 0
+
+    assert sorted(fetched) == sorted([products[0].id, products[2].id])
+    assert stats.done == 1
+    assert stats.failed == 1
+    assert scheduler.next_due() == MOCKED_TIME + 50
+
+
+@pytest.mark.asyncio
+async def test_slow_product_does_not_hold_up_the_others(database, monkeypatch):
+    monkeypatch.setattr(env, "FETCH_CONCURRENCY", 2)
+    products = [Product(id=uuid4(), name="test", description="test") for _ in range(3)]
+    async with async_session_scope() as session:
+        session.add_all(products)
+    scheduler = FetchScheduler()
+    for due, product in enumerate(products):
+        scheduler.schedule(ProductSchedule(product.id, due, 60))
+
+    release = asyncio.Event()
+    fetched = []
+
+    async def fake_fetch(product):
+        if product.id == products[0].id:
+            await release.wait()
+        fetched.append(product.id)
+        return offers(100)
+
+    stats = FetchCycleStats()
+    tasks = set()
+    with patch("src.background.fetch_products", fake_fetch):
+        assert OfferWorker.start_due_fetches(scheduler, tasks, stats) == 2
+        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+        # the slot of the fast product is reused while the slow one is still running
+        assert OfferWorker.start_due_fetches(scheduler, tasks, stats) == 1
+        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        assert fetched == [products[1].id, products[2].id]
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    assert stats.done == 3
+
+
+@pytest.mark.asyncio
+async def test_leased_fetch_cycle_extends_leases(products, monkeypatch):
+    monkeypatch.setattr(env, "FETCH_SCHEDULE", "adaptive")
+
+    async def fake_fetch(product):
+        return offers(100)
+
+    async def leases() -> set[tuple]:
+        async with async_session_scope() as session:
+            return {
+                (lease.expires_at, lease.interval)
+                for lease in await session.scalars(select(FetchLease))
+            }
+
+    with patch("src.background.fetch_products", fake_fetch):
+        stats = await OfferWorker.leased_fetch_cycle()
+        # the leases expire when the products are due again
+        assert await leases() == {(MOCKED_TIME + 60, 60)}
+
+        async with async_session_scope() as session:
+            await session.execute(update(FetchLease).values(expires_at=0))
+        await OfferWorker.leased_fetch_cycle()
+
+    # the offers did not change, so the products are fetched less often
+    assert stats.done == 3
+    assert await leases() == {(MOCKED_TIME + 90, 90)}
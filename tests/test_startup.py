@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+
+STARTUP_SCRIPT = """
+import json, sys
+
+import src.main
+src.main.create_app()
+
+from src import db
+print(json.dumps({
+    "engines": [db._engine is not None, db._async_engine is not None],
+    "drivers": [name for name in ("aiosqlite", "asyncpg") if name in sys.modules],
+}))
+"""
+
+
+def run_startup() -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        timeout=60,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_does_not_connect_to_the_database():
+    startup = run_startup()
+
+    assert startup["engines"] == [False, False]
+    assert startup["drivers"] == []
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+import src.summary as summary_module
+from src.summary import PriceSummary, summarize_offers
+
+
+def test_empty_list():
+    assert summarize_offers([], []) == PriceSummary()
+
+
+@pytest.mark.parametrize(
+    "prices, expected_median",
+    [
+        ([5, 1, 3], 3),
+        # the median of an even number of offers is the mean of the two middle ones
+        ([4, 1, 3, 2], 2.5),
+        ([7], 7),
+    ],
+)
+def test_median_of_unsorted_prices(prices, expected_median):
+    summary = summarize_offers(prices, [1] * len(prices))
+
+    assert summary.median_price == expected_median
+    assert summary.min_price == min(prices)
+    assert summary.max_price == max(prices)
+    assert summary.offer_count == len(prices)
+
+
+def test_stock_weighted_variants():
+    summary = summarize_offers([100, 200, 300], [1, 1, 8])
+
+    assert summary.avg_price == 200
+    assert summary.weighted_avg_price == (100 + 200 + 8 * 300) / 10
+    assert summary.weighted_median_price == 300
+    assert summary.total_stock == 10
+
+
+def test_nothing_in_stock():
+    summary = summarize_offers([100, 200], [0, 0])
+
+    assert summary.weighted_avg_price is None
+    assert summary.weighted_median_price is None
+    assert summary.total_stock == 0
+
+
+def test_numpy_and_python_paths_agree():
+    pytest.importorskip("numpy")
+    rng = random.Random(42)
+    prices = [rng.randint(1, 10_000) for _ in range(1001)]
+    stocks = [rng.randint(0, 50) for _ in range(1001)]
+
+    vectorized = summary_module._summarize_numpy(prices, stocks)
+    python = summary_module._summarize_python(prices, stocks)
+
+    assert vectorized.min_price == python.min_price
+    assert vectorized.max_price == python.max_price
+    assert vectorized.avg_price == pytest.approx(python.avg_price)
+    assert vectorized.median_price == python.median_price
+    assert vectorized.weighted_avg_price == pytest.approx(python.weighted_avg_price)
+    assert vectorized.weighted_median_price == python.weighted_median_price
+    assert vectorized.total_stock == python.total_stock
@@ -0,0 +1,17 @@
+import pytest
+
+from src.util import parse_bucket
+
+
+@pytest.mark.parametrize(
+    "bucket, expected",
+    [("30s", 30), ("5m", 300), ("1h", 3600), ("1d", 86400), (" 2H ", 7200)],
+)
+def test_parse_bucket(bucket, expected):
+    assert parse_bucket(bucket) == expected
+
+
+@pytest.mark.parametrize("bucket", ["", "h", "0m", "-1h", "1w", "1.5h"])
+def test_parse_bucket_invalid(bucket):
+    with pytest.raises(ValueError):
+        parse_bucket(bucket)